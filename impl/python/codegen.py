@@ -5,47 +5,54 @@ import symbols
 import itertools
 from vm import (
     Equal,
+    EqualImm,
     Insn,
     NotEqual,
-    RestoreEvalStack,
-    SaveEvalStack,
+    NotEqualImm,
     Store,
     Print,
     Label,
     Jump,
     Add,
+    AddImm,
     Mul,
+    MulImm,
     Sub,
+    SubImm,
     Div,
     LessThan,
+    LessThanImm,
     LessThanEqual,
+    LessThanEqualImm,
     GreaterThan,
+    GreaterThanImm,
     GreaterThanEqual,
+    GreaterThanEqualImm,
     JumpIfNotZero,
     JumpIfZero,
-    Load,
+    JumpIfLess,
+    JumpIfLessEq,
+    JumpIfGreater,
+    JumpIfGreaterEq,
+    JumpIfEq,
+    JumpIfNotEq,
+    LoadLocal,
+    StoreLocal,
     PushFP,
     PushImmediate,
-    PushSP,
     PushLabel,
     Negate,
     Not,
     Pop,
-    PopFP,
     PopSP,
-    JumpIndirect,
-    Call,
+    CallDirect,
+    Ret,
     Halt,
     Noop,
-    Swap,
+    AllocZero,
 )
 
-BAIL = 1             # Is bail
-NO_BAIL = 0          # Is not bail
-BAIL_FP_OFFSET = 2   # Offset from frame pointer that stores BAIL status
-RA_FP_OFFSET = 0     # Offset from frame pointer that stores the return address
 RET_FP_OFFSET = -1   # Offset from frame pointer that stores the return value
-FP_CALLER_OFFSET = 1  # Offset from frame pointer that stores the caller's addr
 
 T = TypeVar('T')
 
@@ -73,17 +80,17 @@ def _Program(ast: asts.Program) -> list[Insn]:
     ))
 
 
-def _Stmt(ast: asts.Stmt, dealloc_label: str) -> list[Insn]:
+def _Stmt(ast: asts.Stmt, func: asts.FuncDecl) -> list[Insn]:
     if isinstance(ast, asts.AssignStmt):
         return _AssignStmt(ast)
     elif isinstance(ast, asts.IfStmt):
-        return _IfStmt(ast, dealloc_label)
+        return _IfStmt(ast, func)
     elif isinstance(ast, asts.WhileStmt):
-        return _WhileStmt(ast, dealloc_label)
+        return _WhileStmt(ast, func)
     elif isinstance(ast, asts.CallStmt):
         return _CallStmt(ast)
     elif isinstance(ast, asts.CompoundStmt):
-        return _CompoundStmt(ast, dealloc_label)
+        return _CompoundStmt(ast, func)
     elif isinstance(ast, asts.PrintStmt):
         return _PrintStmt(ast)
     elif isinstance(ast, asts.ReturnStmt):
@@ -95,62 +102,22 @@ def _Stmt(ast: asts.Stmt, dealloc_label: str) -> list[Insn]:
 
 
 def callexpr_bare(func_id: asts.Id, args: list[asts.Expr], cmt=None):
+    # Omega only calls declared functions, so the callee is always known
+    # and CallDirect builds its whole frame (see vm_insns.CallDirect)
     fn_type = func_id.symbol.get_type()
     assert isinstance(fn_type, symbols.FuncType)
     param_size = fn_type.param_size
     func_name = func_id.token.value
-    alloc_sz = 5 + param_size
 
     return flatten_list((
         _cmt(cmt),
         _cmt(f"-callexpr_bare: omega/{func_name}"),
-
-        stack_malloc(
-            alloc_sz, cmt=f"alloc sz:{alloc_sz}(psz:{param_size})")[1],
-        [SaveEvalStack()],
-
-        *(assign(-2-i, rval(arg), cmt="Assign arg to memstack")
-          for i, arg in enumerate(args)),
-
-        _cmt("Initialize FP and BAIL"),
-        assign(BAIL_FP_OFFSET, [PushImmediate(NO_BAIL)], cmt="BAIL: NO_BAIL"),
-        [PushFP(0, comment="Store our old FP")],
-
-        _cmt("Assign this FP = SP - 4"),
-        [
-            PushSP(-4, "Set FP to new function scope memstack location"),
-            PopFP(),
-        ],
-
-        _cmt("Finish storing the caller's FP to the callee's frame"), [
-            *assign(FP_CALLER_OFFSET, [Swap()], "store caller's FP to FP_CALLER_OFFSET")
-        ],
-
-        _cmt(f"-Call {func_name}"),
-        [
-            PushLabel(func_label(func_id)),
-            Call(f"call {func_name}"),
-        ],
-
-        _cmt("-Epilogue: Return FP to caller, and RET as rval"),
-        _cmt("Retrieve ideal stack for processing"), [
-            *retrieve(RET_FP_OFFSET, "stack push RET"),
-        ],
-        _cmt("Set FP to caller"), [
-            *retrieve(FP_CALLER_OFFSET, "stack push FP_CALLER"),
-            PopFP("FP = FP_CALLER"),
-        ],
-
-        _cmt(f"Dealloc fsize ({alloc_sz})"),
-        [RestoreEvalStack()],
-        stack_free(alloc_sz),
-
-        _cmt("-RET as rval"), [
-            # We have already put RET right after FP_CALLER
-            # Since we popped FP_CALLER once, the thing left on the stack
-            # is the return value
-        ]
-
+        *(rval(arg) for arg in args),
+        # main is called without arguments; its parameters start out 0
+        [PushImmediate(0, "unset param")
+         for _ in range(param_size - len(args))],
+        [CallDirect(func_label(func_id), param_size, fn_type.frame_size,
+                    f"call {func_name}")],
     ))
 
 
@@ -159,15 +126,10 @@ def rval_CallExpr(ast: asts.CallExpr) -> list[Insn]:
     return callexpr_bare(ast.fn.id, ast.args)
 
 
-def _lval_offset(fp_offset: int) -> list[Insn]:
-    return [PushFP(fp_offset, comment=f"lval_offset: {fp_offset}")]
-
-
 def retrieve(fp_offset: int, cmt: Optional[str] = None) -> list[Insn]:
     return flatten_list((
         _cmt(cmt),
-        [PushFP(fp_offset)],
-        [Load()]
+        [LoadLocal(fp_offset)],
     ))
 
 
@@ -175,19 +137,22 @@ def assign(fp_offset: int, rval_insn: list[Insn], cmt: Optional[str] = None)\
         -> list[Insn]:
     return flatten_list((
         _cmt(cmt),
-        _lval_offset(fp_offset),
         rval_insn,
-        [Store()],
+        [StoreLocal(fp_offset)],
     ))
 
 
 def _AssignStmt(ast: asts.AssignStmt) -> list[Insn]:
-    # TODO: Basically this becomes lval
-    return flatten_list((
-        lval(ast.lhs),
-        rval(ast.rhs),
-        [Store()],
-    ))
+    match ast.lhs:
+        case asts.IdExpr():
+            # Variables are frame slots: store without computing the address
+            return assign(ast.lhs.id.symbol.offset, rval(ast.rhs))
+        case _:
+            return flatten_list((
+                lval(ast.lhs),
+                rval(ast.rhs),
+                [Store()],
+            ))
 
 
 def _PrintStmt(ast: asts.PrintStmt) -> list[Insn]:
@@ -199,19 +164,34 @@ def _PrintStmt(ast: asts.PrintStmt) -> list[Insn]:
     ))
 
 
-def _IfStmt(ast: asts.IfStmt, parent_dealloc: str) -> list[Insn]:
-    assert False, "IfStmt not yet supported"
-    # handle ast.expr
-    # handle ast.thenStmt
-    # handle ast.elseStmt
-    pass
+def _IfStmt(ast: asts.IfStmt, func: asts.FuncDecl) -> list[Insn]:
+    end_label = control_label([ast.expr], "if-end")
+    if ast.elseStmt is None:
+        return flatten_list((
+            control(ast.expr, end_label, False),
+            _Stmt(ast.thenStmt, func),
+            [Label(end_label)],
+        ))
+    else_label = control_label([ast.expr], "if-else")
+    return flatten_list((
+        control(ast.expr, else_label, False),
+        _Stmt(ast.thenStmt, func),
+        [Jump(end_label), Label(else_label)],
+        _Stmt(ast.elseStmt, func),
+        [Label(end_label)],
+    ))
 
 
-def _WhileStmt(ast: asts.WhileStmt, parent_dealloc: str) -> list[Insn]:
-    assert False, "WhileStmt not yet supported"
-    # handle ast.expr
-    # handle ast.stmt
-    pass
+def _WhileStmt(ast: asts.WhileStmt, func: asts.FuncDecl) -> list[Insn]:
+    # Test at the bottom so that each iteration takes a single branch
+    top_label = control_label([ast.expr], "while-top")
+    test_label = control_label([ast.expr], "while-test")
+    return flatten_list((
+        [Jump(test_label), Label(top_label)],
+        _Stmt(ast.stmt, func),
+        [Label(test_label)],
+        control(ast.expr, top_label, True),
+    ))
 
 
 def _ctrl_lit(literal: bool, label: str, sense: bool) -> list[Insn]:
@@ -234,7 +214,10 @@ def control(e: asts.Expr, label: str, sense: bool) -> list[Insn]:
         case asts.IdExpr():
             return control_IdExpr(e, label, sense)
         case _:
-            assert False, f"Missing handler for {e}"
+            return flatten_list((
+                rval(e),
+                [JumpIfNotZero(label) if sense else JumpIfZero(label)],
+            ))
 
 
 def control_IdExpr(e: asts.IdExpr, label: str, sense: bool) -> list[Insn]:
@@ -281,21 +264,43 @@ def _ctrl_bin(left: asts.Expr, right: asts.Expr, op_kind: str, label: str,
 
 
 def control_BinaryOp(e: asts.BinaryOp, label: str, sense: bool) -> list[Insn]:
-    match (e.op.kind, sense):
+    match e.op.kind:
         case "and":
             return _ctrl_bin(e.left, e.right, "and", label, sense)
         case "or":
             return _ctrl_bin(e.left, e.right, "or", label, sense)
-        case ">":
-            assert False, "Not yet supported"
-        case ">=":
-            assert False, "Not yet supported"
+        case "<" | "<=" | ">" | ">=" | "==" | "!=":
+            return _ctrl_cmp(e, label, sense)
+        case _:
+            return flatten_list((
+                rval(e),
+                [JumpIfNotZero(label) if sense else JumpIfZero(label)],
+            ))
+
+
+_NEGATED_CMP = {"<": ">=", "<=": ">", ">": "<=", ">=": "<", "==": "!=",
+                "!=": "=="}
+
+
+def _ctrl_cmp(e: asts.BinaryOp, label: str, sense: bool) -> list[Insn]:
+    # One fused compare-and-branch instead of a compare and a JumpIfZero
+    op_kind = e.op.kind if sense else _NEGATED_CMP[e.op.kind]
+    match op_kind:
         case "<":
-            assert False, "Not yet supported"
+            jump = JumpIfLess(label)
         case "<=":
-            assert False, "Not yet supported"
+            jump = JumpIfLessEq(label)
+        case ">":
+            jump = JumpIfGreater(label)
+        case ">=":
+            jump = JumpIfGreaterEq(label)
+        case "==":
+            jump = JumpIfEq(label)
+        case "!=":
+            jump = JumpIfNotEq(label)
         case _:
-            assert False, f"Missing handler for {e.op.kind}"
+            assert False, f"Unreachable: bad op_kind: {op_kind}"
+    return flatten_list((rval(e.left), rval(e.right), [jump]))
 
 
 def control_UnaryOp(e: asts.UnaryOp, label: str, sense: bool) -> list[Insn]:
@@ -315,48 +320,19 @@ def _CallStmt(ast: asts.CallStmt) -> list[Insn]:
     ))
 
 
-def option_unwrap_or(opt: Optional[T], default: T) -> T:
-    return opt if opt is not None else default
-
-
-def stack_malloc(atomic_sz: int, cmt=None) -> tuple[int, list[Insn]]:
-    return (atomic_sz, _cmt(cmt) + [PushImmediate(0)] * atomic_sz)
-
-
-def stack_calloc(ty: symbols.Type, elem_cnt: int, imm: Optional[int] = None) \
-        -> tuple[int, list[Insn]]:
-    atomic_sz = (ty.size() * elem_cnt)
-    return (atomic_sz, [PushImmediate(option_unwrap_or(imm, 0))] * atomic_sz)
-
-
-def stack_free(atomic_sz: int, cmt=None) -> list[Insn]:
-    return _cmt(cmt) + [Pop()] * atomic_sz
-
-
 def _cmt(cmt: Optional[str]) -> list[Insn]:
     return [Noop(line.strip()) for line in cmt.strip().splitlines()] \
         if cmt else []
 
 
-def _CompoundStmt(ast: asts.CompoundStmt, parent_dealloc: str, cmt=None) -> list[Insn]:
-    # TODO: Revise to v2 func call
-    my_dealloc_label = f"dealloc-{scope_label(ast.local_scope)}"
-
-    stmts = (_Stmt(stmt, my_dealloc_label) for stmt in ast.stmts)
-    isns_stmts = flatten_list(stmt for stmt in stmts)
+def _CompoundStmt(ast: asts.CompoundStmt, func: asts.FuncDecl, cmt=None) -> list[Insn]:
+    # Locals of every scope live in the frame CallDirect allocated, so a
+    # scope has nothing to release on exit
+    isns_stmts = flatten_list(_Stmt(stmt, func) for stmt in ast.stmts)
 
-    isns_return = _ReturnStmt(ast.return_stmt, my_dealloc_label) \
+    isns_return = _ReturnStmt(ast.return_stmt, func) \
         if ast.return_stmt else []
 
-    isns_bail = flatten_list((
-        stack_peek("Peak BAIL"),
-        [
-            JumpIfNotZero(parent_dealloc)
-        ]
-    ))
-
-    # TODO: func call allocate all space needed by all variables
-
     return flatten_list((
         _cmt("""
         +--------------+
@@ -371,124 +347,70 @@ def _CompoundStmt(ast: asts.CompoundStmt, parent_dealloc: str, cmt=None) -> list
         """),
         isns_stmts,
         isns_return,
-        [Label(my_dealloc_label)],
-        isns_bail
     ))
 
 
 def _FuncDecl(ast: asts.FuncDecl) -> list[Insn]:
-    # TODO: Revise to v2 func call
-
-    # TODO: func decl allocate all the space necessary for all vars
-    func_type = ast.id.symbol.get_type()
-    assert isinstance(func_type, symbols.FuncType)
-    frame_size = func_type.frame_size
-    func_done = f"{func_label(ast.id)}-bail"
-    # handle ast.body
-    # ast.params is handled by callee
-    ret_isns = [
-        JumpIndirect()
-    ]
-
+    # CallDirect has already allocated the frame, locals included
     return flatten_list((
         [Label(func_label(ast.id))],
-        _cmt("Store RA to memstack"),
-        assign(RA_FP_OFFSET, [Swap()]),
-        stack_malloc(frame_size, "allocate func vars")[1],
-        [SaveEvalStack("Allocate func vars to memstack")],
-        _CompoundStmt(ast.body, func_done, cmt="The main exec of func"),
+        _CompoundStmt(ast.body, ast, cmt="The main exec of func"),
         [
-            Label(func_done),
+            Label(ret_label(ast)),
+            Ret(),
         ],
-        [RestoreEvalStack("Dealloc func vars from memstack")],
-        stack_free(frame_size),
-        retrieve(RA_FP_OFFSET),
-        [
-            JumpIndirect()
-        ]
     ))
 
 
-def stack_emplace(imm: Optional[int] = None) -> list[Insn]:
-    """
-    Moves the value of TOS to SP and increase SP by one
-    The original value at TOS is popped by the end of this call
-    """
-
+def _ReturnStmt(ast: asts.ReturnStmt, func: asts.FuncDecl) -> list[Insn]:
+    # The eval stack is empty between statements and Ret pops the whole
+    # frame, so returning from any depth is a jump to the epilogue
+    if isinstance(ast.expr, asts.CallExpr) and _is_tail_call(ast.expr, func):
+        return _tail_call(ast.expr, func)
     return flatten_list((
-        [] if imm is None else [PushImmediate(imm)],
-        [
-            PushSP(0, "Push retval to stack"),
-            Swap(),
-            Store("Assign value of retval to stack"),
-            PushSP(1, "Move stack pointer forward to preserve RET"),
-            PopSP(),
-        ],
+        _cmt("return"+("" if not ast.expr else " expr")),
+        assign(RET_FP_OFFSET, rval(ast.expr), "store RET")
+        if ast.expr is not None else [],
+        [Jump(ret_label(func), "return")],
     ))
 
 
-def stack_push() -> list[Insn]:
-    """
-    Copies the value of TOS to SP and increase SP by one.
-    The value of TOS at the end of this call remains the same
-    """
-    return [
-        PushSP(0, "Push retval to stack"),
-        Swap(),
-        Store("Assign value of retval to stack"),
-        PushSP(0, "Prepare to duplicate"),
-        Load("Duplicate value back"),
-        PushSP(1, "Move stack pointer forward to preserve RET"),
-        PopSP()
-    ]
+def _is_tail_call(call: asts.CallExpr, func: asts.FuncDecl) -> bool:
+    # The callee's arguments have to fit where ours are
+    callee = call.fn.id.symbol.get_type()
+    caller = func.id.symbol.get_type()
+    assert isinstance(callee, symbols.FuncType)
+    assert isinstance(caller, symbols.FuncType)
+    return callee.param_size <= caller.param_size
 
 
-def stack_peek(cmt=None) -> list[Insn]:
+def _tail_call(call: asts.CallExpr, func: asts.FuncDecl) -> list[Insn]:
+    """
+    `return g(...)` in the frame of the current function: Ret only uses
+    FP-1..FP+2 (see vm_insns.CallDirect), so g's arguments can overwrite
+    ours, its zeroed locals replace ours, and g then returns its RET
+    straight to our caller.
+    """
+    callee = call.fn.id.symbol.get_type()
+    caller = func.id.symbol.get_type()
+    assert isinstance(callee, symbols.FuncType)
+    assert isinstance(caller, symbols.FuncType)
+    name = call.fn.id.token.value
     return flatten_list((
-        _cmt(cmt),
-        [
-            PushSP(-1),
-            Load()
-        ],
-
+        _cmt(f"return tail call: omega/{name}"),
+        *(rval(arg) for arg in call.args),
+        [PushImmediate(0, "unset param")
+         for _ in range(callee.param_size - len(call.args))],
+        # Arg i lives at FP-2-i and the last one is on top
+        [StoreLocal(-2 - i, f"{name} arg {i}")
+         for i in reversed(range(callee.param_size))],
+        [PushFP(3, "drop our locals"), PopSP()] if caller.frame_size else [],
+        [AllocZero(callee.frame_size, f"{name} locals")]
+        if callee.frame_size else [],
+        [Jump(func_label(call.fn.id), f"tail call {name}")],
     ))
 
 
-def stack_pop_retrieve(cmt=None) -> list[Insn]:
-    return [
-        *_cmt(cmt),
-        PushSP(-1),
-        Load(),
-        PushSP(-1, "Decrement SP to pop"),
-        PopSP(),
-    ]
-
-
-def stack_pop(cmt: Optional[str] = None) -> list[Insn]:
-    return [
-        *_cmt(cmt),
-        PushSP(-1, "Decrement SP"),
-        PopSP()
-    ]
-
-
-def _ReturnStmt(ast: asts.ReturnStmt, dealloc_label: str) -> list[Insn]:
-    isns_expr = _cmt("return"+("" if not ast.expr else " expr"))
-    if ast.expr is not None:
-        # rval and store return value
-        isns_expr = []
-        isns_expr.extend(assign(RET_FP_OFFSET, rval(ast.expr), "store RET"))
-
-    # mark BAIL
-    isns_expr.extend(assign(BAIL_FP_OFFSET, [PushImmediate(BAIL)], "set BAIL"))
-    # jump to the dealloc section of the enclosing scope
-    isns_expr.extend([
-        PushLabel(dealloc_label),
-        JumpIndirect()
-    ])
-    return isns_expr
-
-
 def lval(e: asts.Expr) -> list[Insn]:
     match e:
         case asts.IdExpr():
@@ -536,8 +458,8 @@ def func_label(e: asts.Id) -> str:
     return f"fn_{e.token.value}{_TypeString(e.symbol.get_type(), e.token.coord)}"
 
 
-def scope_label(s: symbols.Scope) -> str:
-    return f"scope_{hex(hash(id(s)))}"
+def ret_label(func: asts.FuncDecl) -> str:
+    return f"{func_label(func.id)}-ret"
 
 
 def control_label(args: list[asts.Expr], keyword: Optional[str]) -> str:
@@ -571,10 +493,7 @@ def rval(e: asts.Expr) -> list[Insn]:
                 case _:
                     offset = e.id.symbol.offset
                     name = e.id.token.value
-                    return [
-                        PushFP(offset, f"Accessing {name}@{offset}"),
-                        Load()
-                    ]
+                    return [LoadLocal(offset, f"Accessing {name}@{offset}")]
         case asts.ArrayCell(arr=_, idx=_):
             error.error("rval(ArrayCell) is currently not supported.", e.coord)
         case asts.IntLiteral(token=token):
@@ -587,7 +506,52 @@ def rval(e: asts.Expr) -> list[Insn]:
             assert False, f"rval() not implemented for {type(e)}"
 
 
+def int_constant(e: asts.Expr) -> Optional[int]:
+    """The value of e if it is an integer constant, otherwise None."""
+    match e:
+        case asts.IntLiteral(token=token):
+            return int(token.value)
+        case asts.UnaryOp() if e.op.kind == "-":
+            value = int_constant(e.expr)
+            return None if value is None else -value
+        case _:
+            return None
+
+
+_IMM_OPS: dict[str, type] = {
+    "+": AddImm,
+    "-": SubImm,
+    "*": MulImm,
+    "<": LessThanImm,
+    "<=": LessThanEqualImm,
+    ">": GreaterThanImm,
+    ">=": GreaterThanEqualImm,
+    "==": EqualImm,
+    "!=": NotEqualImm,
+}
+
+# k op x == x swapped-op k, for the ops that have an immediate form
+_SWAPPED_OPS = {"+": "+", "*": "*", "<": ">", "<=": ">=", ">": "<",
+                ">=": "<=", "==": "==", "!=": "!="}
+
+
+def _rval_imm(e: asts.BinaryOp) -> Optional[list[Insn]]:
+    # x op k as x followed by one immediate-operand instruction, saving the
+    # PushImmediate
+    right = int_constant(e.right)
+    if right is not None and e.op.kind in _IMM_OPS:
+        return flatten_list((rval(e.left), [_IMM_OPS[e.op.kind](right)]))
+    left = int_constant(e.left)
+    if left is not None and e.op.kind in _SWAPPED_OPS:
+        op_kind = _SWAPPED_OPS[e.op.kind]
+        return flatten_list((rval(e.right), [_IMM_OPS[op_kind](left)]))
+    return None
+
+
 def rval_BinaryOp(e: asts.BinaryOp) -> list[Insn]:
+    imm = _rval_imm(e)
+    if imm is not None:
+        return imm
     rval_both = (rval(e.left), rval(e.right))
     match e.op.kind:
         case "+":
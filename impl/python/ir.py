@@ -0,0 +1,405 @@
+"""
+Three-address intermediate representation between the decorated AST and
+VM instructions.
+
+A Program is a set of Functions. A Function is a list of basic Blocks in
+layout order, the first being its entry. A Block is straight-line
+instructions followed by one terminator (Jump, Branch or Return), and the
+terminators' targets form the function's control-flow graph.
+
+Operands are:
+
+    Temp(n)         t<n>, a compiler temporary local to its function
+    Const(v)        an integer (booleans are 0 and 1)
+    Var(off, name)  a frame slot: a parameter (off < 0) or local (off >= 3)
+                    at FP + off, as assigned by offsets.program
+    FuncRef(label)  the address of a function
+
+Temps may be assigned in more than one block (the two arms of an `and` in
+value context both set its result) but must be assigned on every path to
+each of their uses. irgen builds a Program from the AST, irlower turns one
+into vm_insns.
+"""
+from typing import NamedTuple, Optional, Union
+
+
+def _same_kind_eq(self, other) -> bool:
+    return type(other) is type(self) and tuple.__eq__(self, other)
+
+
+def _same_kind_ne(self, other) -> bool:
+    return not _same_kind_eq(self, other)
+
+
+class Temp(NamedTuple):
+    id: int
+
+    # As plain tuples Temp(3) == Const(3)
+    __eq__ = _same_kind_eq
+    __ne__ = _same_kind_ne
+    __hash__ = tuple.__hash__
+
+    def __str__(self):
+        return f"t{self.id}"
+
+
+class Const(NamedTuple):
+    value: int
+
+    __eq__ = _same_kind_eq
+    __ne__ = _same_kind_ne
+    __hash__ = tuple.__hash__
+
+    def __str__(self):
+        return str(self.value)
+
+
+class Var(NamedTuple):
+    offset: int
+    name: str
+
+    def __str__(self):
+        return f"{self.name}@{self.offset}"
+
+
+class FuncRef(NamedTuple):
+    label: str
+
+    def __str__(self):
+        return f"&{self.label}"
+
+
+Operand = Union[Temp, Const, Var, FuncRef]
+Dest = Union[Temp, Var]
+
+BINARY_OPS = ("+", "-", "*", "/", "<", "<=", ">", ">=", "==", "!=")
+COMPARE_OPS = ("<", "<=", ">", ">=", "==", "!=")
+UNARY_OPS = ("-", "not")
+
+
+class Move:
+    """dst = src"""
+
+    def __init__(self, dst: Dest, src: Operand):
+        self.dst: Dest = dst
+        self.src: Operand = src
+
+
+class BinOp:
+    """dst = left op right; comparisons produce 0 or 1, / floors"""
+
+    def __init__(self, dst: Dest, op: str, left: Operand, right: Operand):
+        self.dst: Dest = dst
+        self.op: str = op
+        self.left: Operand = left
+        self.right: Operand = right
+
+
+class UnOp:
+    """dst = op operand"""
+
+    def __init__(self, dst: Dest, op: str, operand: Operand):
+        self.dst: Dest = dst
+        self.op: str = op
+        self.operand: Operand = operand
+
+
+class Call:
+    """[dst =] call func(args); without dst the result is discarded"""
+
+    def __init__(self, dst: Optional[Dest], func: str, args: list[Operand]):
+        self.dst: Optional[Dest] = dst
+        self.func: str = func
+        self.args: list[Operand] = args
+
+
+class Print:
+    """print value"""
+
+    def __init__(self, value: Operand):
+        self.value: Operand = value
+
+
+class Jump:
+    """goto target"""
+
+    def __init__(self, target: str):
+        self.target: str = target
+
+
+class Branch:
+    """if left op right goto if_true else goto if_false"""
+
+    def __init__(self, op: str, left: Operand, right: Operand, if_true: str,
+                 if_false: str):
+        self.op: str = op
+        self.left: Operand = left
+        self.right: Operand = right
+        self.if_true: str = if_true
+        self.if_false: str = if_false
+
+
+class Return:
+    """return [value]"""
+
+    def __init__(self, value: Optional[Operand] = None):
+        self.value: Optional[Operand] = value
+
+
+Insn = Union[Move, BinOp, UnOp, Call, Print]
+Terminator = Union[Jump, Branch, Return]
+
+
+class Block:
+    def __init__(self, label: str):
+        self.label: str = label
+        self.insns: list[Insn] = []
+        self.term: Optional[Terminator] = None
+
+    @property
+    def successors(self) -> list[str]:
+        match self.term:
+            case Jump(target=target):
+                return [target]
+            case Branch(if_true=if_true, if_false=if_false):
+                return [if_true] if if_true == if_false \
+                    else [if_true, if_false]
+            case _:
+                return []
+
+
+class Function:
+    def __init__(self, name: str, label: str, param_size: int,
+                 frame_size: int, returns_value: bool):
+        self.name: str = name
+        self.label: str = label
+        self.param_size: int = param_size
+        self.frame_size: int = frame_size
+        self.returns_value: bool = returns_value
+        self.blocks: dict[str, Block] = {}
+        self.temps: int = 0
+
+    @property
+    def entry(self) -> Block:
+        return next(iter(self.blocks.values()))
+
+    def new_temp(self) -> Temp:
+        self.temps += 1
+        return Temp(self.temps - 1)
+
+    def predecessors(self) -> dict[str, list[str]]:
+        preds: dict[str, list[str]] = {label: [] for label in self.blocks}
+        for block in self.blocks.values():
+            for succ in block.successors:
+                preds[succ].append(block.label)
+        return preds
+
+    def reverse_postorder(self) -> list[Block]:
+        """The blocks reachable from the entry, in reverse postorder."""
+        order: list[Block] = []
+        seen = {self.entry.label}
+        stack = [(self.entry, iter(self.entry.successors))]
+        while stack:
+            block, succs = stack[-1]
+            for succ in succs:
+                if succ not in seen:
+                    seen.add(succ)
+                    stack.append((self.blocks[succ],
+                                  iter(self.blocks[succ].successors)))
+                    break
+            else:
+                stack.pop()
+                order.append(block)
+        order.reverse()
+        return order
+
+
+class Program:
+    def __init__(self):
+        self.functions: dict[str, Function] = {}
+        self.main: Optional[str] = None     # label of main, if any
+
+
+def remove_unreachable(f: Function) -> bool:
+    """
+    Delete the blocks of f that cannot be reached from its entry, keeping
+    the layout order of the rest. Returns whether any were deleted.
+    """
+    reachable = {block.label for block in f.reverse_postorder()}
+    dead = [label for label in f.blocks if label not in reachable]
+    for label in dead:
+        del f.blocks[label]
+    return bool(dead)
+
+
+def operands(insn: Union[Insn, Terminator]) -> list[Operand]:
+    """The operands insn reads, in evaluation order."""
+    match insn:
+        case Move(src=src):
+            return [src]
+        case BinOp(left=left, right=right) | Branch(left=left, right=right):
+            return [left, right]
+        case UnOp(operand=operand):
+            return [operand]
+        case Call(args=args):
+            return list(args)
+        case Print(value=value):
+            return [value]
+        case Return(value=value):
+            return [] if value is None else [value]
+        case _:
+            return []
+
+
+def dest(insn: Union[Insn, Terminator]) -> Optional[Dest]:
+    """The operand insn writes, if any."""
+    match insn:
+        case Move(dst=dst) | BinOp(dst=dst) | UnOp(dst=dst) | Call(dst=dst):
+            return dst
+        case _:
+            return None
+
+
+# Printer
+
+def format_insn(insn: Union[Insn, Terminator]) -> str:
+    match insn:
+        case Move(dst=dst, src=src):
+            return f"{dst} = {src}"
+        case BinOp(dst=dst, op=op, left=left, right=right):
+            return f"{dst} = {left} {op} {right}"
+        case UnOp(dst=dst, op=op, operand=operand):
+            return f"{dst} = {op}{' ' if op == 'not' else ''}{operand}"
+        case Call(dst=dst, func=func, args=args):
+            call = f"call {func}({', '.join(str(a) for a in args)})"
+            return call if dst is None else f"{dst} = {call}"
+        case Print(value=value):
+            return f"print {value}"
+        case Jump(target=target):
+            return f"goto {target}"
+        case Branch(op=op, left=left, right=right, if_true=if_true,
+                    if_false=if_false):
+            return f"if {left} {op} {right} goto {if_true} else {if_false}"
+        case Return(value=value):
+            return "return" if value is None else f"return {value}"
+        case _:
+            assert False, f"format_insn() not implemented for {type(insn)}"
+
+
+def format_function(f: Function) -> str:
+    lines = [f"func {f.label} (params {f.param_size}, frame {f.frame_size}"
+             f"{', returns value' if f.returns_value else ''}):"]
+    for block in f.blocks.values():
+        lines.append(f"  {block.label}:")
+        lines.extend(f"    {format_insn(insn)}" for insn in block.insns)
+        lines.append("    " + ("<no terminator>" if block.term is None
+                               else format_insn(block.term)))
+    return "\n".join(lines)
+
+
+def format_program(p: Program) -> str:
+    header = f"main: {p.main}" if p.main is not None else "main: none"
+    return "\n\n".join([header, *(format_function(f)
+                                  for f in p.functions.values())])
+
+
+# Verifier
+
+class IRError(Exception):
+    def __init__(self, function: str, block: Optional[str], reason: str):
+        where = function if block is None else f"{function}:{block}"
+        super().__init__(f"[{where}] {reason}")
+        self.function = function
+        self.block = block
+        self.reason = reason
+
+
+def verify(p: Program):
+    """
+    Check that p is well formed: every block is terminated and branches to
+    blocks of its own function, operators and call arities are valid, Vars
+    lie inside their function's frame, and every Temp is assigned on all
+    paths to each use. Raises IRError on the first problem found.
+    """
+    if p.main is not None and p.main not in p.functions:
+        raise IRError(p.main, None, "main is not a function of the program")
+    for f in p.functions.values():
+        _verify_function(p, f)
+
+
+def _verify_function(p: Program, f: Function):
+    if not f.blocks:
+        raise IRError(f.label, None, "function has no blocks")
+    for block in f.blocks.values():
+        def fail(reason: str):
+            raise IRError(f.label, block.label, reason)
+
+        if block.term is None:
+            fail("block has no terminator")
+        for succ in block.successors:
+            if succ not in f.blocks:
+                fail(f"branch to unknown block {succ}")
+        for insn in [*block.insns, block.term]:
+            match insn:
+                case BinOp(op=op) if op not in BINARY_OPS:
+                    fail(f"bad binary operator {op}")
+                case UnOp(op=op) if op not in UNARY_OPS:
+                    fail(f"bad unary operator {op}")
+                case Branch(op=op) if op not in COMPARE_OPS:
+                    fail(f"bad branch operator {op}")
+                case Call(func=func, args=args):
+                    callee = p.functions.get(func)
+                    if callee is None:
+                        fail(f"call to unknown function {func}")
+                    elif len(args) != callee.param_size:
+                        fail(f"{func} takes {callee.param_size} "
+                             f"argument(s), got {len(args)}")
+                case Return(value=value) \
+                        if value is not None and not f.returns_value:
+                    fail("void function returns a value")
+            for operand in [*operands(insn), dest(insn)]:
+                if isinstance(operand, Var) and not (
+                        -1 - f.param_size <= operand.offset <= -2
+                        or 3 <= operand.offset < 3 + f.frame_size):
+                    fail(f"{operand} is outside the frame")
+                if isinstance(operand, Temp) and operand.id >= f.temps:
+                    fail(f"{operand} was not allocated by the function")
+    _verify_temps(f)
+
+
+def _verify_temps(f: Function):
+    # Forward must-analysis: temps assigned on every path into a block
+    everything = frozenset(Temp(n) for n in range(f.temps))
+    assigned_in: dict[str, frozenset[Temp]] = {
+        label: everything for label in f.blocks}
+    assigned_in[f.entry.label] = frozenset()
+    preds = f.predecessors()
+    order = f.reverse_postorder()
+    changed = True
+    while changed:
+        changed = False
+        for block in order:
+            if block is not f.entry:
+                ins = [_assigned_out(f.blocks[pred], assigned_in[pred])
+                       for pred in preds[block.label]]
+                new = frozenset.intersection(*ins) if ins else frozenset()
+                if new != assigned_in[block.label]:
+                    assigned_in[block.label] = new
+                    changed = True
+    for block in order:
+        assigned = set(assigned_in[block.label])
+        for insn in [*block.insns, block.term]:
+            for operand in operands(insn):
+                if isinstance(operand, Temp) and operand not in assigned:
+                    raise IRError(f.label, block.label,
+                                  f"{operand} may be used before it is "
+                                  f"assigned: {format_insn(insn)}")
+            dst = dest(insn)
+            if isinstance(dst, Temp):
+                assigned.add(dst)
+
+
+def _assigned_out(block: Block, assigned_in: frozenset[Temp]) \
+        -> frozenset[Temp]:
+    return assigned_in | {dst for insn in block.insns
+                          if isinstance(dst := dest(insn), Temp)}
@@ -0,0 +1,313 @@
+"""
+Constant folding and algebraic simplification of the IR.
+
+Operations on constants are evaluated at compile time with the VM's
+semantics: / floors, comparisons and `not` give 0 or 1. A result is only
+folded when it fits in an int64, so the program behaves the same under
+every vm_arith mode, and division by zero is left for the VM to report.
+
+Simplifications (IR operands have no side effects, calls being separate
+instructions):
+
+    x + 0, 0 + x, x - 0, x * 1, 1 * x, x / 1  ->  x
+    x * 0, 0 * x, x - x                       ->  0  (x pure, see below)
+    0 - x                                     ->  -x
+    - - x, not not b                          ->  x, b
+    not (x < y)                               ->  x >= y (and so on)
+
+The last two, and branches on `t != 0` or `t == 0` for a comparison or
+`not` t, look through a temp assigned earlier in the same block, provided
+no frame slot it reads is assigned in between. Branches on constants
+become jumps, and blocks no longer reachable are dropped along with the
+instructions computing unused temps.
+
+The arithmetic mode is only chosen when the program runs, so an
+instruction that could raise a VM error under some mode (a division by
+anything but a constant other than 0 and -1, or +, -, * and negation that
+may overflow under trap) is never dropped, and the identities giving 0
+only apply to an x that is a constant, a frame slot or a temp whose every
+assignment cannot raise (or is a call, which stays).
+"""
+from typing import Optional
+
+import ir
+from vm_arith import INT64_MIN, INT64_MAX
+
+_NEGATED = {"<": ">=", "<=": ">", ">": "<=", ">=": "<", "==": "!=",
+            "!=": "=="}
+
+
+def evaluate(op: str, x: int, y: int) -> Optional[int]:
+    """x op y as the VM computes it, or None if it cannot be folded."""
+    match op:
+        case "+":
+            result = x + y
+        case "-":
+            result = x - y
+        case "*":
+            result = x * y
+        case "/":
+            if y == 0:
+                return None
+            result = x // y
+        case "<":
+            return int(x < y)
+        case "<=":
+            return int(x <= y)
+        case ">":
+            return int(x > y)
+        case ">=":
+            return int(x >= y)
+        case "==":
+            return int(x == y)
+        case "!=":
+            return int(x != y)
+        case _:
+            assert False, f"evaluate() not implemented for {op}"
+    return result if INT64_MIN <= result <= INT64_MAX else None
+
+
+def evaluate_unary(op: str, x: int) -> Optional[int]:
+    match op:
+        case "-":
+            return -x if INT64_MIN <= -x <= INT64_MAX else None
+        case "not":
+            return int(x == 0)
+        case _:
+            assert False, f"evaluate_unary() not implemented for {op}"
+
+
+# This is the entry point of the pass.
+def program(p: ir.Program):
+    for f in p.functions.values():
+        function(f)
+
+
+def function(f: ir.Function):
+    changed = True
+    while changed:
+        changed = False
+        consts = _constant_temps(f)
+        pure = _pure_temps(f)
+        for block in f.blocks.values():
+            changed |= _fold_block(block, consts, pure)
+        changed |= ir.remove_unreachable(f)
+        changed |= remove_dead_temps(f)
+
+
+def _constant_temps(f: ir.Function) -> dict[ir.Temp, ir.Const]:
+    """Temps whose only assignment is a constant."""
+    assigned: dict[ir.Temp, list[ir.Insn]] = {}
+    for block in f.blocks.values():
+        for insn in block.insns:
+            dst = ir.dest(insn)
+            if isinstance(dst, ir.Temp):
+                assigned.setdefault(dst, []).append(insn)
+    return {t: insns[0].src for t, insns in assigned.items()
+            if len(insns) == 1 and isinstance(insns[0], ir.Move)
+            and isinstance(insns[0].src, ir.Const)}
+
+
+def may_raise(insn: ir.Insn) -> bool:
+    """
+    Whether insn can raise a VM error under some vm_arith mode. Calls are
+    assumed to, whatever the callee does.
+    """
+    match insn:
+        case ir.Move() | ir.Print():
+            return False
+        case ir.BinOp(op="/", right=ir.Const(value=y)):
+            # Division by zero, or INT64_MIN / -1 under trap
+            return y in (0, -1)
+        case ir.BinOp(op="+" | "-" | "*" as op, left=ir.Const(value=x),
+                      right=ir.Const(value=y)):
+            return evaluate(op, x, y) is None
+        case ir.BinOp(op=op):
+            return op not in ir.COMPARE_OPS
+        case ir.UnOp(op="-", operand=ir.Const(value=x)):
+            return evaluate_unary("-", x) is None
+        case ir.UnOp(op=op):
+            return op == "-"
+        case _:
+            return True
+
+
+def _pure_temps(f: ir.Function) -> set[ir.Temp]:
+    """Temps that dropping a use of cannot drop a VM error: no assignment
+    of them may raise, calls aside since they are never dropped."""
+    impure: set[ir.Temp] = set()
+    assigned: set[ir.Temp] = set()
+    for block in f.blocks.values():
+        for insn in block.insns:
+            dst = ir.dest(insn)
+            if isinstance(dst, ir.Temp):
+                assigned.add(dst)
+                if may_raise(insn) and not isinstance(insn, ir.Call):
+                    impure.add(dst)
+    return assigned - impure
+
+
+def _fold_block(block: ir.Block, consts: dict[ir.Temp, ir.Const],
+                pure: set[ir.Temp]) -> bool:
+    changed = False
+    for i, insn in enumerate(block.insns):
+        changed |= _substitute(insn, consts)
+        new = _simplify(insn, block, i, pure)
+        if new is not None:
+            block.insns[i] = new
+            changed = True
+    changed |= _substitute(block.term, consts)
+    new_term = _simplify_branch(block.term, block)
+    if new_term is not None:
+        block.term = new_term
+        changed = True
+    return changed
+
+
+def _substitute(insn, consts: dict[ir.Temp, ir.Const]) -> bool:
+    def const(op: ir.Operand) -> ir.Operand:
+        return consts.get(op, op) if isinstance(op, ir.Temp) else op
+
+    before = ir.operands(insn)
+    match insn:
+        case ir.Move():
+            insn.src = const(insn.src)
+        case ir.BinOp() | ir.Branch():
+            insn.left = const(insn.left)
+            insn.right = const(insn.right)
+        case ir.UnOp():
+            insn.operand = const(insn.operand)
+        case ir.Call():
+            insn.args = [const(arg) for arg in insn.args]
+        case ir.Print():
+            insn.value = const(insn.value)
+        case ir.Return() if insn.value is not None:
+            insn.value = const(insn.value)
+    return ir.operands(insn) != before
+
+
+def _defining(block: ir.Block, temp: ir.Operand, before: int) \
+        -> Optional[ir.Insn]:
+    """
+    The instruction assigning temp earlier in block (before index `before`),
+    if the frame slots it reads are not assigned between it and `before`.
+    """
+    if not isinstance(temp, ir.Temp):
+        return None
+    for i in range(before - 1, -1, -1):
+        if ir.dest(block.insns[i]) == temp:
+            reads = {op for op in ir.operands(block.insns[i])
+                     if isinstance(op, ir.Var)}
+            if any(ir.dest(insn) in reads
+                   for insn in block.insns[i + 1:before]):
+                return None
+            return block.insns[i]
+    return None
+
+
+def _simplify(insn: ir.Insn, block: ir.Block, index: int,
+              pure: set[ir.Temp]) -> Optional[ir.Insn]:
+    match insn:
+        case ir.BinOp(dst=dst, op=op, left=ir.Const(value=x),
+                      right=ir.Const(value=y)):
+            value = evaluate(op, x, y)
+            return None if value is None else ir.Move(dst, ir.Const(value))
+        case ir.BinOp(dst=dst, op=op, left=left, right=right):
+            return _identity(dst, op, left, right, pure)
+        case ir.UnOp(dst=dst, op=op, operand=ir.Const(value=x)):
+            value = evaluate_unary(op, x)
+            return None if value is None else ir.Move(dst, ir.Const(value))
+        case ir.UnOp(dst=dst, op=op, operand=operand):
+            inner = _defining(block, operand, index)
+            match inner:
+                case ir.UnOp(op=inner_op, operand=x) if inner_op == op:
+                    return ir.Move(dst, x)
+                case ir.BinOp(op=cmp, left=x, right=y) \
+                        if op == "not" and cmp in _NEGATED:
+                    return ir.BinOp(dst, _NEGATED[cmp], x, y)
+    return None
+
+
+def _identity(dst: ir.Dest, op: str, left: ir.Operand, right: ir.Operand,
+              pure: set[ir.Temp]) -> Optional[ir.Insn]:
+    zero, one = ir.Const(0), ir.Const(1)
+
+    def droppable(x: ir.Operand) -> bool:
+        return not isinstance(x, ir.Temp) or x in pure
+
+    match op:
+        case "+" if right == zero:
+            return ir.Move(dst, left)
+        case "+" if left == zero:
+            return ir.Move(dst, right)
+        case "-" if right == zero:
+            return ir.Move(dst, left)
+        case "-" if left == zero:
+            return ir.UnOp(dst, "-", right)
+        case "-" if left == right and droppable(left):
+            return ir.Move(dst, zero)
+        case "*" if right == one:
+            return ir.Move(dst, left)
+        case "*" if left == one:
+            return ir.Move(dst, right)
+        case "*" if right == zero and droppable(left) \
+                or left == zero and droppable(right):
+            return ir.Move(dst, zero)
+        case "/" if right == one:
+            return ir.Move(dst, left)
+    return None
+
+
+def _simplify_branch(term: ir.Terminator, block: ir.Block) \
+        -> Optional[ir.Terminator]:
+    match term:
+        case ir.Branch(if_true=if_true, if_false=if_false) \
+                if if_true == if_false:
+            return ir.Jump(if_true)
+        case ir.Branch(op=op, left=ir.Const(value=x),
+                       right=ir.Const(value=y)):
+            return ir.Jump(term.if_true if evaluate(op, x, y)
+                           else term.if_false)
+        case ir.Branch(op="!=" | "==", left=left, right=ir.Const(value=0)):
+            # Branch on what a boolean temp was computed from
+            sense = term.op == "!="
+            inner = _defining(block, left, len(block.insns))
+            match inner:
+                case ir.BinOp(op=cmp, left=x, right=y) if cmp in _NEGATED:
+                    return ir.Branch(cmp if sense else _NEGATED[cmp], x, y,
+                                     term.if_true, term.if_false)
+                case ir.UnOp(op="not", operand=x):
+                    return ir.Branch("==" if sense else "!=", x,
+                                     ir.Const(0), term.if_true,
+                                     term.if_false)
+    return None
+
+
+def remove_dead_temps(f: ir.Function) -> bool:
+    """
+    Drop the instructions that only compute temps nothing reads, unless
+    they may raise a VM error; calls stay, with their result discarded.
+    Returns whether anything changed.
+    """
+    changed = False
+    while True:
+        used = {op for block in f.blocks.values()
+                for insn in [*block.insns, block.term]
+                for op in ir.operands(insn) if isinstance(op, ir.Temp)}
+        removed = False
+        for block in f.blocks.values():
+            kept: list[ir.Insn] = []
+            for insn in block.insns:
+                dst = ir.dest(insn)
+                if isinstance(dst, ir.Temp) and dst not in used:
+                    if not may_raise(insn):
+                        removed = True
+                        continue
+                    if isinstance(insn, ir.Call):
+                        insn.dst = None
+                        changed = True
+                kept.append(insn)
+            block.insns = kept
+        if not removed:
+            return changed
+        changed = True
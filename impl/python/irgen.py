@@ -0,0 +1,227 @@
+"""
+Lowering of decorated ASTs (after offsets.program) to the IR in ir.py.
+
+Expressions become three-address instructions over temps, constants and
+frame slots; if, while, and, or and not become blocks joined by Branch
+and Jump terminators.
+"""
+from typing import Optional
+
+import asts
+import codegen
+import error
+import ir
+import symbols
+
+
+# This is the entry point for the visitor.
+def program(ast: asts.Program) -> ir.Program:
+    p = ir.Program()
+    for decl in ast.decls:
+        f = _FuncDecl(decl)
+        p.functions[f.label] = f
+        if decl.id.token.value == "main":
+            p.main = f.label
+    return p
+
+
+class _Builder:
+    """Appends blocks and instructions to one function."""
+
+    def __init__(self, f: ir.Function):
+        self.f = f
+        self.labels = 0
+        self.block: Optional[ir.Block] = None
+
+    def new_label(self, hint: str) -> str:
+        self.labels += 1
+        return f"L{self.labels}.{hint}"
+
+    def start(self, label: str):
+        """Continue in a new block, placed after the existing ones."""
+        self.block = ir.Block(label)
+        self.f.blocks[label] = self.block
+
+    def emit(self, insn: ir.Insn):
+        self.block.insns.append(insn)
+
+    def end(self, term: ir.Terminator):
+        self.block.term = term
+
+
+def _FuncDecl(ast: asts.FuncDecl) -> ir.Function:
+    fn_type = ast.id.symbol.get_type()
+    assert isinstance(fn_type, symbols.FuncType)
+    f = ir.Function(ast.id.token.value, codegen.func_label(ast.id),
+                    fn_type.param_size, fn_type.frame_size,
+                    not isinstance(fn_type.ret, symbols.VoidType))
+    b = _Builder(f)
+    b.start("entry")
+    _CompoundStmt(b, ast.body)
+    # Falling off the end returns whatever is in the RET slot
+    b.end(ir.Return())
+    return f
+
+
+def _CompoundStmt(b: _Builder, ast: asts.CompoundStmt):
+    for stmt in ast.stmts:
+        _Stmt(b, stmt)
+    if ast.return_stmt is not None:
+        _ReturnStmt(b, ast.return_stmt)
+
+
+def _Stmt(b: _Builder, ast: asts.Stmt):
+    if isinstance(ast, asts.AssignStmt):
+        _AssignStmt(b, ast)
+    elif isinstance(ast, asts.IfStmt):
+        _IfStmt(b, ast)
+    elif isinstance(ast, asts.WhileStmt):
+        _WhileStmt(b, ast)
+    elif isinstance(ast, asts.CallStmt):
+        _call(b, ast.call, None)
+    elif isinstance(ast, asts.CompoundStmt):
+        _CompoundStmt(b, ast)
+    elif isinstance(ast, asts.PrintStmt):
+        b.emit(ir.Print(rval(b, ast.expr)))
+    else:
+        assert False, f"_Stmt() not implemented for {type(ast)}"
+
+
+def _AssignStmt(b: _Builder, ast: asts.AssignStmt):
+    if not isinstance(ast.lhs, asts.IdExpr):
+        error.error("Assignment to arrays is not supported", ast.token.coord)
+    b.emit(ir.Move(_var(ast.lhs.id), rval(b, ast.rhs)))
+
+
+def _ReturnStmt(b: _Builder, ast: asts.ReturnStmt):
+    b.end(ir.Return(None if ast.expr is None else rval(b, ast.expr)))
+    # Statements after a return nested in an if or while still need a
+    # block, even though nothing reaches it
+    b.start(b.new_label("after-return"))
+
+
+def _IfStmt(b: _Builder, ast: asts.IfStmt):
+    then_label = b.new_label("then")
+    end_label = b.new_label("endif")
+    else_label = end_label if ast.elseStmt is None else b.new_label("else")
+    control(b, ast.expr, then_label, else_label)
+    b.start(then_label)
+    _CompoundStmt(b, ast.thenStmt)
+    b.end(ir.Jump(end_label))
+    if ast.elseStmt is not None:
+        b.start(else_label)
+        _CompoundStmt(b, ast.elseStmt)
+        b.end(ir.Jump(end_label))
+    b.start(end_label)
+
+
+def _WhileStmt(b: _Builder, ast: asts.WhileStmt):
+    # Body before test, so that laid out in order the loop is tested at
+    # the bottom
+    body_label = b.new_label("body")
+    test_label = b.new_label("test")
+    end_label = b.new_label("endwhile")
+    b.end(ir.Jump(test_label))
+    b.start(body_label)
+    _CompoundStmt(b, ast.stmt)
+    b.end(ir.Jump(test_label))
+    b.start(test_label)
+    control(b, ast.expr, body_label, end_label)
+    b.start(end_label)
+
+
+def control(b: _Builder, e: asts.Expr, if_true: str, if_false: str):
+    """End the current block with a branch on e."""
+    match e:
+        case asts.BinaryOp() if e.op.kind == "and":
+            right_label = b.new_label("and")
+            control(b, e.left, right_label, if_false)
+            b.start(right_label)
+            control(b, e.right, if_true, if_false)
+        case asts.BinaryOp() if e.op.kind == "or":
+            right_label = b.new_label("or")
+            control(b, e.left, if_true, right_label)
+            b.start(right_label)
+            control(b, e.right, if_true, if_false)
+        case asts.BinaryOp() if e.op.kind in ir.COMPARE_OPS:
+            left = rval(b, e.left)
+            right = rval(b, e.right)
+            b.end(ir.Branch(e.op.kind, left, right, if_true, if_false))
+        case asts.UnaryOp() if e.op.kind == "not":
+            control(b, e.expr, if_false, if_true)
+        case asts.TrueLiteral():
+            b.end(ir.Jump(if_true))
+        case asts.FalseLiteral():
+            b.end(ir.Jump(if_false))
+        case _:
+            b.end(ir.Branch("!=", rval(b, e), ir.Const(0), if_true,
+                            if_false))
+
+
+def rval(b: _Builder, e: asts.Expr) -> ir.Operand:
+    match e:
+        case asts.BinaryOp() if e.op.kind in ("and", "or"):
+            return _rval_logical(b, e)
+        case asts.BinaryOp():
+            left = rval(b, e.left)
+            right = rval(b, e.right)
+            dst = b.f.new_temp()
+            b.emit(ir.BinOp(dst, e.op.kind, left, right))
+            return dst
+        case asts.UnaryOp():
+            operand = rval(b, e.expr)
+            dst = b.f.new_temp()
+            b.emit(ir.UnOp(dst, e.op.kind, operand))
+            return dst
+        case asts.CallExpr():
+            dst = b.f.new_temp()
+            _call(b, e, dst)
+            return dst
+        case asts.IdExpr():
+            match e.semantic_type:
+                case symbols.FuncType():
+                    return ir.FuncRef(codegen.func_label(e.id))
+                case symbols.ArrayType() | symbols.VoidType() | \
+                        symbols.PhonyType():
+                    error.error(f"rval(IdExpr as {e.semantic_type}) is not "
+                                "supported", e.id.token.coord)
+                case _:
+                    return _var(e.id)
+        case asts.ArrayCell():
+            error.error("rval(ArrayCell) is currently not supported.",
+                        e.coord)
+        case asts.IntLiteral(token=token):
+            return ir.Const(int(token.value))
+        case asts.TrueLiteral():
+            return ir.Const(1)
+        case asts.FalseLiteral():
+            return ir.Const(0)
+        case _:
+            assert False, f"rval() not implemented for {type(e)}"
+
+
+def _rval_logical(b: _Builder, e: asts.BinaryOp) -> ir.Temp:
+    # Short-circuits like a condition; each outcome sets the result
+    dst = b.f.new_temp()
+    true_label = b.new_label("true")
+    false_label = b.new_label("false")
+    end_label = b.new_label("endbool")
+    control(b, e, true_label, false_label)
+    b.start(true_label)
+    b.emit(ir.Move(dst, ir.Const(1)))
+    b.end(ir.Jump(end_label))
+    b.start(false_label)
+    b.emit(ir.Move(dst, ir.Const(0)))
+    b.end(ir.Jump(end_label))
+    b.start(end_label)
+    return dst
+
+
+def _call(b: _Builder, ast: asts.CallExpr, dst: Optional[ir.Temp]):
+    assert isinstance(ast.fn, asts.IdExpr)
+    args = [rval(b, arg) for arg in ast.args]
+    b.emit(ir.Call(dst, codegen.func_label(ast.fn.id), args))
+
+
+def _var(id: asts.Id) -> ir.Var:
+    return ir.Var(id.symbol.offset, id.token.value)
@@ -0,0 +1,207 @@
+"""
+Inlining of small non-recursive functions in the IR.
+
+A call is replaced by a copy of the callee's blocks. The callee's locals,
+and the parameters it assigns, get frame slots of their own after the
+caller's locals (its frame_size from offsets.py grows accordingly): the
+copy starts by storing the arguments into those parameter slots and
+zeroing the locals it reads, as CallDirect would. Other parameters are
+replaced by their arguments, which the copy cannot change since it only
+assigns its own slots and fresh temps. Each return stores its value into
+the call's destination and jumps to the code after the call.
+
+A callee is inlined when it is not part of a cycle of calls and its size
+(instructions, terminators and the moves that set up its frame) is at
+most max_size, and only while the program as a whole has grown by at most
+growth times its original size. Callees are inlined into their callers
+bottom-up, so a callee's own calls are already inlined when it is copied.
+"""
+from typing import Optional
+
+import ir
+
+MAX_SIZE = 12
+GROWTH = 0.5
+
+
+# This is the entry point of the pass.
+def program(p: ir.Program, max_size: int = MAX_SIZE,
+            growth: float = GROWTH):
+    budget = int(growth * sum(_size(f) for f in p.functions.values()))
+    recursive = _recursive(p)
+    for f in _bottom_up(p):
+        count = 0
+        while True:
+            site = _next_site(p, f, recursive, max_size, budget)
+            if site is None:
+                break
+            label, index, callee = site
+            budget -= _size(callee)
+            _inline(f, label, index, callee, count)
+            count += 1
+
+
+def _size(f: ir.Function) -> int:
+    return f.param_size + f.frame_size + sum(
+        len(block.insns) + 1 for block in f.blocks.values())
+
+
+def _callees(f: ir.Function) -> set[str]:
+    return {insn.func for block in f.blocks.values()
+            for insn in block.insns if isinstance(insn, ir.Call)}
+
+
+def _recursive(p: ir.Program) -> set[str]:
+    """The functions that can (indirectly) call themselves."""
+    calls = {label: _callees(f) for label, f in p.functions.items()}
+    recursive: set[str] = set()
+    for label in calls:
+        seen: set[str] = set()
+        work = list(calls[label])
+        while work:
+            callee = work.pop()
+            if callee == label:
+                recursive.add(label)
+                break
+            if callee not in seen:
+                seen.add(callee)
+                work.extend(calls[callee])
+    return recursive
+
+
+def _bottom_up(p: ir.Program) -> list[ir.Function]:
+    """The functions, each after the functions it calls (cycles aside)."""
+    order: list[ir.Function] = []
+    seen: set[str] = set()
+
+    def visit(label: str):
+        if label in seen:
+            return
+        seen.add(label)
+        for callee in sorted(_callees(p.functions[label])):
+            visit(callee)
+        order.append(p.functions[label])
+
+    for label in p.functions:
+        visit(label)
+    return order
+
+
+def _next_site(p: ir.Program, f: ir.Function, recursive: set[str],
+               max_size: int, budget: int) \
+        -> Optional[tuple[str, int, ir.Function]]:
+    for block in f.blocks.values():
+        for i, insn in enumerate(block.insns):
+            if not isinstance(insn, ir.Call) or insn.func in recursive \
+                    or insn.func == f.label:
+                continue
+            callee = p.functions[insn.func]
+            size = _size(callee)
+            if size <= max_size and size <= budget:
+                return block.label, i, callee
+    return None
+
+
+def _inline(f: ir.Function, label: str, index: int, callee: ir.Function,
+            count: int):
+    block = f.blocks[label]
+    call = block.insns[index]
+    prefix = f"i{count}.{callee.name}"
+    after = ir.Block(f"{prefix}.after")
+    after.insns = block.insns[index + 1:]
+    after.term = block.term
+
+    names: dict[int, str] = {}
+    read: set[int] = set()
+    written: set[int] = set()
+    for original in callee.blocks.values():
+        for insn in [*original.insns, original.term]:
+            for op in ir.operands(insn):
+                if isinstance(op, ir.Var):
+                    names[op.offset] = op.name
+                    read.add(op.offset)
+            dst = ir.dest(insn)
+            if isinstance(dst, ir.Var):
+                names[dst.offset] = dst.name
+                written.add(dst.offset)
+
+    # The callee's frame: a slot for each parameter it assigns and each
+    # local, the other parameters are replaced by their arguments
+    operands: dict[int, ir.Operand] = {}
+    setup: list[ir.Insn] = []
+    for i, arg in enumerate(call.args):
+        if -2 - i in written:
+            operands[-2 - i] = ir.Var(3 + f.frame_size,
+                                      f"{callee.name}.{names[-2 - i]}")
+            f.frame_size += 1
+            setup.append(ir.Move(operands[-2 - i], arg))
+        else:
+            operands[-2 - i] = arg
+    for offset in range(3, 3 + callee.frame_size):
+        operands[offset] = ir.Var(
+            3 + f.frame_size,
+            f"{callee.name}.{names.get(offset, f'local{offset}')}")
+        f.frame_size += 1
+        if offset in read:
+            # CallDirect would have zeroed it
+            setup.append(ir.Move(operands[offset], ir.Const(0)))
+    temps: dict[ir.Temp, ir.Temp] = {}
+
+    def operand(op: ir.Operand) -> ir.Operand:
+        match op:
+            case ir.Var(offset=offset):
+                return operands[offset]
+            case ir.Temp():
+                if op not in temps:
+                    temps[op] = f.new_temp()
+                return temps[op]
+        return op
+
+    def target(name: str) -> str:
+        return f"{prefix}.{name}"
+
+    block.insns = block.insns[:index] + setup
+    block.term = ir.Jump(target(callee.entry.label))
+
+    copies: list[ir.Block] = []
+    for original in callee.blocks.values():
+        copy = ir.Block(target(original.label))
+        copy.insns = [_copy(insn, operand) for insn in original.insns]
+        match original.term:
+            case ir.Return(value=value):
+                if call.dst is not None:
+                    # A value function returning without one leaves RET 0
+                    copy.insns.append(ir.Move(
+                        call.dst, ir.Const(0) if value is None
+                        else operand(value)))
+                copy.term = ir.Jump(after.label)
+            case ir.Jump(target=name):
+                copy.term = ir.Jump(target(name))
+            case ir.Branch(op=op, left=left, right=right, if_true=if_true,
+                           if_false=if_false):
+                copy.term = ir.Branch(op, operand(left), operand(right),
+                                      target(if_true), target(if_false))
+        copies.append(copy)
+
+    # Keep the layout: the copy right after the call, then the rest
+    blocks = list(f.blocks.values())
+    at = blocks.index(block) + 1
+    blocks[at:at] = [*copies, after]
+    f.blocks = {b.label: b for b in blocks}
+
+
+def _copy(insn: ir.Insn, operand) -> ir.Insn:
+    match insn:
+        case ir.Move(dst=dst, src=src):
+            return ir.Move(operand(dst), operand(src))
+        case ir.BinOp(dst=dst, op=op, left=left, right=right):
+            return ir.BinOp(operand(dst), op, operand(left), operand(right))
+        case ir.UnOp(dst=dst, op=op, operand=x):
+            return ir.UnOp(operand(dst), op, operand(x))
+        case ir.Call(dst=dst, func=func, args=args):
+            return ir.Call(None if dst is None else operand(dst), func,
+                           [operand(arg) for arg in args])
+        case ir.Print(value=value):
+            return ir.Print(operand(value))
+        case _:
+            assert False, f"_copy() not implemented for {type(insn)}"
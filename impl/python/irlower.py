@@ -0,0 +1,362 @@
+"""
+Lowering of the IR in ir.py to VM instructions.
+
+Frame slots map to LoadLocal/StoreLocal. A temp that is assigned and used
+once in the same block, in an order the eval stack can follow, stays on
+the eval stack in between ("stack temps"). Every other temp gets a frame
+slot of its own after the function's locals, which grows the frame
+CallDirect allocates. Blocks are emitted in layout order, so jumps to the
+next block fall through.
+"""
+from typing import Optional, Union
+
+import ir
+from vm_insns import *
+
+_BINOPS: dict[str, type] = {
+    "+": Add,
+    "-": Sub,
+    "*": Mul,
+    "/": Div,
+    "<": LessThan,
+    "<=": LessThanEqual,
+    ">": GreaterThan,
+    ">=": GreaterThanEqual,
+    "==": Equal,
+    "!=": NotEqual,
+}
+
+_IMM_OPS: dict[str, type] = {
+    "+": AddImm,
+    "-": SubImm,
+    "*": MulImm,
+    "<": LessThanImm,
+    "<=": LessThanEqualImm,
+    ">": GreaterThanImm,
+    ">=": GreaterThanEqualImm,
+    "==": EqualImm,
+    "!=": NotEqualImm,
+}
+
+_BRANCHES: dict[str, type] = {
+    "<": JumpIfLess,
+    "<=": JumpIfLessEq,
+    ">": JumpIfGreater,
+    ">=": JumpIfGreaterEq,
+    "==": JumpIfEq,
+    "!=": JumpIfNotEq,
+}
+
+# x op y == y mirrored-op x
+_MIRRORED = {"+": "+", "*": "*", "<": ">", "<=": ">=", ">": "<", ">=": "<=",
+             "==": "==", "!=": "!="}
+
+# not (x op y) == x negated-op y
+_NEGATED = {"<": ">=", "<=": ">", ">": "<=", ">=": "<", "==": "!=",
+            "!=": "=="}
+
+# Operands of these may be pushed in either order
+_SWAPPABLE = (ir.BinOp, ir.Branch)
+
+# What _arrangement returns when only the second of two operands is on the
+# stack
+SECOND_ONLY = -1
+
+
+# This is the entry point.
+def program(p: ir.Program) -> list[Insn]:
+    stack_temps = {f.label: _stack_temps(f) for f in p.functions.values()}
+    slots = {f.label: _slots(f, stack_temps[f.label])
+             for f in p.functions.values()}
+    frames = {label: p.functions[label].frame_size + len(slots[label])
+              for label in p.functions}
+
+    insns: list[Insn] = []
+    if p.main is not None:
+        main = p.functions[p.main]
+        # main is called without arguments; its parameters start out 0
+        insns.extend(PushImmediate(0, "unset param")
+                     for _ in range(main.param_size))
+        insns.append(CallDirect(main.label, main.param_size,
+                                frames[main.label], f"call {main.name}"))
+    insns.append(Halt())
+    for f in p.functions.values():
+        insns.extend(_Lowering(f, stack_temps[f.label], slots[f.label],
+                               frames).function())
+    return insns
+
+
+def _arrangement(ops: list[ir.Operand], pending: list[ir.Temp],
+                 stack_temps: set[ir.Temp], swappable: bool) -> Optional[int]:
+    """
+    How the stack temps among ops sit on top of the eval stack (pending):
+    the number of leading operands they make up, SECOND_ONLY if they are
+    just the second of two swappable operands, or None if the instruction
+    cannot find them there.
+    """
+    on = [op for op in ops if isinstance(op, ir.Temp) and op in stack_temps]
+    if not on:
+        return 0
+    if pending[-len(on):] != on:
+        return None
+    if ops[:len(on)] == on:
+        return len(on)
+    if swappable and len(ops) == 2 and on == [ops[1]]:
+        return SECOND_ONLY
+    return None
+
+
+def _stack_temps(f: ir.Function) -> set[ir.Temp]:
+    defs: dict[ir.Temp, list[str]] = {}
+    uses: dict[ir.Temp, list[str]] = {}
+    for block in f.blocks.values():
+        for insn in [*block.insns, block.term]:
+            for op in ir.operands(insn):
+                if isinstance(op, ir.Temp):
+                    uses.setdefault(op, []).append(block.label)
+            dst = ir.dest(insn)
+            if isinstance(dst, ir.Temp):
+                defs.setdefault(dst, []).append(block.label)
+    candidates = {t for t, blocks in defs.items()
+                  if len(blocks) == 1 and uses.get(t) == blocks}
+
+    # Drop the temps that are not where their user needs them until the
+    # rest all are
+    while True:
+        bad: set[ir.Temp] = set()
+        for block in f.blocks.values():
+            pending: list[ir.Temp] = []
+            for insn in [*block.insns, block.term]:
+                ops = ir.operands(insn)
+                on = [op for op in ops
+                      if isinstance(op, ir.Temp) and op in candidates]
+                if _arrangement(ops, pending, candidates,
+                                isinstance(insn, _SWAPPABLE)) is None:
+                    lowest = min((pending.index(t) for t in on
+                                  if t in pending), default=len(pending))
+                    bad.update(on, pending[lowest:])
+                    pending = [t for t in pending[:lowest] if t not in on]
+                elif on:
+                    del pending[-len(on):]
+                dst = ir.dest(insn)
+                if isinstance(dst, ir.Temp) and dst in candidates:
+                    pending.append(dst)
+            bad.update(pending)
+        if not bad:
+            return candidates
+        candidates -= bad
+
+
+def _slots(f: ir.Function, stack_temps: set[ir.Temp]) -> dict[ir.Temp, int]:
+    used = {op for block in f.blocks.values()
+            for insn in [*block.insns, block.term]
+            for op in ir.operands(insn) if isinstance(op, ir.Temp)}
+    spilled = sorted(used - stack_temps)
+    # Locals start at FP+3 (see offsets.py)
+    return {t: 3 + f.frame_size + i for i, t in enumerate(spilled)}
+
+
+class _Lowering:
+    def __init__(self, f: ir.Function, stack_temps: set[ir.Temp],
+                 slots: dict[ir.Temp, int], frames: dict[str, int]):
+        self.f = f
+        self.stack_temps = stack_temps
+        self.slots = slots
+        self.frames = frames
+        self.pending: list[ir.Temp] = []
+        self.out: list[Insn] = []
+
+    def label(self, block: str) -> str:
+        return f"{self.f.label}-{block}"
+
+    def function(self) -> list[Insn]:
+        targets = {succ for block in self.f.blocks.values()
+                   for succ in block.successors}
+        blocks = list(self.f.blocks.values())
+        self.out.append(Label(self.f.label))
+        for i, block in enumerate(blocks):
+            if block.label in targets:
+                self.out.append(Label(self.label(block.label)))
+            if self.is_tail_call(block):
+                for insn in block.insns[:-1]:
+                    self.insn(insn)
+                self.tail_call(block.insns[-1])
+            else:
+                for insn in block.insns:
+                    self.insn(insn)
+                next_label = blocks[i + 1].label if i + 1 < len(blocks) \
+                    else None
+                self.terminator(block.term, next_label)
+            assert not self.pending, f"{block.label}: stack temps left over"
+        return self.out
+
+    def is_tail_call(self, block: ir.Block) -> bool:
+        """
+        Whether block ends in `return call g(...)` (or `call g(); return` in
+        a void function) with g's arguments fitting where ours are.
+        """
+        if not block.insns or not isinstance(block.term, ir.Return):
+            return False
+        call = block.insns[-1]
+        return isinstance(call, ir.Call) \
+            and len(call.args) <= self.f.param_size \
+            and (call.dst == block.term.value if call.dst is not None
+                 else block.term.value is None and not self.f.returns_value)
+
+    def tail_call(self, call: ir.Call):
+        """
+        Run the callee in our frame: Ret only uses FP-1..FP+2 (see
+        vm_insns.CallDirect), so its arguments can overwrite ours and its
+        zeroed locals replace ours, and it returns straight to our caller.
+        """
+        for arg in call.args[self.stacked(call.args, swappable=False):]:
+            self.load(arg)
+        for i in reversed(range(len(call.args))):
+            self.out.append(StoreLocal(-2 - i, f"{call.func} arg {i}"))
+        if self.frames[self.f.label]:
+            self.out.extend([PushFP(3, "drop our locals"), PopSP()])
+        if self.frames[call.func]:
+            self.out.append(AllocZero(self.frames[call.func],
+                                      f"{call.func} locals"))
+        self.out.append(Jump(call.func, f"tail call {call.func}"))
+
+    def load(self, op: ir.Operand):
+        match op:
+            case ir.Const(value=value):
+                self.out.append(PushImmediate(value))
+            case ir.Var(offset=offset, name=name):
+                self.out.append(LoadLocal(offset, f"{name}@{offset}"))
+            case ir.FuncRef(label=label):
+                self.out.append(PushLabel(label))
+            case ir.Temp():
+                assert op not in self.stack_temps, f"{op} is on the stack"
+                self.out.append(LoadLocal(self.slots[op], str(op)))
+
+    def store(self, dst: Optional[ir.Dest]):
+        match dst:
+            case ir.Var(offset=offset, name=name):
+                self.out.append(StoreLocal(offset, f"{name}@{offset}"))
+            case ir.Temp() if dst in self.stack_temps:
+                self.pending.append(dst)
+            case ir.Temp() if dst in self.slots:
+                self.out.append(StoreLocal(self.slots[dst], str(dst)))
+            case _:
+                self.out.append(Pop("unused result"))
+
+    def stacked(self, ops: list[ir.Operand], swappable: bool) -> int:
+        """
+        Take the stack temps among ops off the simulated eval stack; see
+        _arrangement for the result.
+        """
+        arrangement = _arrangement(ops, self.pending, self.stack_temps,
+                                   swappable)
+        assert arrangement is not None, "stack temps out of order"
+        n = sum(1 for op in ops
+                if isinstance(op, ir.Temp) and op in self.stack_temps)
+        if n:
+            del self.pending[-n:]
+        return arrangement
+
+    def operands(self, op: str, left: ir.Operand, right: ir.Operand) \
+            -> tuple[str, Optional[ir.Const]]:
+        """
+        Get left and right onto the eval stack for the binary operator op.
+        Returns the operator to apply (mirrored if the operands ended up the
+        other way round) and, when an immediate form can take it, the
+        constant that was left off the stack.
+        """
+        match self.stacked([left, right], swappable=True):
+            case 2:
+                return op, None
+            case 1:
+                left_on_stack = True
+            case 0:
+                left_on_stack = False
+                if isinstance(left, ir.Const) and op in _MIRRORED \
+                        and not isinstance(right, ir.Const):
+                    op, left, right = _MIRRORED[op], right, left
+            case _:
+                # right is on the stack already
+                if op in _MIRRORED:
+                    op, left, right = _MIRRORED[op], right, left
+                    left_on_stack = True
+                else:
+                    self.load(left)
+                    self.out.append(Swap())
+                    return op, None
+        if not left_on_stack:
+            self.load(left)
+        if isinstance(right, ir.Const):
+            return op, right
+        self.load(right)
+        return op, None
+
+    def insn(self, insn: ir.Insn):
+        match insn:
+            case ir.Move(dst=dst, src=src):
+                if not self.stacked([src], swappable=False):
+                    self.load(src)
+                self.store(dst)
+            case ir.BinOp(dst=dst, op=op, left=left, right=right):
+                op, imm = self.operands(op, left, right)
+                if imm is None:
+                    self.out.append(_BINOPS[op]())
+                elif op in _IMM_OPS:
+                    self.out.append(_IMM_OPS[op](imm.value))
+                else:
+                    self.load(imm)
+                    self.out.append(_BINOPS[op]())
+                self.store(dst)
+            case ir.UnOp(dst=dst, op=op, operand=operand):
+                if not self.stacked([operand], swappable=False):
+                    self.load(operand)
+                self.out.append(Negate() if op == "-" else Not())
+                self.store(dst)
+            case ir.Call(dst=dst, func=func, args=args):
+                for arg in args[self.stacked(args, swappable=False):]:
+                    self.load(arg)
+                self.out.append(CallDirect(func, len(args), self.frames[func],
+                                           f"call {func}"))
+                if dst is None:
+                    self.out.append(Pop("Disregard return value"))
+                else:
+                    self.store(dst)
+            case ir.Print(value=value):
+                if not self.stacked([value], swappable=False):
+                    self.load(value)
+                self.out.append(Print())
+            case _:
+                assert False, f"insn() not implemented for {type(insn)}"
+
+    def terminator(self, term: ir.Terminator, next_label: Optional[str]):
+        match term:
+            case ir.Jump(target=target):
+                if target != next_label:
+                    self.out.append(Jump(self.label(target)))
+            case ir.Branch(op=op, left=left, right=right, if_true=if_true,
+                           if_false=if_false):
+                tail: Optional[str] = None
+                if if_false == next_label:
+                    target = if_true
+                elif if_true == next_label:
+                    op, target = _NEGATED[op], if_false
+                else:
+                    target, tail = if_true, if_false
+                op, imm = self.operands(op, left, right)
+                if imm == ir.Const(0) and op in ("==", "!="):
+                    jump = JumpIfZero if op == "==" else JumpIfNotZero
+                else:
+                    if imm is not None:
+                        self.load(imm)
+                    jump = _BRANCHES[op]
+                self.out.append(jump(self.label(target)))
+                if tail is not None:
+                    self.out.append(Jump(self.label(tail)))
+            case ir.Return(value=value):
+                if value is not None:
+                    if not self.stacked([value], swappable=False):
+                        self.load(value)
+                    self.out.append(StoreLocal(-1, "RET"))
+                self.out.append(Ret())
+            case _:
+                assert False, f"terminator() not implemented for {type(term)}"
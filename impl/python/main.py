@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import argparse
+import sys
 from sys import stdout
 from typing import List
 
@@ -8,11 +9,13 @@ from scanner import Scanner
 from parser import Parser
 import typecheck
 import bindings
-import codegen
 import offsets
+import passes
+import peephole
 from vm_insns import Insn
 import vm_utils
 import vm_insns
+import vm_arith
 
 
 def main():
@@ -21,7 +24,10 @@ def main():
     compiled_source = None
     with open(fname) as f:
         input = f.read()
-        compiled_source = compile(input)
+        compiled_source = compile(
+            input, args.opt_level, args.passes, args.time_passes,
+            args.check_passes, args.dump_ir, args.peephole_window,
+            args.pass_stats)
 
     if not compiled_source:
         raise RuntimeError(f"Compiling {fname} yields None for some reason")
@@ -32,22 +38,53 @@ def main():
         f.writelines((vm_insns.dis(isns)+"\n" for isns in compiled_source))
 
     if args.run:
-        interpret(compiled_source, args.args, args.verbose)
+        result = interpret(compiled_source, args.args, args.verbose,
+                           args.arith, args.engine, args.stats, args.timeout,
+                           args.cpu_time)
+        if not result.halted:
+            sys.exit(2)
 
 
-def compile(input):
+def compile(input, opt_level=0, pass_names=None, time_passes=False,
+            check_passes=False, dump_ir=False,
+            peephole_window=peephole.DEFAULT_WINDOW, pass_stats=False):
     lexer = Scanner(input)
     psr = Parser(lexer)
     tree: Program = psr.parse()
     bindings.program(tree)
     typecheck.program(tree)
     offsets.program(tree)
-    insns: List[Insn] = codegen.generate(tree)
+    manager = passes.PassManager(opt_level, pass_names, time_passes,
+                                 check_passes, dump_ir,
+                                 window=peephole_window,
+                                 print_stats=pass_stats)
+    insns: List[Insn] = manager.run(tree)
     return insns
 
 
-def interpret(insns: list[Insn], args, verbose):
-    vm_utils.invoke_omega(insns, args, verbose)
+def interpret(insns: list[Insn], args, verbose, arith="bigint",
+              engine="interp", stats=None, wall_time=None, cpu_time=None):
+    return vm_utils.invoke_omega(insns, args, verbose, arith=arith,
+                                 engine=engine, stats=stats,
+                                 wall_time=wall_time, cpu_time=cpu_time)
+
+
+def _pass_list(spec: str) -> list[str]:
+    try:
+        return passes.parse_passes(spec)
+    except passes.PassError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def _positive_int(text: str) -> int:
+    try:
+        value = int(text)
+    except ValueError:
+        value = 0
+    if value < 1:
+        raise argparse.ArgumentTypeError(
+            f"expected a positive integer, got {text!r}")
+    return value
 
 
 def get_args():
@@ -64,8 +101,44 @@ def get_args():
     ap.add_argument(
         "args", nargs="*", help="Arguments to pass to the program as integers"
     )
+    ap.add_argument("-O", dest="opt_level", type=int, choices=[0, 1, 2],
+                    default=0,
+                    help="Optimization level; -O1 and up compile through "
+                    "the three-address IR")
+    ap.add_argument("--passes", metavar="PASS,...", type=_pass_list,
+                    help="Run these optimization passes instead of the "
+                    "level's (known: " + ", ".join(passes.PASSES) + ")")
+    ap.add_argument("--time-passes", action="store_true",
+                    help="Print the time spent in each compiler pass to "
+                    "stderr")
+    ap.add_argument("--check-passes", action="store_true",
+                    help="Run the program after every pass and fail if its "
+                    "output changes")
+    ap.add_argument("--peephole-window", type=_positive_int, metavar="N",
+                    default=peephole.DEFAULT_WINDOW,
+                    help="Longest instruction sequence the peephole pass "
+                    "looks at (default %(default)s)")
+    ap.add_argument("--pass-stats", action="store_true",
+                    help="Print what the optimization passes rewrote to "
+                    "stderr")
+    ap.add_argument("--dump-ir", action="store_true",
+                    help="Print the IR to stderr (implies the IR pipeline)")
     ap.add_argument("--run", action="store_true",
                     help="Run the program after compilation")
+    ap.add_argument("--arith", choices=sorted(vm_arith.ARITH_MODES),
+                    default="bigint",
+                    help="Integer semantics used when running the program")
+    ap.add_argument("--engine", choices=sorted(vm_utils.ENGINES),
+                    default="interp",
+                    help="Execution engine used when running the program")
+    ap.add_argument("--stats", nargs="?", const="text",
+                    choices=["text", "json"],
+                    help="Report instruction and resource counts of the run "
+                    "to stderr")
+    ap.add_argument("--timeout", type=float, metavar="SECONDS",
+                    help="Stop the program after this much wall-clock time")
+    ap.add_argument("--cpu-time", type=float, metavar="SECONDS",
+                    help="Stop the program after this much CPU time")
     return ap.parse_args()
 
 
@@ -179,11 +179,13 @@ def _FuncDecl(ast: asts.FuncDecl, offset: int):
         param_offset = _ParamDecl(param, param_offset)
     if ast.ret_type_ast is not None:
         _Type(ast.ret_type_ast)
-    ret_offset = _CompoundStmt(ast.body, offset + 4)
+    # FP+0..FP+2 hold the return address, caller FP and saved eval stack
+    # address (see vm_insns.CallDirect); locals follow
+    ret_offset = _CompoundStmt(ast.body, offset + 3)
     func_type = ast.id.symbol.get_type()
     assert isinstance(func_type, symbols.FuncType), f"semantic_type: {ast.id.semantic_type}"
     # func_type.frame_size = ret_offset - 4 - offset + 1
-    func_type.frame_size = ret_offset - 4 - offset
+    func_type.frame_size = ret_offset - 3 - offset
     # func_type.param_size = offset - 2 - param_offset + 1
     func_type.param_size = offset - 2 - param_offset
     return (func_type.param_size, func_type.frame_size)
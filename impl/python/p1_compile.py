@@ -1,12 +1,15 @@
 #!/usr/bin/env python3
+from typing import Optional
+
 import vm_insns
 import scanner
 import parser
 import bindings
 import typecheck
 import offsets
-import codegen
+import passes
 import vm
+import vm_memory
 import io
 
 
@@ -16,7 +19,9 @@ def emit_code(insns: list[vm_insns.Insn]) -> str:
         for i, insn in enumerate(insns))
 
 
-def compile_source(inp: str) -> list[vm_insns.Insn]:
+def compile_source(inp: str, opt_level: int = 0,
+                   pass_names: Optional[list[str]] = None) \
+        -> list[vm_insns.Insn]:
     s = scanner.Scanner(inp)
     tree = parser.Parser(s).parse()
 
@@ -25,8 +30,8 @@ def compile_source(inp: str) -> list[vm_insns.Insn]:
     typecheck.program(tree)
     offsets.program(tree)
 
-    # generate assembly for our PyVM
-    instructions = codegen.generate(tree)
+    # generate and optimize assembly for our PyVM
+    instructions = passes.PassManager(opt_level, pass_names).run(tree)
     return instructions
 
 
@@ -43,7 +48,7 @@ def test(tests: list[str]):
         source.append(src)
 
         stack = []
-        memory = [0] * 100000
+        memory = vm_memory.PagedMemory()
         regs = {
             "PC": 0,
             "FP": 0,
@@ -56,7 +61,7 @@ def test(tests: list[str]):
         o = exec
         insn_last = None
         ra_lookup = {i+1: insn for i, insn in enumerate(insns)
-                     if isinstance(insn, vm_insns.Call)}
+                     if isinstance(insn, (vm_insns.Call, vm_insns.CallDirect))}
         nolabel = vm_insns.Call("?")
         machine_trace = io.StringIO()
         interps.append(machine_trace)
@@ -69,12 +74,12 @@ def test(tests: list[str]):
                     not isinstance(insn, vm_insns.Label):
                 frame = exec.memory[exec.regs["FP"]: exec.regs["SP"]]
                 pseudo_regs = {
-                    "RET": exec.memory[exec.regs["FP"]-1],
+                    "RET": exec.memory[exec.regs["FP"]-1]
+                    if exec.regs["FP"] > 0 else -1,
                     "RA": f"{frame[0]}: " +
                     f"{ra_lookup.get(frame[0], nolabel).comment}",
                     "CallerFP": frame[1] if len(frame) >= 2 else -1,
-                    "BAIL": frame[2] if len(frame) >= 3 else -1,
-                    "THROW": frame[3] if len(frame) >= 4 else -1,
+                    "Saved": frame[2] if len(frame) >= 3 else -1,
                 }
                 print(f"      stack ={exec.stack}", file=machine_trace)
                 print(
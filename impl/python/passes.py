@@ -0,0 +1,217 @@
+"""
+Optimization pass manager for the compiler back end.
+
+A pass is either an IR pass, which rewrites an ir.Program in place, or a
+VM pass, which maps a list of vm_insns to a new one. The pipeline after
+offsets.program is
+
+    -O0:      codegen                            -> VM passes
+    -O1/-O2:  irgen -> IR passes -> irlower      -> VM passes
+
+with the passes of the level (LEVELS) or the ones named with --passes, in
+order. IR passes force the IR pipeline and must come before VM passes.
+Passes taking options (Pass.options) get them from the PassManager's
+keyword arguments of the same name: `window` for the peephole size and
+`stats`, a Counter passes add their rewrite counts to.
+
+With check=True every pass is followed by a run of the program on the
+interpreter, whose output and halting must match the run of the program
+before the first pass (PassError otherwise). With time_passes=True the
+time spent in each stage is printed to stderr, with print_stats=True the
+statistics.
+"""
+import io
+import sys
+import time
+from collections import Counter
+from typing import Callable, NamedTuple, Optional, Union
+
+import asts
+import codegen
+import ir
+import irfold
+import irgen
+import irinline
+import irlower
+import peephole
+import vm
+import vm_cfg
+import vm_memory
+from vm_insns import Insn, Noop
+
+# Instructions a program may run under check=True before it is assumed not
+# to halt, in which case outputs are not compared
+CHECK_MAX_INSNS = 10_000_000
+
+
+class Pass(NamedTuple):
+    name: str
+    kind: str                   # "ir" or "vm"
+    run: Callable
+    description: str
+    options: tuple[str, ...] = ()
+
+
+def _strip_noops(insns: list[Insn]) -> list[Insn]:
+    return [insn for insn in insns if not isinstance(insn, Noop)]
+
+
+PASSES: dict[str, Pass] = {p.name: p for p in [
+    Pass("inline", "ir", irinline.program,
+         "inline calls to small non-recursive functions"),
+    Pass("fold", "ir", irfold.program,
+         "fold constants, simplify algebraic identities and drop the "
+         "branches that can never be taken"),
+    Pass("strip-noops", "vm", _strip_noops,
+         "drop the Noop comments codegen leaves in the code"),
+    Pass("peephole", "vm", peephole.optimize,
+         "rewrite redundant instruction sequences (see peephole.py)",
+         ("window", "stats")),
+    Pass("simplify-cfg", "vm", vm_cfg.simplify,
+         "thread jumps, drop unreachable code and unused labels, and merge "
+         "blocks only entered by a jump", ("stats",)),
+]}
+
+LEVELS: dict[int, list[str]] = {
+    0: [],
+    1: ["fold", "simplify-cfg", "peephole"],
+    2: ["inline", "fold", "simplify-cfg", "peephole"],
+}
+
+
+class PassError(Exception):
+    def __init__(self, name: str, reason: str):
+        super().__init__(f"pass {name}: {reason}")
+        self.name = name
+        self.reason = reason
+
+
+def validate(names: list[str]):
+    """Raise PassError unless names are known passes in a valid order."""
+    for name in names:
+        if name not in PASSES:
+            raise PassError(name, "unknown pass; known passes: "
+                            + ", ".join(PASSES))
+    kinds = [PASSES[name].kind for name in names]
+    first_vm = kinds.index("vm") if "vm" in kinds else len(kinds)
+    for name, kind in zip(names[first_vm:], kinds[first_vm:]):
+        if kind == "ir":
+            raise PassError(name, "IR passes must run before VM passes")
+
+
+def parse_passes(spec: str) -> list[str]:
+    """The pass names of a comma-separated --passes value."""
+    names = [name.strip() for name in spec.split(",") if name.strip()]
+    validate(names)
+    return names
+
+
+class _Outcome(NamedTuple):
+    output: str
+    halted: bool
+
+
+def run_program(insns: list[Insn],
+                max_insns: int = CHECK_MAX_INSNS) -> _Outcome:
+    """Run insns on the interpreter the way vm_utils.invoke_omega does."""
+    out = io.StringIO()
+    exe = vm.Execution(insns, [], vm_memory.PagedMemory(),
+                       {"PC": 0, "FP": 0, "SP": 1}, max_insns=max_insns,
+                       vm_stdout=out)
+    try:
+        halted = exe.run().halted
+    except Exception as e:
+        # A VM error is part of the behaviour being compared
+        return _Outcome(out.getvalue() + f"<{type(e).__name__}: {e}>", True)
+    return _Outcome(out.getvalue(), halted)
+
+
+class PassManager:
+    def __init__(self, opt_level: int = 0, passes: Optional[list[str]] = None,
+                 time_passes: bool = False, check: bool = False,
+                 dump_ir: bool = False, file=sys.stderr,
+                 window: int = peephole.DEFAULT_WINDOW,
+                 print_stats: bool = False):
+        names = LEVELS[opt_level] if passes is None else passes
+        validate(names)
+        self.passes = [PASSES[name] for name in names]
+        kinds = [p.kind for p in self.passes]
+        self.use_ir = opt_level > 0 or "ir" in kinds or dump_ir
+        self.time_passes = time_passes
+        self.check = check
+        self.dump_ir = dump_ir
+        self.file = file
+        self.window = window
+        self.print_stats = print_stats
+        self.stats: Counter = Counter()
+        self.timings: list[tuple[str, float]] = []
+        self.reference: Optional[_Outcome] = None
+
+    def run(self, tree: asts.Program) -> list[Insn]:
+        """Generate code for the decorated tree and optimize it."""
+        self.timings = []
+        self.reference = None
+        self.stats = Counter()
+        if self.use_ir:
+            program = self._timed("irgen", irgen.program, tree)
+            ir.verify(program)
+            self._checkpoint("irgen", program)
+            for p in self.passes:
+                if p.kind == "ir":
+                    self._timed(p.name, self._runner(p), program)
+                    try:
+                        ir.verify(program)
+                    except ir.IRError as e:
+                        raise PassError(p.name, f"broke the IR: {e}")
+                    self._checkpoint(p.name, program)
+            if self.dump_ir:
+                print(ir.format_program(program), file=self.file)
+            insns = self._timed("irlower", irlower.program, program)
+        else:
+            insns = self._timed("codegen", codegen.generate, tree)
+            self._checkpoint("codegen", insns)
+        self.stats["instructions generated"] = len(insns)
+        for p in self.passes:
+            if p.kind == "vm":
+                insns = self._timed(p.name, self._runner(p), insns)
+                self._checkpoint(p.name, insns)
+        self.stats["instructions emitted"] = len(insns)
+        if self.time_passes:
+            self.report()
+        if self.print_stats:
+            self.report_stats()
+        return insns
+
+    def report(self):
+        total = sum(seconds for _, seconds in self.timings)
+        for name, seconds in self.timings:
+            print(f"{name:>16}: {seconds * 1000:8.3f}ms", file=self.file)
+        print(f"{'total':>16}: {total * 1000:8.3f}ms", file=self.file)
+
+    def report_stats(self):
+        for name, count in sorted(self.stats.items()):
+            print(f"{name:>22}: {count:8d}", file=self.file)
+
+    def _runner(self, p: Pass) -> Callable:
+        options = {name: getattr(self, name) for name in p.options}
+        return lambda code: p.run(code, **options)
+
+    def _timed(self, name: str, fn: Callable, arg):
+        start = time.perf_counter()
+        result = fn(arg)
+        self.timings.append((name, time.perf_counter() - start))
+        return result
+
+    def _checkpoint(self, name: str, code: Union[ir.Program, list[Insn]]):
+        if not self.check:
+            return
+        insns = irlower.program(code) if isinstance(code, ir.Program) \
+            else code
+        outcome = run_program(insns)
+        if self.reference is None:
+            self.reference = outcome
+        elif self.reference.halted and outcome != self.reference:
+            raise PassError(name, "changed the program's output from "
+                            f"{self.reference.output!r} to "
+                            f"{outcome.output!r}" +
+                            ("" if outcome.halted else " (did not halt)"))
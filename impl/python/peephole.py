@@ -0,0 +1,117 @@
+"""
+Peephole optimizer over lists of vm_insns.
+
+A window of at most `window` instructions slides over the code and known
+redundant sequences in it are rewritten:
+
+    noop                                  ->  (nothing)
+    pushSP k; popSP; pushSP j; popSP      ->  pushSP k+j; popSP
+    pushSP 0; popSP                       ->  (nothing)
+    jmp L; [lab M ...] lab L              ->  [lab M ...] lab L
+    push v; pop  (any side-effect free push, e.g. pushi, loadl, dup)
+                                          ->  (nothing)
+    swap; swap                            ->  (nothing)
+
+A window never extends over a label except for the jump rule, which only
+removes the jump, so every label stays defined where it was and nothing
+jumps into the middle of a rewritten sequence. Rewrites repeat until none
+applies.
+"""
+from collections import Counter
+from typing import Callable, Optional
+
+from vm_insns import *
+
+DEFAULT_WINDOW = 4
+
+# Instructions that push one value and do nothing else
+_PURE_PUSHES = (PushImmediate, PushLabel, PushFP, PushSP, LoadLocal, Dup,
+                Over)
+
+# A rule looks at the instructions from some index on, at most window of
+# them, and returns how many to replace and what with, or None
+_Rule = Callable[[list[Insn], int, int], Optional[tuple[int, list[Insn]]]]
+
+
+def _noop(insns: list[Insn], i: int, window: int):
+    return (1, []) if isinstance(insns[i], Noop) else None
+
+
+def _sp_chain(insns: list[Insn], i: int, window: int):
+    match insns[i:i + min(window, 4)]:
+        case [PushSP(offset=k), PopSP(), PushSP(offset=j), PopSP()]:
+            return 4, [PushSP(k + j, insns[i].comment), PopSP()]
+        case [PushSP(offset=0), PopSP(), *_]:
+            return 2, []
+    return None
+
+
+def _jump_to_next(insns: list[Insn], i: int, window: int):
+    if not isinstance(insns[i], Jump):
+        return None
+    for insn in insns[i + 1:i + window]:
+        if not isinstance(insn, Label):
+            return None
+        if insn.label == insns[i].label:
+            return 1, []
+    return None
+
+
+def _dead_push(insns: list[Insn], i: int, window: int):
+    match insns[i:i + min(window, 2)]:
+        case [push, Pop()] if isinstance(push, _PURE_PUSHES):
+            return 2, []
+    return None
+
+
+def _swap_swap(insns: list[Insn], i: int, window: int):
+    match insns[i:i + min(window, 2)]:
+        case [Swap(), Swap()]:
+            return 2, []
+    return None
+
+
+RULES: dict[str, _Rule] = {
+    "noop": _noop,
+    "sp-chain": _sp_chain,
+    "jump-to-next": _jump_to_next,
+    "dead-push": _dead_push,
+    "swap-swap": _swap_swap,
+}
+
+
+def optimize(insns: list[Insn], window: int = DEFAULT_WINDOW,
+             stats: Optional[Counter] = None) -> list[Insn]:
+    """
+    Apply RULES to insns until none matches. Counts of the rewrites are
+    added to stats under the rule names.
+    """
+    if window < 1:
+        raise ValueError(f"peephole window must be at least 1, not {window}")
+    stats = Counter() if stats is None else stats
+    before = _labels(insns)
+    changed = True
+    while changed:
+        changed = False
+        out: list[Insn] = []
+        i = 0
+        while i < len(insns):
+            for name, rule in RULES.items():
+                match = rule(insns, i, window)
+                if match is not None:
+                    n, replacement = match
+                    out.extend(replacement)
+                    i += n
+                    stats[name] += 1
+                    changed = True
+                    break
+            else:
+                out.append(insns[i])
+                i += 1
+        insns = out
+    assert _labels(insns) == before, "peephole lost a label"
+    return insns
+
+
+def _labels(insns: list[Insn]) -> list[str]:
+    return [insn.label for insn in insns if isinstance(insn, Label)]
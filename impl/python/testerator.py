@@ -14,12 +14,18 @@ import typecheck
 import bindings
 import codegen
 import vm_utils
+import vm_insns
+import vm_parser
+import vm_scanner
+import vm_verify
 
 import offsets
 import ast_pprint
 import os
     
 OUT_DIR=os.getenv("TEST_OUTPUT") or "test_output"
+# Seconds a compiled test program may run before it is stopped
+TEST_TIMEOUT = float(os.getenv("TEST_TIMEOUT") or 10)
 
 
 def test(
@@ -66,23 +72,33 @@ def nothing(student, expected, crash):
     return True
 
 
+def test_equal(student, expected, crash) -> bool:
+    return student == expected
+
+
+def _format(value) -> str:
+    if isinstance(value, AST):
+        return ast_pprint.SymbolCollector().output(value)
+    return pprint.pformat(value)
+
+
 def log_test(test, retval):
     input_content_hash = hex(hash(test['input']))
     with open(f"{OUT_DIR}/test-{input_content_hash}.expect", "w") as f:
         print(f"input: {test['input']}", file=f)
-        print(ast_pprint.SymbolCollector().output(test["output"]), file=f)
+        print(_format(test["output"]), file=f)
 
     with open(f"{OUT_DIR}/test-{input_content_hash}.actual", "w") as f:
         print(f"input: {test['input']}", file=f)
-        print(ast_pprint.SymbolCollector().output(retval), file=f)
+        print(_format(retval), file=f)
 
 
 def print_test(test, retval, out, err):
     print(f"input: {test['input']}")
     print(f"==== expected return value ====")
-    print(ast_pprint.SymbolCollector().output(test["output"]))
+    print(_format(test["output"]))
     print(f"==== actual return value ====")
-    print(ast_pprint.SymbolCollector().output(retval))
+    print(_format(retval))
     print(f"expected stdout: {test['stdout']}")
     print(f"stdout: {out.getvalue()}")
     print(f"expected stderr: {test['stderr']}")
@@ -98,10 +114,20 @@ def compile(input: str):
     offsets.program(tree)
     return tree
 
+def verify(input: str):
+    """(pc, reason) of the VerifyError a VM program raises, or None."""
+    insns = vm_parser.Parser(
+        vm_scanner.Scanner(input, reserved=vm_insns.reserved)).parse()
+    try:
+        vm_verify.verify(insns)
+    except vm_verify.VerifyError as e:
+        return (e.pc, e.reason)
+    return None
+
 def compile_run(input: str):
     tree = compile(input)
     insns = codegen.generate(tree)
-    vm_utils.invoke_omega(insns, [], False)
+    vm_utils.invoke_omega(insns, [], False, wall_time=TEST_TIMEOUT)
     return None
 
 
@@ -1,7 +1,65 @@
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, NamedTuple, Tuple, Optional
+import bisect
 
 from vm_insns import *
+from vm_memory import Memory, PagedMemory, PAGE_WORDS, zero
+from vm_arith import ARITH_MODES
+from vm_stats import ExecutionStats
 import sys
+import time
+
+
+class ExecutionObserver:
+    """
+    Hooks called by an Execution after the instruction they describe has
+    executed. Subclasses override only the hooks they need; hooks that are
+    not overridden are never called.
+    """
+
+    def on_call(self, exe: "Execution", pc: int, target: int):
+        pass
+
+    def on_return(self, exe: "Execution", pc: int, target: int):
+        pass
+
+    def on_branch(self, exe: "Execution", pc: int, target: int, taken: bool):
+        pass
+
+    def on_store(self, exe: "Execution", pc: int, addr: int, value: int):
+        """Called for each word written: by Store and StoreLocal, and by
+        the frame CallDirect sets up, AllocZero and SaveEvalStack."""
+        pass
+
+    def on_print(self, exe: "Execution", pc: int, value: int):
+        pass
+
+    def on_halt(self, exe: "Execution", pc: int):
+        pass
+
+
+HOOKS = ["on_call", "on_return", "on_branch", "on_store", "on_print",
+         "on_halt"]
+
+CHECK_EVERY = 10_000    # Instructions between time limit checks
+
+
+class RunResult(NamedTuple):
+    """Why and where Execution.run() stopped."""
+    reason: str             # "halt", "max_insns", "wall_time" or "cpu_time"
+    pc: int
+    insns_executed: int
+    function: str           # label of the enclosing function, or TOPLEVEL
+
+    @property
+    def halted(self) -> bool:
+        return self.reason == "halt"
+
+    def __str__(self):
+        if self.halted:
+            return f"halted after {self.insns_executed} instructions"
+        return f"stopped ({self.reason} limit) after " \
+            f"{self.insns_executed} instructions at pc {self.pc} " \
+            f"in {self.function}"
 
 
 class Execution:
@@ -9,17 +67,34 @@ class Execution:
         self,
         insns: List[Insn],
         stack: List[int],
-        memory: List[int],
+        memory: Memory,
         regs: Dict[str, int],
         max_insns=1_000_000_000,
-        vm_stdout=sys.stdout
+        vm_stdout=sys.stdout,
+        arith="bigint",
+        collect_stats=False,
+        observers: Optional[List[ExecutionObserver]] = None,
+        wall_time: Optional[float] = None,
+        cpu_time: Optional[float] = None,
+        check_every=CHECK_EVERY,
     ):
         self.insns: List[Insn] = insns
         self.stack: List[int] = stack
-        self.memory: List[int] = memory
+        self.memory: Memory = memory
         self.regs: Dict[str, int] = regs
         self.max_insns = max_insns
+        self.initial_max_insns = max_insns
+        # Limits in seconds for each call of run(), checked every
+        # check_every instructions
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        self.check_every = check_every
         self.vm_stdout = vm_stdout
+        assert arith in ARITH_MODES, f"Unknown arithmetic mode: {arith}"
+        self.arith = arith
+        self.int_fixup = ARITH_MODES[arith]
+        self.stats: Optional[ExecutionStats] = \
+            ExecutionStats(insns) if collect_stats else None
 
         if "FP" not in self.regs:
             self.regs["FP"] = 0
@@ -27,6 +102,7 @@ class Execution:
             self.regs["SP"] = 0
         if "PC" not in self.regs:
             self.regs["PC"] = 0
+        self.max_sp: int = self.regs["SP"]
         self.labels: dict[str, int] = {}
         for i, insn in enumerate(self.insns):
             match insn:
@@ -41,6 +117,63 @@ class Execution:
 
         self.verbose = False
         self.debug_step = False
+        self._entries: Optional[List[int]] = None
+
+        self.observers = list(observers or [])
+        self.hooks: dict[str, list] = {}
+        for name in HOOKS:
+            overridden = [getattr(o, name) for o in self.observers
+                          if getattr(type(o), name)
+                          is not getattr(ExecutionObserver, name)]
+            if overridden:
+                self.hooks[name] = overridden
+        if self.hooks:
+            # Only observed executions pay for the hook dispatch
+            self.step = self._observed_step
+
+    @property
+    def instrumented(self) -> bool:
+        """Whether run() must interpret every instruction via step()."""
+        return self.verbose or self.debug_step or self.stats is not None \
+            or bool(self.hooks)
+
+    def reset(self, args: Optional[List[int]] = None):
+        """
+        Prepare for another run of the same program with the given
+        arguments, laid out as the first run's were: reversed, followed by
+        the return value slot. Labels, compiled code and options are kept;
+        registers, the eval stack, the instruction budget and the stats
+        start over, and only the memory the previous run wrote is cleared:
+        the touched pages of a PagedMemory, or below the highest SP the run
+        reached for a list (programs are assumed not to store above SP, as
+        generated code never does).
+        """
+        params = list(reversed(args or [])) + [0]
+        if isinstance(self.memory, PagedMemory):
+            self.memory.clear()
+        else:
+            zero(self.memory, 0, min(self.max_sp, len(self.memory)))
+        self.memory[: len(params)] = params
+        self.stack.clear()
+        self.regs.update(PC=0, FP=0, SP=len(params))
+        self.max_sp = len(params)
+        self.max_insns = self.initial_max_insns
+        if self.stats is not None:
+            self.stats = ExecutionStats(self.insns)
+
+    def function_at(self, pc: int) -> str:
+        """
+        Label of the function containing pc, taken to be the nearest call
+        target at or before it (functions are laid out contiguously).
+        """
+        if self._entries is None:
+            self._entries = sorted({
+                self.labels[insn.label]
+                for insn, nxt in zip(self.insns, self.insns[1:] + [None])
+                if isinstance(insn, CallDirect) or
+                isinstance(insn, PushLabel) and isinstance(nxt, Call)})
+        i = bisect.bisect_right(self._entries, pc)
+        return self.insns[self._entries[i - 1]].label if i else TOPLEVEL
 
     def __repr__(self):
         return f"Execution({self.insns}, {self.stack}, {self.regs})"
@@ -77,6 +210,42 @@ class Execution:
                     self.regs["PC"] = self.labels[label]
                 else:
                     self.regs["PC"] += 1
+            case JumpIfLess(label=label):
+                top = self.stack.pop()
+                if self.stack.pop() < top:
+                    self.regs["PC"] = self.labels[label]
+                else:
+                    self.regs["PC"] += 1
+            case JumpIfLessEq(label=label):
+                top = self.stack.pop()
+                if self.stack.pop() <= top:
+                    self.regs["PC"] = self.labels[label]
+                else:
+                    self.regs["PC"] += 1
+            case JumpIfGreater(label=label):
+                top = self.stack.pop()
+                if self.stack.pop() > top:
+                    self.regs["PC"] = self.labels[label]
+                else:
+                    self.regs["PC"] += 1
+            case JumpIfGreaterEq(label=label):
+                top = self.stack.pop()
+                if self.stack.pop() >= top:
+                    self.regs["PC"] = self.labels[label]
+                else:
+                    self.regs["PC"] += 1
+            case JumpIfEq(label=label):
+                top = self.stack.pop()
+                if self.stack.pop() == top:
+                    self.regs["PC"] = self.labels[label]
+                else:
+                    self.regs["PC"] += 1
+            case JumpIfNotEq(label=label):
+                top = self.stack.pop()
+                if self.stack.pop() != top:
+                    self.regs["PC"] = self.labels[label]
+                else:
+                    self.regs["PC"] += 1
             case JumpIndirect():
                 self.regs["PC"] = self.stack.pop()
             case PushImmediate(value=value):
@@ -95,28 +264,67 @@ class Execution:
                 lval = self.stack.pop()
                 self.memory[lval] = rval
                 self.regs["PC"] += 1
+            case LoadLocal(offset=offset):
+                self.stack.append(self.memory[self.regs["FP"] + offset])
+                self.regs["PC"] += 1
+            case StoreLocal(offset=offset):
+                self.memory[self.regs["FP"] + offset] = self.stack.pop()
+                self.regs["PC"] += 1
             case Add():
                 top = self.stack.pop()
                 penultimate = self.stack.pop()
-                self.stack.append(penultimate + top)
+                result = penultimate + top
+                if self.int_fixup is not None:
+                    result = self.int_fixup(result)
+                self.stack.append(result)
                 self.regs["PC"] += 1
             case Sub():
                 top = self.stack.pop()
                 penultimate = self.stack.pop()
-                self.stack.append(penultimate - top)
+                result = penultimate - top
+                if self.int_fixup is not None:
+                    result = self.int_fixup(result)
+                self.stack.append(result)
                 self.regs["PC"] += 1
             case Mul():
                 top = self.stack.pop()
                 penultimate = self.stack.pop()
-                self.stack.append(penultimate * top)
+                result = penultimate * top
+                if self.int_fixup is not None:
+                    result = self.int_fixup(result)
+                self.stack.append(result)
                 self.regs["PC"] += 1
             case Div():
                 top = self.stack.pop()
                 penultimate = self.stack.pop()
-                self.stack.append(penultimate // top)
+                result = penultimate // top
+                if self.int_fixup is not None:
+                    result = self.int_fixup(result)
+                self.stack.append(result)
+                self.regs["PC"] += 1
+            case AddImm(value=value):
+                result = self.stack[-1] + value
+                if self.int_fixup is not None:
+                    result = self.int_fixup(result)
+                self.stack[-1] = result
+                self.regs["PC"] += 1
+            case SubImm(value=value):
+                result = self.stack[-1] - value
+                if self.int_fixup is not None:
+                    result = self.int_fixup(result)
+                self.stack[-1] = result
+                self.regs["PC"] += 1
+            case MulImm(value=value):
+                result = self.stack[-1] * value
+                if self.int_fixup is not None:
+                    result = self.int_fixup(result)
+                self.stack[-1] = result
                 self.regs["PC"] += 1
             case Negate():
-                self.stack.append(-self.stack.pop())
+                result = -self.stack.pop()
+                if self.int_fixup is not None:
+                    result = self.int_fixup(result)
+                self.stack.append(result)
                 self.regs["PC"] += 1
             case LessThan():
                 top = self.stack.pop()
@@ -148,6 +356,24 @@ class Execution:
                 penultimate = self.stack.pop()
                 self.stack.append(int(penultimate != top))
                 self.regs["PC"] += 1
+            case LessThanImm(value=value):
+                self.stack[-1] = int(self.stack[-1] < value)
+                self.regs["PC"] += 1
+            case GreaterThanImm(value=value):
+                self.stack[-1] = int(self.stack[-1] > value)
+                self.regs["PC"] += 1
+            case LessThanEqualImm(value=value):
+                self.stack[-1] = int(self.stack[-1] <= value)
+                self.regs["PC"] += 1
+            case GreaterThanEqualImm(value=value):
+                self.stack[-1] = int(self.stack[-1] >= value)
+                self.regs["PC"] += 1
+            case EqualImm(value=value):
+                self.stack[-1] = int(self.stack[-1] == value)
+                self.regs["PC"] += 1
+            case NotEqualImm(value=value):
+                self.stack[-1] = int(self.stack[-1] != value)
+                self.regs["PC"] += 1
             case Not():
                 self.stack.append(int(self.stack.pop() == 0))
                 self.regs["PC"] += 1
@@ -164,11 +390,33 @@ class Execution:
                 self.stack.append(self.regs["SP"] + offset)
                 self.regs["PC"] += 1
             case PopSP():
-                self.regs["SP"] = self.stack.pop()
+                sp = self.regs["SP"] = self.stack.pop()
+                if sp > self.max_sp:
+                    self.max_sp = sp
                 self.regs["PC"] += 1
             case Pop():
                 self.stack.pop()
                 self.regs["PC"] += 1
+            case PopN(n=n):
+                if n:
+                    del self.stack[-n:]
+                self.regs["PC"] += 1
+            case AllocZero(n=n):
+                sp = self.regs["SP"]
+                zero(self.memory, sp, sp + n)
+                sp = self.regs["SP"] = sp + n
+                if sp > self.max_sp:
+                    self.max_sp = sp
+                self.regs["PC"] += 1
+            case Dup():
+                self.stack.append(self.stack[-1])
+                self.regs["PC"] += 1
+            case Over():
+                self.stack.append(self.stack[-2])
+                self.regs["PC"] += 1
+            case Rot():
+                self.stack.append(self.stack.pop(-3))
+                self.regs["PC"] += 1
             case Swap():
                 top = self.stack.pop()
                 penultimate = self.stack.pop()
@@ -180,11 +428,40 @@ class Execution:
                 retattr = self.regs["PC"] + 1
                 self.regs["PC"] = self.stack.pop()
                 self.stack.append(retattr)
+            case CallDirect(label=label, argc=argc, frame_size=frame_size):
+                sp = self.regs["SP"]
+                size = len(self.stack) - argc
+                args = self.stack[size:]
+                args.reverse()
+                count_addr = sp + size
+                fp = count_addr + argc + 2
+                header = [0, self.regs["PC"] + 1, self.regs["FP"], count_addr]
+                self.memory[sp: fp + 3 + frame_size] = \
+                    self.stack[:size] + [size] + args + header + \
+                    [0] * frame_size
+                self.regs["FP"] = fp
+                self.regs["SP"] = fp + 3 + frame_size
+                if self.regs["SP"] > self.max_sp:
+                    self.max_sp = self.regs["SP"]
+                self.stack = []
+                self.regs["PC"] = self.labels[label]
+            case Ret():
+                fp = self.regs["FP"]
+                ret, retaddr, caller_fp, count_addr = \
+                    self.memory[fp - 1: fp + 3]
+                size = self.memory[count_addr]
+                self.stack = self.memory[count_addr - size: count_addr]
+                self.stack.append(ret)
+                self.regs["SP"] = count_addr - size
+                self.regs["FP"] = caller_fp
+                self.regs["PC"] = retaddr
             case SaveEvalStack():
                 sp = self.regs["SP"]
                 size = len(self.stack)
                 self.memory[sp: sp + size + 1] = self.stack + [size]
                 self.regs["SP"] += size + 1
+                if self.regs["SP"] > self.max_sp:
+                    self.max_sp = self.regs["SP"]
                 self.stack = []
                 self.regs["PC"] += 1
             case RestoreEvalStack():
@@ -200,10 +477,117 @@ class Execution:
                 raise Exception(f"Unknown instruction: {insn}")
         return self
 
-    def run(self):
+    def _observed_step(self) -> Optional["Execution"]:
+        hooks = self.hooks
+        pc = self.regs["PC"]
+        insn = self.insns[pc]
+        top = self.stack[-1] if self.stack else None
+        below = self.stack[-2] if len(self.stack) > 1 else None
+        sp = self.regs["SP"]
+        o = Execution.step(self)
+        match insn:
+            case _ if isinstance(insn, BRANCHES):
+                target = self.labels[insn.label]
+                taken = self.regs["PC"] == target
+                for hook in hooks.get("on_branch", ()):
+                    hook(self, pc, target, taken)
+            case Call():
+                for hook in hooks.get("on_call", ()):
+                    hook(self, pc, top)
+            case CallDirect():
+                # The saved eval stack, arguments, header and zeroed
+                # locals fill [old SP, new SP)
+                for hook in hooks.get("on_store", ()):
+                    for addr in range(sp, self.regs["SP"]):
+                        hook(self, pc, addr, self.memory[addr])
+                for hook in hooks.get("on_call", ()):
+                    hook(self, pc, self.regs["PC"])
+            case Ret():
+                for hook in hooks.get("on_return", ()):
+                    hook(self, pc, self.regs["PC"])
+            case JumpIndirect():
+                # Return addresses always follow a Call
+                if top > 0 and isinstance(self.insns[top - 1], Call):
+                    for hook in hooks.get("on_return", ()):
+                        hook(self, pc, top)
+                else:
+                    for hook in hooks.get("on_branch", ()):
+                        hook(self, pc, top, True)
+            case Store():
+                for hook in hooks.get("on_store", ()):
+                    hook(self, pc, below, top)
+            case StoreLocal(offset=offset):
+                for hook in hooks.get("on_store", ()):
+                    hook(self, pc, self.regs["FP"] + offset, top)
+            case AllocZero() | SaveEvalStack():
+                # They write [old SP, new SP)
+                for hook in hooks.get("on_store", ()):
+                    for addr in range(sp, self.regs["SP"]):
+                        hook(self, pc, addr, self.memory[addr])
+            case Print():
+                for hook in hooks.get("on_print", ()):
+                    hook(self, pc, top)
+            case Halt():
+                for hook in hooks.get("on_halt", ()):
+                    hook(self, pc)
+        return o
+
+    def run(self) -> RunResult:
+        """
+        Run until Halt, until max_insns instructions have executed or until
+        the wall_time/cpu_time limit is exceeded, whichever comes first.
+        max_insns is left holding the unused part of the budget.
+        """
         if self.verbose:
             print("Begin Execution")
             self.dump_state()
+        timed = self.wall_time is not None or self.cpu_time is not None
+        if timed:
+            wall_deadline = None if self.wall_time is None \
+                else time.monotonic() + self.wall_time
+            cpu_deadline = None if self.cpu_time is None \
+                else time.process_time() + self.cpu_time
+        remaining = self.max_insns
+        executed = 0
+        reason = "max_insns"
+        try:
+            while remaining > 0:
+                n = min(self.check_every, remaining) if timed else remaining
+                self.max_insns = n
+                try:
+                    halted = self._run()
+                finally:
+                    executed += n - self.max_insns
+                    remaining -= n - self.max_insns
+                if halted:
+                    reason = "halt"
+                    break
+                if not timed:
+                    continue
+                if wall_deadline is not None \
+                        and time.monotonic() >= wall_deadline:
+                    reason = "wall_time"
+                    break
+                if cpu_deadline is not None \
+                        and time.process_time() >= cpu_deadline:
+                    reason = "cpu_time"
+                    break
+        finally:
+            self.max_insns = remaining
+
+        if self.verbose:
+            print("End Execution")
+            self.dump_memory_usage()
+        pc = self.regs["PC"]
+        return RunResult(reason, pc, executed, self.function_at(pc))
+
+    def _run(self) -> bool:
+        """
+        Execute at most max_insns instructions, counting max_insns down.
+        Returns whether a Halt was executed. Engines override this.
+        """
+        if self.stats is not None:
+            return self._run_with_stats()
         o = self
 
         while o is not None:
@@ -215,7 +599,46 @@ class Execution:
             self.max_insns -= 1
             if self.max_insns == 0:
                 break
+        return o is None
 
-        if self.verbose:
-            print("End Execution")
+    def _run_with_stats(self) -> bool:
+        # Kept apart from _run() so that runs without stats pay nothing
+        stats = self.stats
+        pc_counts = stats.pc_counts
+        regs = self.regs
+        start = time.perf_counter()
+        o = self
+
+        while o is not None:
+            if self.debug_step:
+                input("Enter>>")
+            pc = regs["PC"]
+            pc_counts[pc] += 1
+            insn = self.insns[pc]
+            if isinstance(insn, SaveEvalStack):
+                stats.words_saved += len(self.stack) + 1
+            elif isinstance(insn, RestoreEvalStack):
+                stats.words_restored += self.memory[regs["SP"] - 1] + 1
+            elif isinstance(insn, CallDirect):
+                stats.words_saved += len(self.stack) - insn.argc + 1
+            elif isinstance(insn, Ret):
+                count_addr = self.memory[regs["FP"] + 2]
+                stats.words_restored += self.memory[count_addr] + 1
+            o = self.step()
+            if len(self.stack) > stats.max_stack_depth:
+                stats.max_stack_depth = len(self.stack)
+            if self.verbose:
+                self.dump_state()
+            self.max_insns -= 1
+            if self.max_insns == 0:
+                break
+
+        stats.wall_time += time.perf_counter() - start
+        return o is None
+
+    def dump_memory_usage(self):
+        print(f"      max SP={self.max_sp}")
+        if isinstance(self.memory, PagedMemory):
+            print(f"      pages ={self.memory.pages_touched} touched "
+                  f"of {len(self.memory) // PAGE_WORDS}")
 
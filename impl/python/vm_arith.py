@@ -0,0 +1,32 @@
+from typing import Callable, Optional
+
+INT64_MIN = -(1 << 63)
+INT64_MAX = (1 << 63) - 1
+_UINT64_MASK = (1 << 64) - 1
+
+
+class IntegerOverflow(Exception):
+    pass
+
+
+def wrap_int64(v: int) -> int:
+    """Two's complement wrap-around, like int64_t arithmetic in C."""
+    if INT64_MIN <= v <= INT64_MAX:
+        return v
+    return ((v - INT64_MIN) & _UINT64_MASK) + INT64_MIN
+
+
+def trap_int64(v: int) -> int:
+    """Raise IntegerOverflow when v does not fit in an int64."""
+    if INT64_MIN <= v <= INT64_MAX:
+        return v
+    raise IntegerOverflow(f"int64 overflow: {v}")
+
+
+# Result fixup applied by Add, Sub, Mul, Div and Negate.
+# None keeps Python's arbitrary-precision ints.
+ARITH_MODES: dict[str, Optional[Callable[[int], int]]] = {
+    "bigint": None,
+    "wrap": wrap_int64,
+    "trap": trap_int64,
+}
@@ -0,0 +1,204 @@
+"""
+Control-flow cleanup of linked VM programs.
+
+Works on the flat instruction list of a whole program, generated or hand
+written, and repeats until nothing changes:
+
+    threading     a branch to a Jump goes straight to the Jump's target,
+                  a Jump to a Ret or Halt becomes that Ret or Halt
+    inversion     JumpIfX A; Jump B; lab A  ->  JumpIfNotX B; lab A
+    next          a Jump to the next instruction is removed, a conditional
+                  one becomes a Pop of its operands
+    unreachable   instructions no path from the start reaches are removed
+    labels        labels nothing refers to are removed
+    merging       a block only entered by a Jump, and not fallen into, is
+                  moved to the Jump's place
+
+As in vm_verify, code addresses are assumed to come only from PushLabel
+(or be return addresses of Call), so the label a PushLabel pushes counts
+as reached once the PushLabel is.
+"""
+from collections import Counter
+from typing import Optional
+
+from vm_insns import *
+from vm_verify import link_labels
+
+# Instructions after which control never falls through
+_TERMINATORS = (Jump, JumpIndirect, Ret, Halt)
+
+_CONDITIONALS = tuple(b for b in BRANCHES if b is not Jump)
+
+_NEGATED: dict[type, type] = {
+    JumpIfZero: JumpIfNotZero,
+    JumpIfNotZero: JumpIfZero,
+    JumpIfLess: JumpIfGreaterEq,
+    JumpIfGreaterEq: JumpIfLess,
+    JumpIfLessEq: JumpIfGreater,
+    JumpIfGreater: JumpIfLessEq,
+    JumpIfEq: JumpIfNotEq,
+    JumpIfNotEq: JumpIfEq,
+}
+
+
+# This is the entry point.
+def simplify(insns: list[Insn], stats: Optional[Counter] = None) \
+        -> list[Insn]:
+    """
+    Clean up the control flow of insns; counts of the changes made are
+    added to stats. Raises vm_verify.VerifyError if a label is undefined
+    or defined twice.
+    """
+    link_labels(insns)
+    stats = Counter() if stats is None else stats
+    insns = list(insns)
+    changed = True
+    while changed:
+        changed = False
+        for step in (_thread, _shortcut, _remove_unreachable,
+                     _remove_labels, _merge):
+            new = step(insns, stats)
+            if new is not None:
+                insns = new
+                changed = True
+    return insns
+
+
+def _labels(insns: list[Insn]) -> dict[str, int]:
+    return {insn.label: i for i, insn in enumerate(insns)
+            if isinstance(insn, Label)}
+
+
+def _references(insns: list[Insn]) -> Counter:
+    return Counter(insn.label for insn in insns
+                   if not isinstance(insn, Label)
+                   and getattr(insn, "label", None) is not None)
+
+
+def _next_real(insns: list[Insn], i: int) -> int:
+    """The index of the first instruction from i on that is not a label or
+    Noop."""
+    while i < len(insns) and isinstance(insns[i], (Label, Noop)):
+        i += 1
+    return i
+
+
+def _thread(insns: list[Insn], stats: Counter) -> Optional[list[Insn]]:
+    labels = _labels(insns)
+    changed = False
+    for i, insn in enumerate(insns):
+        if not isinstance(insn, BRANCHES):
+            continue
+        target = insn.label
+        seen = {target}
+        while True:
+            j = _next_real(insns, labels[target] + 1)
+            if j == len(insns) or not isinstance(insns[j], Jump) \
+                    or insns[j].label in seen:
+                break
+            target = insns[j].label
+            seen.add(target)
+        if target != insn.label:
+            insns[i] = type(insn)(target, insn.comment)
+            stats["jumps threaded"] += 1
+            changed = True
+        j = _next_real(insns, labels[target] + 1)
+        if isinstance(insn, Jump) and j < len(insns) \
+                and isinstance(insns[j], (Ret, Halt)):
+            insns[i] = type(insns[j])(insns[j].comment)
+            stats["jumps to exits"] += 1
+            changed = True
+    return insns if changed else None
+
+
+def _shortcut(insns: list[Insn], stats: Counter) -> Optional[list[Insn]]:
+    labels = _labels(insns)
+    out: list[Insn] = []
+    changed = False
+    i = 0
+    while i < len(insns):
+        insn = insns[i]
+        if isinstance(insn, BRANCHES):
+            after = _next_real(insns, i + 1)
+            target = labels[insn.label]
+            if i < target <= after:
+                # Branch to the next instruction
+                if isinstance(insn, (JumpIfZero, JumpIfNotZero)):
+                    out.append(Pop("branch to next"))
+                elif isinstance(insn, _CONDITIONALS):
+                    out.append(PopN(2, "branch to next"))
+                stats["branches to next"] += 1
+                changed = True
+                i += 1
+                continue
+            if isinstance(insn, _CONDITIONALS) and after < len(insns) \
+                    and isinstance(insns[after], Jump) \
+                    and i + 1 == after \
+                    and after < target <= _next_real(insns, after + 1):
+                # Branch over a Jump
+                out.append(_NEGATED[type(insn)](insns[after].label,
+                                                insn.comment))
+                stats["branches inverted"] += 1
+                changed = True
+                i += 2
+                continue
+        out.append(insn)
+        i += 1
+    return out if changed else None
+
+
+def _remove_unreachable(insns: list[Insn], stats: Counter) \
+        -> Optional[list[Insn]]:
+    if not insns:
+        return None
+    labels = _labels(insns)
+    reached = {0}
+    work = [0]
+    while work:
+        pc = work.pop()
+        insn = insns[pc]
+        succs = [] if isinstance(insn, _TERMINATORS) else [pc + 1]
+        if not isinstance(insn, Label) \
+                and getattr(insn, "label", None) is not None:
+            succs.append(labels[insn.label])
+        for succ in succs:
+            if succ < len(insns) and succ not in reached:
+                reached.add(succ)
+                work.append(succ)
+    if len(reached) == len(insns):
+        return None
+    stats["unreachable removed"] += len(insns) - len(reached)
+    return [insn for pc, insn in enumerate(insns) if pc in reached]
+
+
+def _remove_labels(insns: list[Insn], stats: Counter) \
+        -> Optional[list[Insn]]:
+    refs = _references(insns)
+    out = [insn for insn in insns
+           if not isinstance(insn, Label) or refs[insn.label]]
+    if len(out) == len(insns):
+        return None
+    stats["labels removed"] += len(insns) - len(out)
+    return out
+
+
+def _merge(insns: list[Insn], stats: Counter) -> Optional[list[Insn]]:
+    labels = _labels(insns)
+    refs = _references(insns)
+    for i, insn in enumerate(insns):
+        if not isinstance(insn, Jump) or refs[insn.label] != 1:
+            continue
+        start = labels[insn.label]
+        if start == 0 or not isinstance(insns[start - 1], _TERMINATORS):
+            continue
+        end = start
+        while end < len(insns) and not isinstance(insns[end], _TERMINATORS):
+            end += 1
+        if end == len(insns) or start <= i <= end:
+            continue
+        block = insns[start:end + 1]
+        rest = insns[:start] + insns[end + 1:]
+        at = i if i < start else i - len(block)
+        stats["blocks merged"] += 1
+        return rest[:at] + block + rest[at + 1:]
+    return None
@@ -0,0 +1,350 @@
+"""
+Translation of VM instructions into Python source.
+
+Generated code keeps the VM state in locals of the generated function:
+
+    stack, push, pop   the eval stack (always the list object exe.stack)
+    mem                exe.memory
+    FP, SP, pc         registers, written back to exe.regs on exit
+    budget             exe.max_insns
+    max_sp             exe.max_sp
+    fix                exe.int_fixup (only referenced when not None)
+    out                exe.vm_stdout
+
+and can call the helpers in GLOBALS.
+
+Save/RestoreEvalStack, CallDirect and Ret mutate the stack list in place
+so that push/pop stay bound to it. When the number of words the first
+three move is known (vm_verify's FunctionInfo.spills) and at most
+MAX_UNROLLED_SPILL, they move them with fixed-size code instead of list
+slicing, and with no copy at all when it is 0.
+"""
+from typing import Callable, Optional
+
+from vm_insns import *
+from vm_memory import zero
+
+MAX_UNROLLED_SPILL = 4
+
+# Instructions that end a basic block: they may transfer control
+# somewhere other than pc + 1.
+BLOCK_ENDERS = (*BRANCHES, JumpIndirect, Call, CallDirect, Ret, Halt)
+
+_BINOPS: dict[type, str] = {
+    Add: "{x} + {y}",
+    Sub: "{x} - {y}",
+    Mul: "{x} * {y}",
+    Div: "{x} // {y}",
+}
+
+_BINOPS_IMM: dict[type, str] = {
+    AddImm: "+",
+    SubImm: "-",
+    MulImm: "*",
+}
+
+_COMPARES: dict[type, str] = {
+    LessThan: "<",
+    GreaterThan: ">",
+    LessThanEqual: "<=",
+    GreaterThanEqual: ">=",
+    Equal: "==",
+    NotEqual: "!=",
+}
+
+_COMPARES_IMM: dict[type, str] = {
+    LessThanImm: "<",
+    GreaterThanImm: ">",
+    LessThanEqualImm: "<=",
+    GreaterThanEqualImm: ">=",
+    EqualImm: "==",
+    NotEqualImm: "!=",
+}
+
+# Globals of every generated function
+GLOBALS = {"zero": zero}
+
+PROLOGUE = [
+    "stack = exe.stack",
+    "push = stack.append",
+    "pop = stack.pop",
+    "mem = exe.memory",
+    "regs = exe.regs",
+    "FP = regs['FP']",
+    "SP = regs['SP']",
+    "pc = regs['PC']",
+    "budget = exe.max_insns",
+    "max_sp = exe.max_sp",
+    "fix = exe.int_fixup",
+    "out = exe.vm_stdout",
+]
+
+EPILOGUE = [
+    "regs['FP'] = FP",
+    "regs['SP'] = SP",
+    "regs['PC'] = pc",
+    "exe.max_insns = budget",
+    "exe.max_sp = max_sp",
+]
+
+
+def _arith(expr: str, fixup: bool) -> str:
+    return f"fix({expr})" if fixup else expr
+
+
+def emit_straight(insn: Insn, fixup: bool, labels: dict[str, int],
+                  spill: Optional[int] = None) -> list[str]:
+    """
+    Source for an instruction that always falls through to pc + 1. spill is
+    the known number of words a Save/RestoreEvalStack moves, if any.
+    """
+    unrolled = spill is not None and spill <= MAX_UNROLLED_SPILL
+    match insn:
+        case Label() | Noop():
+            return []
+        case PushImmediate(value=value):
+            return [f"push({value!r})"]
+        case PushLabel(label=label):
+            return [f"push({labels[label]})"]
+        case Load():
+            return ["stack[-1] = mem[stack[-1]]"]
+        case Store():
+            return ["v = pop()", "mem[pop()] = v"]
+        case LoadLocal(offset=offset):
+            return [f"push(mem[FP + {offset}])"]
+        case StoreLocal(offset=offset):
+            return [f"mem[FP + {offset}] = pop()"]
+        case Add() | Sub() | Mul() | Div():
+            expr = _BINOPS[type(insn)].format(x="stack[-1]", y="v")
+            return ["v = pop()", f"stack[-1] = {_arith(expr, fixup)}"]
+        case AddImm(value=value) | SubImm(value=value) | MulImm(value=value):
+            expr = f"stack[-1] {_BINOPS_IMM[type(insn)]} {value!r}"
+            return [f"stack[-1] = {_arith(expr, fixup)}"]
+        case Negate():
+            return [f"stack[-1] = {_arith('-stack[-1]', fixup)}"]
+        case LessThan() | GreaterThan() | LessThanEqual() | \
+                GreaterThanEqual() | Equal() | NotEqual():
+            op = _COMPARES[type(insn)]
+            return ["v = pop()", f"stack[-1] = 1 if stack[-1] {op} v else 0"]
+        case _ if type(insn) in _COMPARES_IMM:
+            op = _COMPARES_IMM[type(insn)]
+            return [f"stack[-1] = 1 if stack[-1] {op} {insn.value!r} else 0"]
+        case Not():
+            return ["stack[-1] = 1 if stack[-1] == 0 else 0"]
+        case Print():
+            return ["print(pop(), file=out)"]
+        case PushFP(offset=offset):
+            return [f"push(FP + {offset})"]
+        case PopFP():
+            return ["FP = pop()"]
+        case PushSP(offset=offset):
+            return [f"push(SP + {offset})"]
+        case PopSP():
+            return ["SP = pop()", "if SP > max_sp: max_sp = SP"]
+        case Pop():
+            return ["pop()"]
+        case PopN(n=n):
+            return [f"del stack[-{n}:]"] if n else []
+        case AllocZero(n=n):
+            return [f"zero(mem, SP, SP + {n})", f"SP += {n}",
+                    "if SP > max_sp: max_sp = SP"]
+        case Swap():
+            return ["stack[-1], stack[-2] = stack[-2], stack[-1]"]
+        case Dup():
+            return ["push(stack[-1])"]
+        case Over():
+            return ["push(stack[-2])"]
+        case Rot():
+            return ["push(stack.pop(-3))"]
+        case SaveEvalStack() if unrolled:
+            words = [f"stack[{i}]" for i in range(spill)] + [str(spill)]
+            return [f"mem[SP: SP + {spill + 1}] = [{', '.join(words)}]",
+                    f"SP += {spill + 1}",
+                    "if SP > max_sp: max_sp = SP",
+                    *(["stack.clear()"] if spill else [])]
+        case SaveEvalStack():
+            return [
+                "v = len(stack)",
+                "mem[SP: SP + v + 1] = stack + [v]",
+                "SP += v + 1",
+                "if SP > max_sp: max_sp = SP",
+                "stack.clear()",
+            ]
+        case RestoreEvalStack() if unrolled:
+            return [*([f"stack[:0] = mem[SP - {spill + 1}: SP - 1]"]
+                      if spill else []),
+                    f"SP -= {spill + 1}"]
+        case RestoreEvalStack():
+            return [
+                "v = mem[SP - 1]",
+                "stack[:0] = mem[SP - v - 1: SP - 1]",
+                "SP -= v + 1",
+            ]
+        case _:
+            raise Exception(f"Cannot compile instruction: {dis(insn)}")
+
+
+def emit_call_direct(insn: CallDirect, pc: int,
+                     spill: Optional[int] = None) -> list[str]:
+    """
+    Source for the frame push of a CallDirect, leaving pc alone. spill is
+    the known number of words below the arguments, if any.
+    """
+    argc, size = insn.argc, insn.frame_size
+    zeros = f" + [0] * {size}" if size else ""
+    if spill is not None and spill <= MAX_UNROLLED_SPILL:
+        words = [f"stack[{i}]" for i in range(spill)] + [str(spill)] + \
+            [f"stack[{-1 - i}]" for i in range(argc)] + \
+            ["0", str(pc + 1), "FP", f"SP + {spill}"]
+        return [
+            f"mem[SP: SP + {spill + argc + 5 + size}] = "
+            f"[{', '.join(words)}]{zeros}",
+            f"FP = SP + {spill + argc + 2}",
+            f"SP = FP + {3 + size}",
+            "if SP > max_sp: max_sp = SP",
+            *(["stack.clear()"] if spill + argc else []),
+        ]
+    return [
+        f"v = len(stack) - {argc}",
+        "args = stack[v:]",
+        "args.reverse()",
+        "c = SP + v",
+        f"mem[SP: c + {argc + 5 + size}] = stack[:v] + [v] + args + "
+        f"[0, {pc + 1}, FP, c]{zeros}",
+        f"FP = c + {argc + 2}",
+        f"SP = FP + {3 + size}",
+        "if SP > max_sp: max_sp = SP",
+        "stack.clear()",
+    ]
+
+
+def emit_ret() -> list[str]:
+    """Source for a Ret that leaves the return address in v."""
+    return [
+        "r, v, fp, c = mem[FP - 1: FP + 3]",
+        "n = mem[c]",
+        "stack[:] = mem[c - n: c]",
+        "push(r)",
+        "SP = c - n",
+        "FP = fp",
+    ]
+
+
+def emit_branch(insn: Insn, pc: int, labels: dict[str, int],
+                spill: Optional[int] = None) -> list[str]:
+    """
+    Source that sets `pc` for a block-ending instruction (not Halt); spill
+    as for emit_call_direct.
+    """
+    match insn:
+        case Jump(label=label):
+            return [f"pc = {labels[label]}"]
+        case JumpIfZero(label=label):
+            return [f"pc = {labels[label]} if pop() == 0 else {pc + 1}"]
+        case JumpIfNotZero(label=label):
+            return [f"pc = {labels[label]} if pop() != 0 else {pc + 1}"]
+        case _ if type(insn) in COMPARE_BRANCHES:
+            op = COMPARE_BRANCHES[type(insn)]
+            return ["v = pop()",
+                    f"pc = {labels[insn.label]} if pop() {op} v else {pc + 1}"]
+        case JumpIndirect():
+            return ["pc = pop()"]
+        case Call():
+            return ["pc = pop()", f"push({pc + 1})"]
+        case CallDirect(label=label):
+            return [*emit_call_direct(insn, pc, spill),
+                    f"pc = {labels[label]}"]
+        case Ret():
+            return [*emit_ret(), "pc = v"]
+        case _:
+            raise Exception(f"Not a branch: {dis(insn)}")
+
+
+def basic_blocks(insns: list[Insn], pcs: set[int],
+                 entries: set[int]) -> dict[int, list[int]]:
+    """
+    Split the instructions at pcs into basic blocks keyed by leader pc.
+    Leaders are the given entries, labels and instructions following a
+    block ender. Halt is left out so that the interpreter executes it.
+    """
+    leaders = set(entries)
+    for pc in pcs:
+        if isinstance(insns[pc], Label):
+            leaders.add(pc)
+        elif isinstance(insns[pc], BLOCK_ENDERS):
+            leaders.add(pc + 1)
+    blocks: dict[int, list[int]] = {}
+    for leader in sorted(leaders & pcs):
+        if isinstance(insns[leader], Halt):
+            continue
+        block = [leader]
+        pc = leader
+        while not isinstance(insns[pc], BLOCK_ENDERS):
+            pc += 1
+            if pc not in pcs or pc in leaders or isinstance(insns[pc], Halt):
+                break
+            block.append(pc)
+        blocks[leader] = block
+    return blocks
+
+
+def compile_region(insns: list[Insn], labels: dict[str, int], pcs: set[int],
+                   entries: set[int], fixup: Optional[Callable[[int], int]],
+                   name: str = "region",
+                   spills: Optional[dict[int, int]] = None) \
+        -> tuple[Callable, dict[int, list[int]]]:
+    """
+    Compile the instructions at pcs into one Python function taking the
+    Execution. It runs block after block while pc stays on one of its block
+    leaders and the remaining budget covers the whole next block, then
+    writes the state back and returns the number of instructions executed.
+    If an instruction raises, the state is still written back, with pc at
+    the leader of the block that raised and the whole block charged to the
+    budget.
+
+    spills gives the statically known words moved by the eval stack saves
+    and restores among them (see vm_verify.FunctionInfo).
+
+    Returns the function and its blocks (leader pc -> block pcs).
+    """
+    spills = {} if spills is None else spills
+    blocks = basic_blocks(insns, pcs, entries)
+    src = [f"def {_identifier(name)}(exe):", *_indent(PROLOGUE, 1),
+           "    start = budget", "    try:", "        while True:"]
+    first = True
+    for leader, block in blocks.items():
+        src.append(f"            {'if' if first else 'elif'} pc == {leader}:")
+        first = False
+        body = [f"if budget < {len(block)}: break",
+                f"budget -= {len(block)}"]
+        for pc in block:
+            spill = spills.get(pc)
+            body.extend(emit_straight(insns[pc], fixup is not None, labels,
+                                      spill)
+                        if not isinstance(insns[pc], BLOCK_ENDERS) else
+                        emit_branch(insns[pc], pc, labels, spill))
+        last = block[-1]
+        if not isinstance(insns[last], BLOCK_ENDERS):
+            body.append(f"pc = {last + 1}")
+        src.extend(_indent(body, 4))
+    src.append("            else:" if blocks else "            if True:")
+    src.append("                break")
+    src.append("    finally:")
+    src.extend(_indent(EPILOGUE, 2))
+    src.append("    return start - budget")
+    return _build(src, name), blocks
+
+
+def _identifier(name: str) -> str:
+    return "".join(c if c.isalnum() else "_" for c in name) or "region"
+
+
+def _indent(lines: list[str], level: int) -> list[str]:
+    return ["    " * level + line for line in lines]
+
+
+def _build(src: list[str], name: str) -> Callable:
+    namespace = dict(GLOBALS)
+    code = compile("\n".join(src) + "\n", f"<compiled {name}>", "exec")
+    exec(code, namespace)
+    return namespace[_identifier(name)]
@@ -1,5 +1,8 @@
 from typing import Optional
 
+# Name of the code before the first function, entered at PC 0
+TOPLEVEL = "<toplevel>"
+
 
 class Insn:
     comment: str
@@ -79,6 +82,138 @@ class JumpIfNotZero(Insn):
         self.comment: Optional[str] = comment
 
 
+class JumpIfLess(Insn):
+    """
+    Verbose asm:  JumpIfLess <label:str>  [<comment:str>]
+    Concise asm:  jlt        <label:str>  [<comment:str>]
+
+    Stack:
+    |-----| <- TOS
+    | y   |
+    |-----|
+    | x   |
+    |-----|          |-----| <- TOS
+    | ... |          | ... |
+    Before            After
+
+    Side Effects: PC <- label iff x < y
+    """
+
+    def __init__(self, label: str, comment: Optional[str] = None):
+        self.label: str = label
+        self.comment: Optional[str] = comment
+
+
+class JumpIfLessEq(Insn):
+    """
+    Verbose asm:  JumpIfLessEq <label:str>  [<comment:str>]
+    Concise asm:  jle          <label:str>  [<comment:str>]
+
+    Stack:
+    |-----| <- TOS
+    | y   |
+    |-----|
+    | x   |
+    |-----|          |-----| <- TOS
+    | ... |          | ... |
+    Before            After
+
+    Side Effects: PC <- label iff x <= y
+    """
+
+    def __init__(self, label: str, comment: Optional[str] = None):
+        self.label: str = label
+        self.comment: Optional[str] = comment
+
+
+class JumpIfGreater(Insn):
+    """
+    Verbose asm:  JumpIfGreater <label:str>  [<comment:str>]
+    Concise asm:  jgt           <label:str>  [<comment:str>]
+
+    Stack:
+    |-----| <- TOS
+    | y   |
+    |-----|
+    | x   |
+    |-----|          |-----| <- TOS
+    | ... |          | ... |
+    Before            After
+
+    Side Effects: PC <- label iff x > y
+    """
+
+    def __init__(self, label: str, comment: Optional[str] = None):
+        self.label: str = label
+        self.comment: Optional[str] = comment
+
+
+class JumpIfGreaterEq(Insn):
+    """
+    Verbose asm:  JumpIfGreaterEq <label:str>  [<comment:str>]
+    Concise asm:  jge             <label:str>  [<comment:str>]
+
+    Stack:
+    |-----| <- TOS
+    | y   |
+    |-----|
+    | x   |
+    |-----|          |-----| <- TOS
+    | ... |          | ... |
+    Before            After
+
+    Side Effects: PC <- label iff x >= y
+    """
+
+    def __init__(self, label: str, comment: Optional[str] = None):
+        self.label: str = label
+        self.comment: Optional[str] = comment
+
+
+class JumpIfEq(Insn):
+    """
+    Verbose asm:  JumpIfEq <label:str>  [<comment:str>]
+    Concise asm:  jeq      <label:str>  [<comment:str>]
+
+    Stack:
+    |-----| <- TOS
+    | y   |
+    |-----|
+    | x   |
+    |-----|          |-----| <- TOS
+    | ... |          | ... |
+    Before            After
+
+    Side Effects: PC <- label iff x == y
+    """
+
+    def __init__(self, label: str, comment: Optional[str] = None):
+        self.label: str = label
+        self.comment: Optional[str] = comment
+
+
+class JumpIfNotEq(Insn):
+    """
+    Verbose asm:  JumpIfNotEq <label:str>  [<comment:str>]
+    Concise asm:  jne         <label:str>  [<comment:str>]
+
+    Stack:
+    |-----| <- TOS
+    | y   |
+    |-----|
+    | x   |
+    |-----|          |-----| <- TOS
+    | ... |          | ... |
+    Before            After
+
+    Side Effects: PC <- label iff x != y
+    """
+
+    def __init__(self, label: str, comment: Optional[str] = None):
+        self.label: str = label
+        self.comment: Optional[str] = comment
+
+
 class JumpIndirect(Insn):
     """
     Verbose asm:  JumpIndirect  [<comment:str>]
@@ -210,6 +345,60 @@ class Div(Insn):
         self.comment: Optional[str] = comment
 
 
+class AddImm(Insn):
+    """
+    Verbose asm:  AddImm <value:int>  [<comment:str>]
+    Concise asm:  addi   <value:int>  [<comment:str>]
+
+    Stack:
+    |-----| <- TOS   |-------| <- TOS
+    | x   |          | x+imm |
+    |-----|          |-------|
+    | ... |          | ...   |
+    Before            After
+    """
+
+    def __init__(self, value: int, comment: Optional[str] = None):
+        self.value: int = value
+        self.comment: Optional[str] = comment
+
+
+class SubImm(Insn):
+    """
+    Verbose asm:  SubImm <value:int>  [<comment:str>]
+    Concise asm:  subi   <value:int>  [<comment:str>]
+
+    Stack:
+    |-----| <- TOS   |-------| <- TOS
+    | x   |          | x-imm |
+    |-----|          |-------|
+    | ... |          | ...   |
+    Before            After
+    """
+
+    def __init__(self, value: int, comment: Optional[str] = None):
+        self.value: int = value
+        self.comment: Optional[str] = comment
+
+
+class MulImm(Insn):
+    """
+    Verbose asm:  MulImm <value:int>  [<comment:str>]
+    Concise asm:  muli   <value:int>  [<comment:str>]
+
+    Stack:
+    |-----| <- TOS   |-------| <- TOS
+    | x   |          | x*imm |
+    |-----|          |-------|
+    | ... |          | ...   |
+    Before            After
+    """
+
+    def __init__(self, value: int, comment: Optional[str] = None):
+        self.value: int = value
+        self.comment: Optional[str] = comment
+
+
 class Negate(Insn):
     """
     Verbose asm:  Negate  [<comment:str>]
@@ -341,6 +530,114 @@ class NotEqual(Insn):
         self.comment: Optional[str] = comment
 
 
+class LessThanImm(Insn):
+    """
+    Verbose asm:  LessThanImm <value:int>  [<comment:str>]
+    Concise asm:  lti         <value:int>  [<comment:str>]
+
+    Stack:
+    |-----| <- TOS   |-------| <- TOS
+    | x   |          | x<imm |
+    |-----|          |-------|
+    | ... |          | ...   |
+    Before            After
+    """
+
+    def __init__(self, value: int, comment: Optional[str] = None):
+        self.value: int = value
+        self.comment: Optional[str] = comment
+
+
+class GreaterThanImm(Insn):
+    """
+    Verbose asm:  GreaterThanImm <value:int>  [<comment:str>]
+    Concise asm:  gti            <value:int>  [<comment:str>]
+
+    Stack:
+    |-----| <- TOS   |-------| <- TOS
+    | x   |          | x>imm |
+    |-----|          |-------|
+    | ... |          | ...   |
+    Before            After
+    """
+
+    def __init__(self, value: int, comment: Optional[str] = None):
+        self.value: int = value
+        self.comment: Optional[str] = comment
+
+
+class LessThanEqualImm(Insn):
+    """
+    Verbose asm:  LessThanEqualImm <value:int>  [<comment:str>]
+    Concise asm:  leqi             <value:int>  [<comment:str>]
+
+    Stack:
+    |-----| <- TOS   |--------| <- TOS
+    | x   |          | x<=imm |
+    |-----|          |--------|
+    | ... |          | ...    |
+    Before            After
+    """
+
+    def __init__(self, value: int, comment: Optional[str] = None):
+        self.value: int = value
+        self.comment: Optional[str] = comment
+
+
+class GreaterThanEqualImm(Insn):
+    """
+    Verbose asm:  GreaterThanEqualImm <value:int>  [<comment:str>]
+    Concise asm:  geqi                <value:int>  [<comment:str>]
+
+    Stack:
+    |-----| <- TOS   |--------| <- TOS
+    | x   |          | x>=imm |
+    |-----|          |--------|
+    | ... |          | ...    |
+    Before            After
+    """
+
+    def __init__(self, value: int, comment: Optional[str] = None):
+        self.value: int = value
+        self.comment: Optional[str] = comment
+
+
+class EqualImm(Insn):
+    """
+    Verbose asm:  EqualImm <value:int>  [<comment:str>]
+    Concise asm:  eqi      <value:int>  [<comment:str>]
+
+    Stack:
+    |-----| <- TOS   |--------| <- TOS
+    | x   |          | x==imm |
+    |-----|          |--------|
+    | ... |          | ...    |
+    Before            After
+    """
+
+    def __init__(self, value: int, comment: Optional[str] = None):
+        self.value: int = value
+        self.comment: Optional[str] = comment
+
+
+class NotEqualImm(Insn):
+    """
+    Verbose asm:  NotEqualImm <value:int>  [<comment:str>]
+    Concise asm:  neqi        <value:int>  [<comment:str>]
+
+    Stack:
+    |-----| <- TOS   |--------| <- TOS
+    | x   |          | x!=imm |
+    |-----|          |--------|
+    | ... |          | ...    |
+    Before            After
+    """
+
+    def __init__(self, value: int, comment: Optional[str] = None):
+        self.value: int = value
+        self.comment: Optional[str] = comment
+
+
 class Not(Insn):
     """
     Verbose asm:  Not  [<comment:str>]
@@ -396,6 +693,44 @@ class Store(Insn):
         self.comment: Optional[str] = comment
 
 
+class LoadLocal(Insn):
+    """
+    Verbose asm:  LoadLocal <offset:int>  [<comment:str>]
+    Concise asm:  ldl       <offset:int>  [<comment:str>]
+
+    Stack:
+                     |----------------| <- TOS
+                     | mem[FP+offset] |
+    |-----| <- TOS   |----------------|
+    | ... |          | ...            |
+    Before            After
+    """
+
+    def __init__(self, offset: int, comment: Optional[str] = None):
+        self.offset: int = offset
+        self.comment: Optional[str] = comment
+
+
+class StoreLocal(Insn):
+    """
+    Verbose asm:  StoreLocal <offset:int>  [<comment:str>]
+    Concise asm:  stl        <offset:int>  [<comment:str>]
+
+    Stack:
+    |-----| <- TOS
+    | v   |
+    |-----|          |-----| <- TOS
+    | ... |          | ... |
+    Before            After
+
+    Side Effects: mem[FP+offset] <- v
+    """
+
+    def __init__(self, offset: int, comment: Optional[str] = None):
+        self.offset: int = offset
+        self.comment: Optional[str] = comment
+
+
 class Print(Insn):
     """
     Verbose asm:  Print  [<comment:str>]
@@ -508,6 +843,85 @@ class Call(Insn):
         self.comment: Optional[str] = comment
 
 
+class CallDirect(Insn):
+    """
+    Verbose asm:  CallDirect <label:str> <argc:int> <frame_size:int>  [<comment:str>]
+    Concise asm:  calld      <label:str> <argc:int> <frame_size:int>  [<comment:str>]
+
+    Stack:
+    |-----| <- TOS
+    | aN  |
+    |-----|
+    | ... |
+    |-----|
+    | a0  |
+    |-----|
+    | vK  |
+    |-----|
+    | ... |
+    |-----|
+    | v0  |
+    |=====|          |=====| <- TOS
+    Before            After
+
+    Memory:
+                    |------------| <- SP
+                    | 0 x frame_size (locals)
+                    |------------|
+                    | C          |   FP+2
+                    | caller FP  |   FP+1
+                    | retaddr    |   FP+0 <- FP
+                    | 0 (RET)    |   FP-1
+                    | a0         |   FP-2
+                    | ...        |
+                    | aN         |   FP-2-N
+                    | K          |   C
+                    | vK         |
+                    | ...        |
+                    | v0         |
+    |-----| <- SP   |------------|
+    | ... |         | ...        |
+    Before           After
+
+    Side Effects: saves the rest of the eval stack like SaveEvalStack,
+    pushes a frame holding the argc arguments, FP <- new frame,
+    PC <- label
+    """
+
+    def __init__(self, label: str, argc: int, frame_size: int,
+                 comment: Optional[str] = None):
+        self.label: str = label
+        self.argc: int = argc
+        self.frame_size: int = frame_size
+        self.comment: Optional[str] = comment
+
+
+class Ret(Insn):
+    """
+    Verbose asm:  Ret  [<comment:str>]
+    Concise asm:  ret  [<comment:str>]
+
+    Stack:
+                     |-----| <- TOS
+                     | RET |
+                     |-----|
+                     | vK  |
+                     |-----|
+                     | ... |
+                     |-----|
+                     | v0  |
+    |=====| <- TOS   |=====|
+    Before            After
+
+    Side Effects: pops the frame pushed by CallDirect and restores the
+    eval stack it saved, PC <- retaddr, FP <- caller FP, SP <- its value
+    before the CallDirect
+    """
+
+    def __init__(self, comment: Optional[str] = None):
+        self.comment: Optional[str] = comment
+
+
 class Halt(Insn):
     """
     Verbose asm:  Halt  [<comment:str>]
@@ -542,6 +956,55 @@ class Pop(Insn):
         self.comment: Optional[str] = comment
 
 
+class PopN(Insn):
+    """
+    Verbose asm:  PopN <n:int>  [<comment:str>]
+    Concise asm:  popn <n:int>  [<comment:str>]
+
+    Stack:
+    |-----| <- TOS
+    | vN  |
+    |-----|
+    | ... |
+    |-----|
+    | v1  |
+    |-----|          |-----| <- TOS
+    | ... |          | ... |
+    Before            After
+    """
+
+    def __init__(self, n: int, comment: Optional[str] = None):
+        self.n: int = n
+        self.comment: Optional[str] = comment
+
+
+class AllocZero(Insn):
+    """
+    Verbose asm:  AllocZero <n:int>  [<comment:str>]
+    Concise asm:  allocz    <n:int>  [<comment:str>]
+
+    Stack:
+    |-----| <- TOS   |-----| <- TOS
+    | ... |          | ... |
+    Before            After
+
+    Memory:
+                    |-----| <- SP
+                    | 0   |
+                    |-----|
+                    | ... | n words
+                    |-----|
+                    | 0   |
+    |-----| <- SP   |-----|
+    | ... |         | ... |
+    Before           After
+    """
+
+    def __init__(self, n: int, comment: Optional[str] = None):
+        self.n: int = n
+        self.comment: Optional[str] = comment
+
+
 class Swap(Insn):
     """
     Verbose asm:  Swap  [<comment:str>]
@@ -561,6 +1024,67 @@ class Swap(Insn):
         self.comment: Optional[str] = comment
 
 
+class Dup(Insn):
+    """
+    Verbose asm:  Dup  [<comment:str>]
+    Concise asm:  dup  [<comment:str>]
+
+    Stack:
+                     |-----| <- TOS
+                     | x   |
+    |-----| <- TOS   |-----|
+    | x   |          | x   |
+    |-----|          |-----|
+    | ... |          | ... |
+    Before            After
+    """
+
+    def __init__(self, comment: Optional[str] = None):
+        self.comment: Optional[str] = comment
+
+
+class Over(Insn):
+    """
+    Verbose asm:  Over  [<comment:str>]
+    Concise asm:  over  [<comment:str>]
+
+    Stack:
+                     |-----| <- TOS
+                     | x   |
+    |-----| <- TOS   |-----|
+    | y   |          | y   |
+    |-----|          |-----|
+    | x   |          | x   |
+    |-----|          |-----|
+    | ... |          | ... |
+    Before            After
+    """
+
+    def __init__(self, comment: Optional[str] = None):
+        self.comment: Optional[str] = comment
+
+
+class Rot(Insn):
+    """
+    Verbose asm:  Rot  [<comment:str>]
+    Concise asm:  rot  [<comment:str>]
+
+    Stack:
+    |-----| <- TOS   |-----| <- TOS
+    | z   |          | x   |
+    |-----|          |-----|
+    | y   |          | z   |
+    |-----|          |-----|
+    | x   |          | y   |
+    |-----|          |-----|
+    | ... |          | ... |
+    Before            After
+    """
+
+    def __init__(self, comment: Optional[str] = None):
+        self.comment: Optional[str] = comment
+
+
 class SaveEvalStack(Insn):
     """
     Verbose asm:  SaveEvalStack  [<comment:str>]
@@ -644,6 +1168,21 @@ class Noop(Insn):
         self.comment: Optional[str] = comment
 
 
+# Instructions that jump to their label operand, always or conditionally
+BRANCHES = (Jump, JumpIfZero, JumpIfNotZero, JumpIfLess, JumpIfLessEq,
+            JumpIfGreater, JumpIfGreaterEq, JumpIfEq, JumpIfNotEq)
+
+# Fused compare-and-branch instructions -> the comparison they branch on
+COMPARE_BRANCHES: dict[type, str] = {
+    JumpIfLess: "<",
+    JumpIfLessEq: "<=",
+    JumpIfGreater: ">",
+    JumpIfGreaterEq: ">=",
+    JumpIfEq: "==",
+    JumpIfNotEq: "!=",
+}
+
+
 def dis(insn: Insn, long=True, indent=0):
     args = ""
     indentation = " " * indent
@@ -662,6 +1201,24 @@ def dis(insn: Insn, long=True, indent=0):
         case JumpIfNotZero():
             op = "JumpIfNotZero" if long else "jnz"
             args += insn.label.__repr__()
+        case JumpIfLess():
+            op = "JumpIfLess" if long else "jlt"
+            args += insn.label.__repr__()
+        case JumpIfLessEq():
+            op = "JumpIfLessEq" if long else "jle"
+            args += insn.label.__repr__()
+        case JumpIfGreater():
+            op = "JumpIfGreater" if long else "jgt"
+            args += insn.label.__repr__()
+        case JumpIfGreaterEq():
+            op = "JumpIfGreaterEq" if long else "jge"
+            args += insn.label.__repr__()
+        case JumpIfEq():
+            op = "JumpIfEq" if long else "jeq"
+            args += insn.label.__repr__()
+        case JumpIfNotEq():
+            op = "JumpIfNotEq" if long else "jne"
+            args += insn.label.__repr__()
         case JumpIndirect():
             op = "JumpIndirect" if long else "ji"
         case PushImmediate():
@@ -678,6 +1235,15 @@ def dis(insn: Insn, long=True, indent=0):
             op = "Mul" if long else "mul"
         case Div():
             op = "Div" if long else "div"
+        case AddImm():
+            op = "AddImm" if long else "addi"
+            args += insn.value.__repr__()
+        case SubImm():
+            op = "SubImm" if long else "subi"
+            args += insn.value.__repr__()
+        case MulImm():
+            op = "MulImm" if long else "muli"
+            args += insn.value.__repr__()
         case Negate():
             op = "Negate" if long else "neg"
         case LessThan():
@@ -692,12 +1258,36 @@ def dis(insn: Insn, long=True, indent=0):
             op = "Equal" if long else "eq"
         case NotEqual():
             op = "NotEqual" if long else "neq"
+        case LessThanImm():
+            op = "LessThanImm" if long else "lti"
+            args += insn.value.__repr__()
+        case GreaterThanImm():
+            op = "GreaterThanImm" if long else "gti"
+            args += insn.value.__repr__()
+        case LessThanEqualImm():
+            op = "LessThanEqualImm" if long else "leqi"
+            args += insn.value.__repr__()
+        case GreaterThanEqualImm():
+            op = "GreaterThanEqualImm" if long else "geqi"
+            args += insn.value.__repr__()
+        case EqualImm():
+            op = "EqualImm" if long else "eqi"
+            args += insn.value.__repr__()
+        case NotEqualImm():
+            op = "NotEqualImm" if long else "neqi"
+            args += insn.value.__repr__()
         case Not():
             op = "Not" if long else "not"
         case Load():
             op = "Load" if long else "ld"
         case Store():
             op = "Store" if long else "st"
+        case LoadLocal():
+            op = "LoadLocal" if long else "ldl"
+            args += insn.offset.__repr__()
+        case StoreLocal():
+            op = "StoreLocal" if long else "stl"
+            args += insn.offset.__repr__()
         case Print():
             op = "Print" if long else "print"
         case PushFP():
@@ -712,12 +1302,29 @@ def dis(insn: Insn, long=True, indent=0):
             op = "PopSP" if long else "popSP"
         case Call():
             op = "Call" if long else "call"
+        case CallDirect():
+            op = "CallDirect" if long else "calld"
+            args += f"{insn.label!r} {insn.argc!r} {insn.frame_size!r}"
+        case Ret():
+            op = "Ret" if long else "ret"
         case Halt():
             op = "Halt" if long else "halt"
         case Pop():
             op = "Pop" if long else "pop"
+        case PopN():
+            op = "PopN" if long else "popn"
+            args += insn.n.__repr__()
+        case AllocZero():
+            op = "AllocZero" if long else "allocz"
+            args += insn.n.__repr__()
         case Swap():
             op = "Swap" if long else "swap"
+        case Dup():
+            op = "Dup" if long else "dup"
+        case Over():
+            op = "Over" if long else "over"
+        case Rot():
+            op = "Rot" if long else "rot"
         case SaveEvalStack():
             op = "SaveEvalStack" if long else "save"
         case RestoreEvalStack():
@@ -737,6 +1344,18 @@ reserved = [
     "jz",
     "JumpIfNotZero",
     "jnz",
+    "JumpIfLess",
+    "jlt",
+    "JumpIfLessEq",
+    "jle",
+    "JumpIfGreater",
+    "jgt",
+    "JumpIfGreaterEq",
+    "jge",
+    "JumpIfEq",
+    "jeq",
+    "JumpIfNotEq",
+    "jne",
     "JumpIndirect",
     "ji",
     "PushImmediate",
@@ -751,6 +1370,12 @@ reserved = [
     "mul",
     "Div",
     "div",
+    "AddImm",
+    "addi",
+    "SubImm",
+    "subi",
+    "MulImm",
+    "muli",
     "Negate",
     "neg",
     "LessThan",
@@ -765,12 +1390,28 @@ reserved = [
     "eq",
     "NotEqual",
     "neq",
+    "LessThanImm",
+    "lti",
+    "GreaterThanImm",
+    "gti",
+    "LessThanEqualImm",
+    "leqi",
+    "GreaterThanEqualImm",
+    "geqi",
+    "EqualImm",
+    "eqi",
+    "NotEqualImm",
+    "neqi",
     "Not",
     "not",
     "Load",
     "ld",
     "Store",
     "st",
+    "LoadLocal",
+    "ldl",
+    "StoreLocal",
+    "stl",
     "Print",
     "print",
     "PushFP",
@@ -783,12 +1424,26 @@ reserved = [
     "popSP",
     "Call",
     "call",
+    "CallDirect",
+    "calld",
+    "Ret",
+    "ret",
     "Halt",
     "halt",
     "Pop",
     "pop",
+    "PopN",
+    "popn",
+    "AllocZero",
+    "allocz",
     "Swap",
     "swap",
+    "Dup",
+    "dup",
+    "Over",
+    "over",
+    "Rot",
+    "rot",
     "SaveEvalStack",
     "save",
     "RestoreEvalStack",
@@ -0,0 +1,213 @@
+from array import array
+from typing import Iterable, List, Union
+
+from vm_arith import ARITH_MODES, IntegerOverflow
+
+PAGE_SHIFT = 12
+PAGE_WORDS = 1 << PAGE_SHIFT   # Words per page
+PAGE_MASK = PAGE_WORDS - 1
+DEFAULT_MAX_WORDS = 1 << 24    # 16M words (128MiB of int64) by default
+
+_ZERO_PAGE = bytes(PAGE_WORDS * array("q").itemsize)
+_ZEROS = array("q", _ZERO_PAGE)
+_ZERO_LIST = [0] * PAGE_WORDS
+
+
+class MemoryLimitExceeded(Exception):
+    pass
+
+
+Page = Union[List[int], array]
+
+
+class PagedMemory:
+    """
+    Word-addressed VM memory that allocates fixed-size pages on first
+    write. Reads from untouched pages yield 0 without allocating.
+
+    Supports the subset of the list interface that vm.Execution uses:
+    integer indexing and contiguous slices (slice assignment must not
+    change the length). max_words is rounded up to a whole page.
+
+    Pages are lists holding arbitrary ints, as bigint arithmetic needs.
+    With int64=True they are array('q') pages storing words unboxed, for
+    the arithmetic modes whose values always fit (see for_arith); storing
+    a value outside the int64 range then raises IntegerOverflow.
+    """
+
+    def __init__(self, initial: Iterable[int] = (),
+                 max_words: int = DEFAULT_MAX_WORDS, int64: bool = False):
+        self.max_words: int = -(-max_words // PAGE_WORDS) * PAGE_WORDS
+        self.int64: bool = int64
+        self.pages: dict[int, Page] = {}
+        self._free: List[Page] = []     # pages released by clear()
+        for addr, value in enumerate(initial):
+            self[addr] = value
+
+    def __len__(self) -> int:
+        return self.max_words
+
+    def __repr__(self):
+        return f"PagedMemory(pages={sorted(self.pages)}, " \
+            f"max_words={self.max_words})"
+
+    @property
+    def pages_touched(self) -> int:
+        return len(self.pages)
+
+    def clear(self):
+        """
+        Zero all of memory. Only the touched pages are released, and they
+        are kept for reuse by later writes instead of being freed.
+        """
+        self._free.extend(self.pages.values())
+        self.pages = {}
+
+    def snapshot(self) -> dict[int, List[int]]:
+        """Contents of the touched pages, keyed by page number."""
+        return {n: list(page) for n, page in self.pages.items()}
+
+    def restore(self, snapshot: dict[int, List[int]]):
+        """
+        Replace the contents with a snapshot. Each page must hold
+        PAGE_WORDS words, which for int64 pages must fit in an int64
+        (IntegerOverflow otherwise).
+        """
+        pages: dict[int, Page] = {}
+        for n, data in snapshot.items():
+            assert len(data) == PAGE_WORDS, f"Page {n} is not a whole page"
+            if self.int64:
+                try:
+                    pages[n] = array("q", data)
+                except OverflowError:
+                    raise IntegerOverflow(
+                        f"Value in page {n} does not fit in int64")
+            else:
+                pages[n] = list(data)
+        self.pages = pages
+
+    def _check(self, addr: int):
+        if addr < 0 or addr >= self.max_words:
+            raise MemoryLimitExceeded(
+                f"Address {addr} outside of memory [0, {self.max_words})")
+
+    def _page(self, addr: int) -> Page:
+        page = self.pages.get(addr >> PAGE_SHIFT)
+        if page is None:
+            self._check(addr)
+            if self._free:
+                page = self._free.pop()
+                page[:] = _ZEROS if self.int64 else _ZERO_LIST
+            elif self.int64:
+                page = array("q", _ZERO_PAGE)
+            else:
+                page = list(_ZERO_LIST)
+            self.pages[addr >> PAGE_SHIFT] = page
+        return page
+
+    def __getitem__(self, key):
+        if key.__class__ is slice:
+            return self._get_slice(key)
+        page = self.pages.get(key >> PAGE_SHIFT)
+        if page is None:
+            self._check(key)
+            return 0
+        return page[key & PAGE_MASK]
+
+    def __setitem__(self, key, value):
+        if key.__class__ is slice:
+            self._set_slice(key, value)
+            return
+        page = self.pages.get(key >> PAGE_SHIFT)
+        if page is None:
+            page = self._page(key)
+        try:
+            page[key & PAGE_MASK] = value
+        except OverflowError:
+            raise IntegerOverflow(
+                f"Value {value} stored at {key} does not fit in int64")
+
+    def zero(self, start: int, stop: int):
+        """Zero [start, stop) without allocating the untouched pages."""
+        if start < stop:
+            self._check(start)
+            self._check(stop - 1)
+        addr = start
+        while addr < stop:
+            chunk_end = min(stop, (addr | PAGE_MASK) + 1)
+            page = self.pages.get(addr >> PAGE_SHIFT)
+            if page is not None:
+                off = addr & PAGE_MASK
+                zeros = _ZEROS if self.int64 else _ZERO_LIST
+                page[off: off + chunk_end - addr] = zeros[: chunk_end - addr]
+            addr = chunk_end
+
+    def _bounds(self, key: slice) -> tuple[int, int]:
+        assert key.step is None, "PagedMemory only supports contiguous slices"
+        start = 0 if key.start is None else key.start
+        stop = self.max_words if key.stop is None else key.stop
+        if start < 0 or stop < 0:
+            raise MemoryLimitExceeded(
+                f"Negative slice [{start}:{stop}] of memory")
+        return start, max(start, min(stop, self.max_words))
+
+    def _get_slice(self, key: slice) -> List[int]:
+        start, stop = self._bounds(key)
+        out: List[int] = []
+        addr = start
+        while addr < stop:
+            chunk_end = min(stop, (addr | PAGE_MASK) + 1)
+            page = self.pages.get(addr >> PAGE_SHIFT)
+            if page is None:
+                out.extend([0] * (chunk_end - addr))
+            else:
+                out.extend(page[addr & PAGE_MASK:
+                                ((chunk_end - 1) & PAGE_MASK) + 1])
+            addr = chunk_end
+        return out
+
+    def _set_slice(self, key: slice, values: List[int]):
+        start = 0 if key.start is None else key.start
+        stop = start + len(values) if key.stop is None else key.stop
+        assert stop - start == len(values), \
+            "PagedMemory slice assignment cannot resize memory"
+        if start < stop:
+            self._check(start)
+            self._check(stop - 1)
+        addr = start
+        i = 0
+        while addr < stop:
+            chunk_end = min(stop, (addr | PAGE_MASK) + 1)
+            n = chunk_end - addr
+            page = self._page(addr)
+            off = addr & PAGE_MASK
+            try:
+                page[off: off + n] = array("q", values[i: i + n]) \
+                    if self.int64 else values[i: i + n]
+            except OverflowError:
+                raise IntegerOverflow(
+                    f"Value stored in [{addr}:{chunk_end}] does not fit "
+                    "in int64")
+            addr = chunk_end
+            i += n
+
+
+Memory = Union[List[int], PagedMemory]
+
+
+def for_arith(arith: str, initial: Iterable[int] = (),
+              max_words: int = DEFAULT_MAX_WORDS) -> PagedMemory:
+    """
+    Paged memory for a vm_arith mode: int64 pages when the mode keeps
+    results in the int64 range, boxed ones for bigint.
+    """
+    return PagedMemory(initial, max_words,
+                       int64=ARITH_MODES[arith] is not None)
+
+
+def zero(memory: Memory, start: int, stop: int):
+    """Zero memory[start:stop] in bulk."""
+    if isinstance(memory, PagedMemory):
+        memory.zero(start, stop)
+    else:
+        memory[start:stop] = [0] * (stop - start)
@@ -27,27 +27,47 @@ class Parser:
         _start_ = []
         while self.current() in {
             "Add",
+            "AddImm",
+            "AllocZero",
             "Call",
+            "CallDirect",
             "Div",
+            "Dup",
             "Equal",
+            "EqualImm",
             "GreaterThan",
             "GreaterThanEqual",
+            "GreaterThanEqualImm",
+            "GreaterThanImm",
             "Halt",
             "Jump",
+            "JumpIfEq",
+            "JumpIfGreater",
+            "JumpIfGreaterEq",
+            "JumpIfLess",
+            "JumpIfLessEq",
+            "JumpIfNotEq",
             "JumpIfNotZero",
             "JumpIfZero",
             "JumpIndirect",
             "Label",
             "LessThan",
             "LessThanEqual",
+            "LessThanEqualImm",
+            "LessThanImm",
             "Load",
+            "LoadLocal",
             "Mul",
+            "MulImm",
             "Negate",
             "Noop",
             "Not",
             "NotEqual",
+            "NotEqualImm",
+            "Over",
             "Pop",
             "PopFP",
+            "PopN",
             "PopSP",
             "Print",
             "PushFP",
@@ -55,49 +75,77 @@ class Parser:
             "PushLabel",
             "PushSP",
             "RestoreEvalStack",
+            "Ret",
+            "Rot",
             "SaveEvalStack",
             "Store",
+            "StoreLocal",
             "Sub",
+            "SubImm",
             "Swap",
             "add",
+            "addi",
+            "allocz",
             "call",
+            "calld",
             "div",
+            "dup",
             "eq",
+            "eqi",
             "geq",
+            "geqi",
             "gt",
+            "gti",
             "halt",
             "j",
+            "jeq",
+            "jge",
+            "jgt",
             "ji",
+            "jle",
+            "jlt",
+            "jne",
             "jnz",
             "jz",
             "lab",
             "ld",
+            "ldl",
             "leq",
+            "leqi",
             "lt",
+            "lti",
             "mul",
+            "muli",
             "neg",
             "neq",
+            "neqi",
             "noop",
             "not",
+            "over",
             "pop",
             "popFP",
             "popSP",
+            "popn",
             "print",
             "push",
             "pushFP",
             "pushSP",
             "pushl",
             "restore",
+            "ret",
+            "rot",
             "save",
             "st",
+            "stl",
             "sub",
+            "subi",
             "swap",
         }:
             _tmp__start__4432493968 = self._operation()
             _start_.append(_tmp__start__4432493968)
         return _start_
 
-    # operation -> ("Label" | "lab") str [ str ] | ("Jump" | "j") str [ str ] | ("JumpIfZero" | "jz") str [ str ] | ("JumpIfNotZero" | "jnz") str [ str ] | ("JumpIndirect" | "ji") [ str ] | ("PushImmediate" | "push") int [ str ] | ("PushLabel" | "pushl") str [ str ] | ("Add" | "add") [ str ] | ("Sub" | "sub") [ str ] | ("Mul" | "mul") [ str ] | ("Div" | "div") [ str ] | ("Negate" | "neg") [ str ] | ("LessThan" | "lt") [ str ] | ("GreaterThan" | "gt") [ str ] | ("LessThanEqual" | "leq") [ str ] | ("GreaterThanEqual" | "geq") [ str ] | ("Equal" | "eq") [ str ] | ("NotEqual" | "neq") [ str ] | ("Not" | "not") [ str ] | ("Load" | "ld") [ str ] | ("Store" | "st") [ str ] | ("Print" | "print") [ str ] | ("PushFP" | "pushFP") int [ str ] | ("PopFP" | "popFP") [ str ] | ("PushSP" | "pushSP") int [ str ] | ("PopSP" | "popSP") [ str ] | ("Call" | "call") [ str ] | ("Halt" | "halt") [ str ] | ("Pop" | "pop") [ str ] | ("Swap" | "swap") [ str ] | ("SaveEvalStack" | "save") [ str ] | ("RestoreEvalStack" | "restore") [ str ] | ("Noop" | "noop") [ str ]
+    # operation -> ("Label" | "lab") str [ str ] | ("Jump" | "j") str [ str ] | ("JumpIfZero" | "jz") str [ str ] | ("JumpIfNotZero" | "jnz") str [ str ] | ("JumpIndirect" | "ji") [ str ] | ("PushImmediate" | "push") int [ str ] | ("PushLabel" | "pushl") str [ str ] | ("Add" | "add") [ str ] | ("Sub" | "sub") [ str ] | ("Mul" | "mul") [ str ] | ("Div" | "div") [ str ] | ("Negate" | "neg") [ str ] | ("LessThan" | "lt") [ str ] | ("GreaterThan" | "gt") [ str ] | ("LessThanEqual" | "leq") [ str ] | ("GreaterThanEqual" | "geq") [ str ] | ("Equal" | "eq") [ str ] | ("NotEqual" | "neq") [ str ] | ("Not" | "not") [ str ] | ("Load" | "ld") [ str ] | ("Store" | "st") [ str ] | ("Print" | "print") [ str ] | ("PushFP" | "pushFP") int [ str ] | ("PopFP" | "popFP") [ str ] | ("PushSP" | "pushSP") int [ str ] | ("PopSP" | "popSP") [ str ] | ("Call" | "call") [ str ] | ("Halt" | "halt") [ str ] | ("Pop" | "pop") [ str ] | ("Swap" | "swap") [ str ] | ("SaveEvalStack" | "save") [ str ] | ("RestoreEvalStack" | "restore") [ str ] | ("Noop" | "noop") [ str ] | ("CallDirect" | "calld") str int int [ str ] | ("Ret" | "ret") [ str ] | ("PopN" | "popn") int [ str ] | ("AllocZero" | "allocz") int [ str ] | ("LoadLocal" | "ldl") int [ str ] | ("StoreLocal" | "stl") int [ str ] | ("JumpIfLess" | "jlt") str [ str ] | ("JumpIfLessEq" | "jle") str [ str ] | ("JumpIfGreater" | "jgt") str [ str ] | ("JumpIfGreaterEq" | "jge") str [ str ] | ("JumpIfEq" | "jeq") str [ str ] | ("JumpIfNotEq" | "jne") str [ str ] | ("AddImm" | "addi") int [ str ] | ("SubImm" | "subi") int [ str ] | ("MulImm" | "muli") int [ str ] | ("LessThanImm" | "lti") int [ str ] | ("GreaterThanImm" | "gti") int [ str ] | ("LessThanEqualImm" | "leqi") int [ str ] | ("GreaterThanEqualImm" | "geqi") int [ str ] | ("EqualImm" | "eqi") int [ str ] | ("NotEqualImm" | "neqi") int [ str ] | ("Dup" | "dup") [ str ] | ("Over" | "over") [ str ] | ("Rot" | "rot") [ str ]
     def _operation(self):
         if self.current() in {"Label", "lab"}:
             if self.current() in {"Label"}:
@@ -503,6 +551,316 @@ class Parser:
             if self.current() in {"STR"}:
                 comment = self._str()
             _operation_ = vm.Noop(comment)
+        elif self.current() in {"CallDirect", "calld"}:
+            if self.current() in {"CallDirect"}:
+                self.match("CallDirect")
+            elif self.current() in {"calld"}:
+                self.match("calld")
+            else:
+                self.error("syntax error")
+                assert False
+            label = self._str()
+            argc = self._int()
+            frame_size = self._int()
+            comment = None
+            if self.current() in {"STR"}:
+                comment = self._str()
+            _operation_ = vm.CallDirect(label, argc, frame_size, comment)
+        elif self.current() in {"Ret", "ret"}:
+            if self.current() in {"Ret"}:
+                self.match("Ret")
+            elif self.current() in {"ret"}:
+                self.match("ret")
+            else:
+                self.error("syntax error")
+                assert False
+            comment = None
+            if self.current() in {"STR"}:
+                comment = self._str()
+            _operation_ = vm.Ret(comment)
+        elif self.current() in {"PopN", "popn"}:
+            if self.current() in {"PopN"}:
+                self.match("PopN")
+            elif self.current() in {"popn"}:
+                self.match("popn")
+            else:
+                self.error("syntax error")
+                assert False
+            n = self._int()
+            comment = None
+            if self.current() in {"STR"}:
+                comment = self._str()
+            _operation_ = vm.PopN(n, comment)
+        elif self.current() in {"AllocZero", "allocz"}:
+            if self.current() in {"AllocZero"}:
+                self.match("AllocZero")
+            elif self.current() in {"allocz"}:
+                self.match("allocz")
+            else:
+                self.error("syntax error")
+                assert False
+            n = self._int()
+            comment = None
+            if self.current() in {"STR"}:
+                comment = self._str()
+            _operation_ = vm.AllocZero(n, comment)
+        elif self.current() in {"LoadLocal", "ldl"}:
+            if self.current() in {"LoadLocal"}:
+                self.match("LoadLocal")
+            elif self.current() in {"ldl"}:
+                self.match("ldl")
+            else:
+                self.error("syntax error")
+                assert False
+            offset = self._int()
+            comment = None
+            if self.current() in {"STR"}:
+                comment = self._str()
+            _operation_ = vm.LoadLocal(offset, comment)
+        elif self.current() in {"StoreLocal", "stl"}:
+            if self.current() in {"StoreLocal"}:
+                self.match("StoreLocal")
+            elif self.current() in {"stl"}:
+                self.match("stl")
+            else:
+                self.error("syntax error")
+                assert False
+            offset = self._int()
+            comment = None
+            if self.current() in {"STR"}:
+                comment = self._str()
+            _operation_ = vm.StoreLocal(offset, comment)
+        elif self.current() in {"JumpIfLess", "jlt"}:
+            if self.current() in {"JumpIfLess"}:
+                self.match("JumpIfLess")
+            elif self.current() in {"jlt"}:
+                self.match("jlt")
+            else:
+                self.error("syntax error")
+                assert False
+            label = self._str()
+            comment = None
+            if self.current() in {"STR"}:
+                comment = self._str()
+            _operation_ = vm.JumpIfLess(label, comment)
+        elif self.current() in {"JumpIfLessEq", "jle"}:
+            if self.current() in {"JumpIfLessEq"}:
+                self.match("JumpIfLessEq")
+            elif self.current() in {"jle"}:
+                self.match("jle")
+            else:
+                self.error("syntax error")
+                assert False
+            label = self._str()
+            comment = None
+            if self.current() in {"STR"}:
+                comment = self._str()
+            _operation_ = vm.JumpIfLessEq(label, comment)
+        elif self.current() in {"JumpIfGreater", "jgt"}:
+            if self.current() in {"JumpIfGreater"}:
+                self.match("JumpIfGreater")
+            elif self.current() in {"jgt"}:
+                self.match("jgt")
+            else:
+                self.error("syntax error")
+                assert False
+            label = self._str()
+            comment = None
+            if self.current() in {"STR"}:
+                comment = self._str()
+            _operation_ = vm.JumpIfGreater(label, comment)
+        elif self.current() in {"JumpIfGreaterEq", "jge"}:
+            if self.current() in {"JumpIfGreaterEq"}:
+                self.match("JumpIfGreaterEq")
+            elif self.current() in {"jge"}:
+                self.match("jge")
+            else:
+                self.error("syntax error")
+                assert False
+            label = self._str()
+            comment = None
+            if self.current() in {"STR"}:
+                comment = self._str()
+            _operation_ = vm.JumpIfGreaterEq(label, comment)
+        elif self.current() in {"JumpIfEq", "jeq"}:
+            if self.current() in {"JumpIfEq"}:
+                self.match("JumpIfEq")
+            elif self.current() in {"jeq"}:
+                self.match("jeq")
+            else:
+                self.error("syntax error")
+                assert False
+            label = self._str()
+            comment = None
+            if self.current() in {"STR"}:
+                comment = self._str()
+            _operation_ = vm.JumpIfEq(label, comment)
+        elif self.current() in {"JumpIfNotEq", "jne"}:
+            if self.current() in {"JumpIfNotEq"}:
+                self.match("JumpIfNotEq")
+            elif self.current() in {"jne"}:
+                self.match("jne")
+            else:
+                self.error("syntax error")
+                assert False
+            label = self._str()
+            comment = None
+            if self.current() in {"STR"}:
+                comment = self._str()
+            _operation_ = vm.JumpIfNotEq(label, comment)
+        elif self.current() in {"AddImm", "addi"}:
+            if self.current() in {"AddImm"}:
+                self.match("AddImm")
+            elif self.current() in {"addi"}:
+                self.match("addi")
+            else:
+                self.error("syntax error")
+                assert False
+            value = self._int()
+            comment = None
+            if self.current() in {"STR"}:
+                comment = self._str()
+            _operation_ = vm.AddImm(value, comment)
+        elif self.current() in {"SubImm", "subi"}:
+            if self.current() in {"SubImm"}:
+                self.match("SubImm")
+            elif self.current() in {"subi"}:
+                self.match("subi")
+            else:
+                self.error("syntax error")
+                assert False
+            value = self._int()
+            comment = None
+            if self.current() in {"STR"}:
+                comment = self._str()
+            _operation_ = vm.SubImm(value, comment)
+        elif self.current() in {"MulImm", "muli"}:
+            if self.current() in {"MulImm"}:
+                self.match("MulImm")
+            elif self.current() in {"muli"}:
+                self.match("muli")
+            else:
+                self.error("syntax error")
+                assert False
+            value = self._int()
+            comment = None
+            if self.current() in {"STR"}:
+                comment = self._str()
+            _operation_ = vm.MulImm(value, comment)
+        elif self.current() in {"LessThanImm", "lti"}:
+            if self.current() in {"LessThanImm"}:
+                self.match("LessThanImm")
+            elif self.current() in {"lti"}:
+                self.match("lti")
+            else:
+                self.error("syntax error")
+                assert False
+            value = self._int()
+            comment = None
+            if self.current() in {"STR"}:
+                comment = self._str()
+            _operation_ = vm.LessThanImm(value, comment)
+        elif self.current() in {"GreaterThanImm", "gti"}:
+            if self.current() in {"GreaterThanImm"}:
+                self.match("GreaterThanImm")
+            elif self.current() in {"gti"}:
+                self.match("gti")
+            else:
+                self.error("syntax error")
+                assert False
+            value = self._int()
+            comment = None
+            if self.current() in {"STR"}:
+                comment = self._str()
+            _operation_ = vm.GreaterThanImm(value, comment)
+        elif self.current() in {"LessThanEqualImm", "leqi"}:
+            if self.current() in {"LessThanEqualImm"}:
+                self.match("LessThanEqualImm")
+            elif self.current() in {"leqi"}:
+                self.match("leqi")
+            else:
+                self.error("syntax error")
+                assert False
+            value = self._int()
+            comment = None
+            if self.current() in {"STR"}:
+                comment = self._str()
+            _operation_ = vm.LessThanEqualImm(value, comment)
+        elif self.current() in {"GreaterThanEqualImm", "geqi"}:
+            if self.current() in {"GreaterThanEqualImm"}:
+                self.match("GreaterThanEqualImm")
+            elif self.current() in {"geqi"}:
+                self.match("geqi")
+            else:
+                self.error("syntax error")
+                assert False
+            value = self._int()
+            comment = None
+            if self.current() in {"STR"}:
+                comment = self._str()
+            _operation_ = vm.GreaterThanEqualImm(value, comment)
+        elif self.current() in {"EqualImm", "eqi"}:
+            if self.current() in {"EqualImm"}:
+                self.match("EqualImm")
+            elif self.current() in {"eqi"}:
+                self.match("eqi")
+            else:
+                self.error("syntax error")
+                assert False
+            value = self._int()
+            comment = None
+            if self.current() in {"STR"}:
+                comment = self._str()
+            _operation_ = vm.EqualImm(value, comment)
+        elif self.current() in {"NotEqualImm", "neqi"}:
+            if self.current() in {"NotEqualImm"}:
+                self.match("NotEqualImm")
+            elif self.current() in {"neqi"}:
+                self.match("neqi")
+            else:
+                self.error("syntax error")
+                assert False
+            value = self._int()
+            comment = None
+            if self.current() in {"STR"}:
+                comment = self._str()
+            _operation_ = vm.NotEqualImm(value, comment)
+        elif self.current() in {"Dup", "dup"}:
+            if self.current() in {"Dup"}:
+                self.match("Dup")
+            elif self.current() in {"dup"}:
+                self.match("dup")
+            else:
+                self.error("syntax error")
+                assert False
+            comment = None
+            if self.current() in {"STR"}:
+                comment = self._str()
+            _operation_ = vm.Dup(comment)
+        elif self.current() in {"Over", "over"}:
+            if self.current() in {"Over"}:
+                self.match("Over")
+            elif self.current() in {"over"}:
+                self.match("over")
+            else:
+                self.error("syntax error")
+                assert False
+            comment = None
+            if self.current() in {"STR"}:
+                comment = self._str()
+            _operation_ = vm.Over(comment)
+        elif self.current() in {"Rot", "rot"}:
+            if self.current() in {"Rot"}:
+                self.match("Rot")
+            elif self.current() in {"rot"}:
+                self.match("rot")
+            else:
+                self.error("syntax error")
+                assert False
+            comment = None
+            if self.current() in {"STR"}:
+                comment = self._str()
+            _operation_ = vm.Rot(comment)
         else:
             self.error("syntax error")
             assert False
@@ -0,0 +1,242 @@
+"""
+Record/replay of VM executions.
+
+A recording holds only what a run depends on besides the program itself:
+the initial registers, eval stack and memory image (which carry the
+program arguments), the VM configuration, and inputs consumed while
+running (none today; the VM has no input instruction yet). It also holds
+checkpoints of the full VM state taken every `every` instructions, so a
+replay can start from the last checkpoint before the instruction it
+should stop at instead of from the beginning.
+
+Recordings are meant to be passed around, so they are data only: gzip'd
+JSON of integers, strings and lists, every field of which load() checks
+before anything is built from it.
+"""
+import gzip
+import hashlib
+import json
+import time
+from typing import Any, Optional
+
+import vm
+import vm_arith
+import vm_insns
+import vm_memory
+
+VERSION = 3
+REGISTERS = ("PC", "FP", "SP")
+
+
+class RecordingError(Exception):
+    """A recording that cannot be loaded or does not fit the program."""
+CHECKPOINT_EVERY = 10_000_000
+
+
+def program_hash(insns: list[vm_insns.Insn]) -> str:
+    text = "\n".join(vm_insns.dis(insn) for insn in insns)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _memory_image(memory: vm_memory.Memory) -> dict[str, Any]:
+    if isinstance(memory, vm_memory.PagedMemory):
+        return {"kind": "paged", "max_words": memory.max_words,
+                "int64": memory.int64,
+                "pages": {str(n): page
+                          for n, page in memory.snapshot().items()}}
+    return {"kind": "list", "words": list(memory)}
+
+
+def _load_memory(image: dict[str, Any]) -> vm_memory.Memory:
+    if image["kind"] == "paged":
+        memory = vm_memory.PagedMemory(max_words=image["max_words"],
+                                       int64=image["int64"])
+        memory.restore({int(n): page for n, page in image["pages"].items()})
+        return memory
+    return list(image["words"])
+
+
+def _state(exe: vm.Execution, executed: int) -> dict[str, Any]:
+    return {
+        "executed": executed,
+        "regs": dict(exe.regs),
+        "stack": list(exe.stack),
+        "memory": _memory_image(exe.memory),
+        "max_sp": exe.max_sp,
+    }
+
+
+def _run_for(exe: vm.Execution, n: int) -> vm.RunResult:
+    """Run at most n instructions, leaving the rest of exe's max_insns
+    budget in place for later runs."""
+    budget = exe.max_insns
+    exe.max_insns = n
+    try:
+        return exe.run()
+    finally:
+        exe.max_insns = budget - (n - exe.max_insns)
+
+
+def record(exe: vm.Execution, path: str,
+           every: int = CHECKPOINT_EVERY) -> vm.RunResult:
+    """
+    Run exe to completion (or until its max_insns budget or a time limit
+    runs out) while recording it to path. Time limits apply to the whole
+    recording. Returns the result of the whole run.
+    """
+    budget = exe.max_insns
+    limits = exe.wall_time, exe.cpu_time
+    wall_deadline = None if exe.wall_time is None \
+        else time.monotonic() + exe.wall_time
+    cpu_deadline = None if exe.cpu_time is None \
+        else time.process_time() + exe.cpu_time
+    rec: dict[str, Any] = {
+        "version": VERSION,
+        "program": program_hash(exe.insns),
+        "arith": exe.arith,
+        "initial": _state(exe, 0),
+        "inputs": [],
+        "checkpoints": [],
+    }
+    executed = 0
+    try:
+        while True:
+            chunk = min(every, budget - executed)
+            exe.max_insns = chunk
+            # Each run() starts its own clock: give it what is left
+            if wall_deadline is not None:
+                exe.wall_time = max(0.0, wall_deadline - time.monotonic())
+            if cpu_deadline is not None:
+                exe.cpu_time = max(0.0, cpu_deadline - time.process_time())
+            try:
+                result = exe.run()
+            finally:
+                # Also counts the instructions before a VM error, so that
+                # replaying to `executed` stops right before the failure
+                executed += chunk - exe.max_insns
+            if result.reason != "max_insns" or executed >= budget:
+                break
+            rec["checkpoints"].append(_state(exe, executed))
+    finally:
+        rec["executed"] = executed
+        with gzip.open(path, "wt") as f:
+            json.dump(rec, f)
+        exe.max_insns = budget - executed
+        exe.wall_time, exe.cpu_time = limits
+    return result._replace(insns_executed=executed)
+
+
+def load(path: str) -> dict[str, Any]:
+    """Read and validate a recording; RecordingError if it is not one."""
+    try:
+        with gzip.open(path, "rt") as f:
+            rec = json.load(f)
+    except (OSError, EOFError, UnicodeDecodeError, ValueError) as e:
+        raise RecordingError(f"{path}: not a recording: {e}")
+    _check_recording(rec)
+    return rec
+
+
+def _check(ok: bool, what: str):
+    if not ok:
+        raise RecordingError(f"bad recording: {what}")
+
+
+def _is_int(value: Any) -> bool:
+    return type(value) is int
+
+
+def _check_ints(values: Any, what: str):
+    _check(isinstance(values, list) and all(map(_is_int, values)),
+           f"{what} is not a list of integers")
+
+
+def _check_fields(d: Any, fields: tuple[str, ...], what: str):
+    _check(isinstance(d, dict) and sorted(d) == sorted(fields),
+           f"{what} must have exactly the fields {', '.join(fields)}")
+
+
+def _check_recording(rec: Any):
+    _check(isinstance(rec, dict) and rec.get("version") == VERSION,
+           f"unsupported version, expected {VERSION}")
+    _check_fields(rec, ("version", "program", "arith", "initial", "inputs",
+                        "checkpoints", "executed"), "recording")
+    _check(isinstance(rec["program"], str), "program hash")
+    _check(isinstance(rec["arith"], str)
+           and rec["arith"] in vm_arith.ARITH_MODES,
+           f"unknown arithmetic mode {rec['arith']!r}")
+    _check_ints(rec["inputs"], "inputs")
+    _check(_is_int(rec["executed"]) and rec["executed"] >= 0,
+           "executed count")
+    _check_state(rec["initial"], "initial state")
+    _check(isinstance(rec["checkpoints"], list), "checkpoints")
+    for i, cp in enumerate(rec["checkpoints"]):
+        _check_state(cp, f"checkpoint {i}")
+
+
+def _check_state(state: Any, what: str):
+    _check_fields(state, ("executed", "regs", "stack", "memory", "max_sp"),
+                  what)
+    _check(_is_int(state["executed"]) and state["executed"] >= 0,
+           f"{what}: executed count")
+    regs = state["regs"]
+    _check(isinstance(regs, dict) and set(regs) <= set(REGISTERS)
+           and all(map(_is_int, regs.values())), f"{what}: registers")
+    _check_ints(state["stack"], f"{what}: stack")
+    _check(_is_int(state["max_sp"]), f"{what}: max_sp")
+    _check_memory(state["memory"], f"{what}: memory")
+
+
+def _check_memory(image: Any, what: str):
+    _check(isinstance(image, dict) and image.get("kind") in ("paged", "list"),
+           f"{what} kind")
+    if image["kind"] == "list":
+        _check_fields(image, ("kind", "words"), what)
+        _check_ints(image["words"], f"{what} words")
+        return
+    _check_fields(image, ("kind", "max_words", "int64", "pages"), what)
+    max_words = image["max_words"]
+    _check(_is_int(max_words) and max_words > 0, f"{what} size")
+    _check(isinstance(image["int64"], bool), f"{what} page kind")
+    _check(isinstance(image["pages"], dict), f"{what} pages")
+    for n, page in image["pages"].items():
+        _check(n.isascii() and n.isdigit()
+               and int(n) * vm_memory.PAGE_WORDS < max_words,
+               f"{what} page number {n!r}")
+        _check_ints(page, f"{what} page {n}")
+        _check(len(page) == vm_memory.PAGE_WORDS, f"{what} page {n} size")
+        _check(not image["int64"] or all(
+            vm_arith.INT64_MIN <= word <= vm_arith.INT64_MAX
+            for word in page), f"{what} page {n} holds a non-int64 word")
+
+
+def replay(insns: list[vm_insns.Insn], path: str,
+           until: Optional[int] = None, engine=vm.Execution,
+           **kwargs) -> tuple[vm.Execution, int]:
+    """
+    Rebuild the recorded run of insns. With until, fast-forward from the
+    last checkpoint at or before that instruction count and stop after
+    exactly `until` instructions; output printed before the checkpoint is
+    not reproduced. Without until, the run is replayed to its end.
+
+    Returns the Execution and the number of instructions executed so far.
+    """
+    rec = load(path)
+    if rec["program"] != program_hash(insns):
+        raise RecordingError("recording was made with a different program")
+    target = rec["executed"] if until is None else until
+    start = rec["initial"]
+    for cp in rec["checkpoints"] if until is not None else []:
+        if cp["executed"] <= target:
+            start = cp
+
+    exe = engine(insns, list(start["stack"]), _load_memory(start["memory"]),
+                 dict(start["regs"]), arith=rec["arith"], **kwargs)
+    exe.max_sp = start["max_sp"]
+    executed = start["executed"]
+    # The budget covers the whole run, including what led to the checkpoint
+    exe.max_insns = max(0, exe.max_insns - executed)
+    if target > executed:
+        executed += _run_for(exe, target - executed).insns_executed
+    return exe, executed
+
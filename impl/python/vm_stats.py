@@ -0,0 +1,70 @@
+import json
+import sys
+from typing import Any
+
+from vm_insns import Insn
+from vm_memory import PagedMemory, PAGE_WORDS
+
+WORD_BYTES = 8
+
+
+class ExecutionStats:
+    """
+    Resource counters for one Execution, filled in by its run loop when
+    the Execution was created with collect_stats=True.
+    """
+
+    def __init__(self, insns: list[Insn]):
+        self.insns = insns
+        self.pc_counts: list[int] = [0] * len(insns)
+        self.max_stack_depth: int = 0
+        # Eval stack words moved by SaveEvalStack/CallDirect and
+        # RestoreEvalStack/Ret, including the count word
+        self.words_saved: int = 0
+        self.words_restored: int = 0
+        self.wall_time: float = 0.0     # seconds spent in run()
+
+    @property
+    def instructions(self) -> int:
+        return sum(self.pc_counts)
+
+    def opcodes(self) -> dict[str, int]:
+        hist: dict[str, int] = {}
+        for insn, n in zip(self.insns, self.pc_counts):
+            if n:
+                name = type(insn).__name__
+                hist[name] = hist.get(name, 0) + n
+        return dict(sorted(hist.items(), key=lambda kv: -kv[1]))
+
+    def summary(self, exe) -> dict[str, Any]:
+        opcodes = self.opcodes()
+        if isinstance(exe.memory, PagedMemory):
+            memory_words = exe.memory.pages_touched * PAGE_WORDS
+        else:
+            memory_words = len(exe.memory)
+        return {
+            "instructions": self.instructions,
+            "opcodes": opcodes,
+            "calls": opcodes.get("Call", 0) + opcodes.get("CallDirect", 0),
+            "returns": opcodes.get("JumpIndirect", 0) + opcodes.get("Ret", 0),
+            "prints": opcodes.get("Print", 0),
+            "max_stack_depth": self.max_stack_depth,
+            "max_sp": exe.max_sp,
+            "memory_words": memory_words,
+            "save_bytes": self.words_saved * WORD_BYTES,
+            "restore_bytes": self.words_restored * WORD_BYTES,
+            "wall_time": self.wall_time,
+        }
+
+    def report(self, exe, fmt: str = "text", file=sys.stderr):
+        summary = self.summary(exe)
+        if fmt == "json":
+            print(json.dumps(summary), file=file)
+            return
+        for key, value in summary.items():
+            if key == "opcodes":
+                continue
+            print(f"{key:>16}: {value}", file=file)
+        print(f"{'opcodes':>16}:", file=file)
+        for name, n in summary["opcodes"].items():
+            print(f"{name:>20} {n}", file=file)
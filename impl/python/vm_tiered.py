@@ -0,0 +1,108 @@
+"""
+Tiered execution: every function starts out interpreted; functions whose
+entry (invocations) or loop headers (back-edges) get hot are compiled to
+Python with vm_compile and entered directly from then on.
+
+Because compiled code can be entered at any of its block leaders, a
+function that gets hot in the middle of a loop switches to compiled code
+the next time the loop header is reached (on-stack replacement).
+"""
+import sys
+import time
+from typing import Callable, NamedTuple, Optional
+
+import vm
+import vm_compile
+import vm_verify
+from vm_insns import *
+
+HOT_CALLS = 50      # Invocations before a function is compiled
+HOT_LOOPS = 1000    # Back-edges taken before a loop's function is compiled
+
+
+class Promotion(NamedTuple):
+    name: str
+    trigger: str        # "calls" or "loop@<pc>"
+    count: int
+    blocks: int
+    compile_ms: float
+
+
+class TieredExecution(vm.Execution):
+    def __init__(self, *args, hot_calls=HOT_CALLS, hot_loops=HOT_LOOPS,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        self.compiled: dict[int, Callable] = {}
+        self.promotions: dict[str, Promotion] = {}
+        # pc -> (function, trigger name, threshold) for counted points
+        self.hot_points: dict[int, tuple[vm_verify.FunctionInfo, str, int]] \
+            = {}
+        self.counters: dict[int, int] = {}
+        try:
+            self.program: Optional[vm_verify.VerifiedProgram] = \
+                vm_verify.verify(self.insns)
+        except vm_verify.VerifyError:
+            # Unverifiable programs are only ever interpreted
+            self.program = None
+            return
+        for f in self.program.functions.values():
+            self.hot_points[f.entry] = (f, "calls", hot_calls)
+            for pc in f.pcs:
+                insn = self.insns[pc]
+                if isinstance(insn, BRANCHES):
+                    target = self.labels[insn.label]
+                    if target <= pc and target not in self.hot_points:
+                        self.hot_points[target] = \
+                            (f, f"loop@{target}", hot_loops)
+
+    def promote(self, f: vm_verify.FunctionInfo, trigger: str, count: int):
+        start = time.perf_counter()
+        entries = {pc for pc, (g, _, _) in self.hot_points.items() if g is f}
+        code, blocks = vm_compile.compile_region(
+            self.insns, self.labels, set(f.pcs), entries | {f.entry},
+            self.int_fixup, f.name, f.spills)
+        for leader in blocks:
+            self.compiled[leader] = code
+            self.hot_points.pop(leader, None)
+        self.promotions[f.name] = Promotion(
+            f.name, trigger, count, len(blocks),
+            (time.perf_counter() - start) * 1000)
+
+    def _run(self) -> bool:
+        if self.instrumented or self.program is None:
+            return super()._run()
+
+        regs = self.regs
+        compiled = self.compiled
+        hot_points = self.hot_points
+        counters = self.counters
+        while True:
+            pc = regs["PC"]
+            code = compiled.get(pc)
+            if code is not None and code(self):
+                if self.max_insns <= 0:
+                    return False
+                continue
+            point = hot_points.get(pc)
+            if point is not None:
+                count = counters.get(pc, 0) + 1
+                counters[pc] = count
+                if count >= point[2]:
+                    self.promote(point[0], point[1], count)
+                    continue
+            o = self.step()
+            self.max_insns -= 1
+            if o is None or self.max_insns == 0:
+                return o is None
+
+    def dump_engine_stats(self, file=sys.stderr):
+        if self.program is None:
+            print("tiered: program failed verification, interpreted only",
+                  file=file)
+            return
+        print(f"tiered: {len(self.promotions)} of "
+              f"{len(self.program.functions)} function(s) promoted",
+              file=file)
+        for p in self.promotions.values():
+            print(f"  {p.name}: {p.trigger} x{p.count}, {p.blocks} blocks, "
+                  f"compiled in {p.compile_ms:.2f}ms", file=file)
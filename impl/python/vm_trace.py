@@ -0,0 +1,177 @@
+"""
+Trace-recording JIT for hot loops.
+
+The interpreter counts taken backward branches (any of vm_insns.BRANCHES
+to an earlier PC). Once a loop header is hot, the next
+iteration is recorded instruction by instruction until control returns to
+the header. The recorded path is compiled into one Python function that
+repeats the iteration with a guard at every branch, call and indirect jump
+that checks the direction taken during recording. A failing guard writes
+the state back and exits to the interpreter at the real target.
+"""
+import sys
+from typing import Callable, NamedTuple, Optional
+
+import vm
+import vm_compile
+from vm_insns import *
+
+HOT_LOOP = 200      # Backward branches to a header before it is traced
+MAX_TRACE = 2000    # Longest iteration that is recorded
+
+
+class Trace(NamedTuple):
+    header: int
+    pcs: list[int]
+    code: Callable
+
+
+def _guard(insn: Insn, pc: int, expected: int, exit_budget: int,
+           labels: dict[str, int]) -> list[str]:
+    exit = ["exits[{pc}] = exits.get({pc}, 0) + 1".format(pc=pc),
+            f"budget += {exit_budget}", "break"]
+    match insn:
+        case JumpIfZero(label=label) | JumpIfNotZero(label=label):
+            if labels[label] == pc + 1:
+                return ["pop()"]
+            taken = expected == labels[label]
+            # Leave the trace when the branch goes the other way
+            leaves_if_zero = taken != isinstance(insn, JumpIfZero)
+            return [f"if pop() {'==' if leaves_if_zero else '!='} 0:",
+                    f"    pc = {pc + 1 if taken else labels[label]}",
+                    *("    " + line for line in exit)]
+        case _ if type(insn) in COMPARE_BRANCHES:
+            target = labels[insn.label]
+            if target == pc + 1:
+                return ["del stack[-2:]"]
+            taken = expected == target
+            op = COMPARE_BRANCHES[type(insn)]
+            return ["v = pop()",
+                    f"if {'not ' if taken else ''}pop() {op} v:",
+                    f"    pc = {pc + 1 if taken else target}",
+                    *("    " + line for line in exit)]
+        case Call():
+            return ["v = pop()", f"push({pc + 1})", f"if v != {expected}:",
+                    "    pc = v", *("    " + line for line in exit)]
+        case JumpIndirect():
+            return ["v = pop()", f"if v != {expected}:", "    pc = v",
+                    *("    " + line for line in exit)]
+        case CallDirect():
+            return vm_compile.emit_call_direct(insn, pc)
+        case Ret():
+            return [*vm_compile.emit_ret(), f"if v != {expected}:",
+                    "    pc = v", *("    " + line for line in exit)]
+        case Jump():
+            return []
+        case _:
+            raise Exception(f"Not a branch: {dis(insn)}")
+
+
+def compile_trace(insns: list[Insn], labels: dict[str, int], header: int,
+                  path: list[tuple[int, int]],
+                  fixup: Optional[Callable[[int], int]]) -> Callable:
+    """
+    Compile a recorded iteration, given as (pc, next pc) pairs starting at
+    header and ending with a transfer back to it. The function loops over
+    the iteration while the budget covers a full one and returns the number
+    of instructions executed.
+    """
+    n = len(path)
+    body = [f"if budget < {n}: break", f"budget -= {n}"]
+    for k, (pc, next_pc) in enumerate(path):
+        insn = insns[pc]
+        if isinstance(insn, vm_compile.BLOCK_ENDERS):
+            body.extend(_guard(insn, pc, next_pc, n - k - 1, labels))
+        else:
+            body.extend(vm_compile.emit_straight(insn, fixup is not None,
+                                                 labels))
+    src = [f"def trace_{header}(exe):",
+           *("    " + line for line in vm_compile.PROLOGUE),
+           "    exits = exe.trace_exits",
+           "    start = budget",
+           "    try:",
+           "        while True:",
+           *("            " + line for line in body),
+           "    finally:",
+           *("        " + line for line in vm_compile.EPILOGUE),
+           "    return start - budget"]
+    namespace = dict(vm_compile.GLOBALS)
+    exec(compile("\n".join(src) + "\n", f"<trace {header}>", "exec"),
+         namespace)
+    return namespace[f"trace_{header}"]
+
+
+class TracingExecution(vm.Execution):
+    def __init__(self, *args, hot_loop=HOT_LOOP, max_trace=MAX_TRACE,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        self.hot_loop = hot_loop
+        self.max_trace = max_trace
+        self.traces: dict[int, Trace] = {}
+        self.trace_exits: dict[int, int] = {}
+        self.aborted: set[int] = set()
+        self.counters: dict[int, int] = {}
+
+    def _record(self, header: int) -> Optional[bool]:
+        """
+        Interpret one iteration starting at header, recording it. Returns
+        None if execution continues, otherwise whether it stopped on a Halt
+        (rather than by exhausting the budget).
+        """
+        path: list[tuple[int, int]] = []
+        regs = self.regs
+        while True:
+            pc = regs["PC"]
+            o = self.step()
+            self.max_insns -= 1
+            if o is None or self.max_insns == 0:
+                return o is None
+            path.append((pc, regs["PC"]))
+            if regs["PC"] == header:
+                break
+            if len(path) >= self.max_trace:
+                self.aborted.add(header)
+                return None
+        code = compile_trace(self.insns, self.labels, header, path,
+                             self.int_fixup)
+        self.traces[header] = Trace(header, [pc for pc, _ in path], code)
+        return None
+
+    def _run(self) -> bool:
+        if self.instrumented:
+            return super()._run()
+
+        insns = self.insns
+        regs = self.regs
+        traces = self.traces
+        counters = self.counters
+        while True:
+            pc = regs["PC"]
+            trace = traces.get(pc)
+            if trace is not None and trace.code(self):
+                if self.max_insns <= 0:
+                    return False
+                continue
+            insn = insns[pc]
+            o = self.step()
+            self.max_insns -= 1
+            if o is None or self.max_insns == 0:
+                return o is None
+            target = regs["PC"]
+            if target <= pc and isinstance(insn, BRANCHES) \
+                    and target not in traces and target not in self.aborted:
+                count = counters.get(target, 0) + 1
+                counters[target] = count
+                if count >= self.hot_loop:
+                    halted = self._record(target)
+                    if halted is not None:
+                        return halted
+
+    def dump_engine_stats(self, file=sys.stderr):
+        print(f"trace: {len(self.traces)} trace(s) compiled, "
+              f"{len(self.aborted)} aborted", file=file)
+        for t in self.traces.values():
+            exits = {pc: n for pc, n in self.trace_exits.items()
+                     if pc in t.pcs}
+            print(f"  loop@{t.header}: {len(t.pcs)} insns, "
+                  f"side exits {exits or 'none'}", file=file)
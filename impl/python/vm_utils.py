@@ -1,10 +1,23 @@
+import sys
 from typing import List
 
 import vm
 import vm_insns
+import vm_memory
+import vm_tiered
+import vm_trace
 
+ENGINES = {
+    "interp": vm.Execution,
+    "tiered": vm_tiered.TieredExecution,
+    "trace": vm_trace.TracingExecution,
+}
 
-def invoke_omega(insns, params, verbose):
+
+def invoke_omega(insns, params, verbose,
+                 max_memory=vm_memory.DEFAULT_MAX_WORDS, arith="bigint",
+                 engine="interp", stats=None, wall_time=None,
+                 cpu_time=None) -> vm.RunResult:
     if verbose:
         dump_insns(insns)
 
@@ -16,16 +29,24 @@ def invoke_omega(insns, params, verbose):
             raise Exception(f"Invalid argument: {arg}")
 
     stack: List[int] = []
-    memory: List[int] = params + [0] * 100000
+    memory = vm_memory.for_arith(arith, params, max_words=max_memory)
     regs = {
         "PC": 0,
         "FP": 0,
         "SP": len(params) + 1,
     }
-    exe = vm.Execution(insns, stack, memory, regs)
+    exe = ENGINES[engine](insns, stack, memory, regs, arith=arith,
+                          collect_stats=stats is not None,
+                          wall_time=wall_time, cpu_time=cpu_time)
     exe.verbose = verbose
-    exe.run()
+    result = exe.run()
+    if stats:
+        exe.stats.report(exe, stats)
+    if not result.halted:
+        print(f"VM {result}", file=sys.stderr)
+        return result
     assert exe.regs["SP"] == len(params) + 1
+    return result
 
 
 def dump_insns(insns):
@@ -0,0 +1,291 @@
+"""
+Load-time verifier for linked VM programs.
+
+Abstractly interprets every function over its control-flow graph to prove
+that the eval-stack depth is the same on every path into an instruction
+and that no instruction pops more than is on the stack. The stack effects
+are the ones drawn in the vm_insns docstrings.
+
+Calling convention assumed (the one codegen and the hand-written examples
+follow): `Call` enters the callee with only the return address on the
+eval stack, and the callee returns via `JumpIndirect` with only the return
+address on the stack and every SaveEvalStack matched by a
+RestoreEvalStack. Seen from the caller, `Call` therefore just pops its
+destination. `CallDirect` enters its callee with an empty eval stack, the
+callee returns via `Ret` with an empty stack, and seen from the caller the
+arguments are replaced by the return value.
+"""
+from typing import NamedTuple, Optional, Union
+
+from vm_insns import *
+
+# Abstract stack value: a label name pushed by PushLabel, RETADDR for the
+# return address pushed by Call, or None for any other (unknown) integer.
+RETADDR = ("retaddr",)
+AbsValue = Union[str, tuple, None]
+
+# Insn type -> (words popped, words pushed) for the insns whose only effect
+# on the abstract state is on its depth.
+STACK_EFFECTS: dict[type, tuple[int, int]] = {
+    Label: (0, 0),
+    Noop: (0, 0),
+    Jump: (0, 0),
+    JumpIfZero: (1, 0),
+    JumpIfNotZero: (1, 0),
+    JumpIfLess: (2, 0),
+    JumpIfLessEq: (2, 0),
+    JumpIfGreater: (2, 0),
+    JumpIfGreaterEq: (2, 0),
+    JumpIfEq: (2, 0),
+    JumpIfNotEq: (2, 0),
+    PushImmediate: (0, 1),
+    Add: (2, 1),
+    Sub: (2, 1),
+    Mul: (2, 1),
+    Div: (2, 1),
+    AddImm: (1, 1),
+    SubImm: (1, 1),
+    MulImm: (1, 1),
+    Negate: (1, 1),
+    LessThan: (2, 1),
+    GreaterThan: (2, 1),
+    LessThanEqual: (2, 1),
+    GreaterThanEqual: (2, 1),
+    Equal: (2, 1),
+    NotEqual: (2, 1),
+    LessThanImm: (1, 1),
+    GreaterThanImm: (1, 1),
+    LessThanEqualImm: (1, 1),
+    GreaterThanEqualImm: (1, 1),
+    EqualImm: (1, 1),
+    NotEqualImm: (1, 1),
+    Not: (1, 1),
+    Load: (1, 1),
+    Store: (2, 0),
+    LoadLocal: (0, 1),
+    StoreLocal: (1, 0),
+    Print: (1, 0),
+    PushFP: (0, 1),
+    PopFP: (1, 0),
+    PushSP: (0, 1),
+    PopSP: (1, 0),
+    Pop: (1, 0),
+    AllocZero: (0, 0),
+}
+
+
+class VerifyError(Exception):
+    def __init__(self, pc: int, reason: str):
+        super().__init__(f"[{pc}] {reason}")
+        self.pc = pc
+        self.reason = reason
+
+
+class State(NamedTuple):
+    stack: tuple[AbsValue, ...]
+    saved: tuple[int, ...]   # depths stashed by unmatched SaveEvalStack
+
+    def join(self, other: "State", pc: int) -> "State":
+        if len(self.stack) != len(other.stack):
+            raise VerifyError(
+                pc, f"inconsistent stack depth: {len(self.stack)} "
+                f"vs {len(other.stack)}")
+        if self.saved != other.saved:
+            raise VerifyError(
+                pc, f"inconsistent saved eval stacks: {self.saved} "
+                f"vs {other.saved}")
+        return State(tuple(a if a == b else None
+                           for a, b in zip(self.stack, other.stack)),
+                     self.saved)
+
+
+class FunctionInfo(NamedTuple):
+    name: str
+    entry: int
+    max_depth: int
+    pcs: frozenset[int]
+    # pc -> eval stack words the CallDirect (below its arguments),
+    # SaveEvalStack or RestoreEvalStack there saves or restores
+    spills: dict[int, int]
+
+
+class VerifiedProgram(NamedTuple):
+    functions: dict[str, FunctionInfo]
+
+    @property
+    def max_depth(self) -> int:
+        return max((f.max_depth for f in self.functions.values()), default=0)
+
+    def function_at(self, pc: int) -> Optional[FunctionInfo]:
+        for f in self.functions.values():
+            if pc in f.pcs:
+                return f
+        return None
+
+
+def link_labels(insns: list[Insn]) -> dict[str, int]:
+    labels: dict[str, int] = {}
+    for i, insn in enumerate(insns):
+        if isinstance(insn, Label):
+            if insn.label in labels:
+                raise VerifyError(i, f"duplicate label {insn.label!r}")
+            labels[insn.label] = i
+    for i, insn in enumerate(insns):
+        lab = getattr(insn, "label", None)
+        if lab is not None and lab not in labels:
+            raise VerifyError(i, f"undefined label {lab!r}")
+    return labels
+
+
+def _pop(state: State, n: int, pc: int, insn: Insn) \
+        -> tuple[tuple[AbsValue, ...], tuple[AbsValue, ...]]:
+    if len(state.stack) < n:
+        raise VerifyError(
+            pc, f"stack underflow: {dis(insn)} pops {n}, "
+            f"depth is {len(state.stack)}")
+    split = len(state.stack) - n
+    return state.stack[:split], state.stack[split:]
+
+
+def _step(insns: list[Insn], labels: dict[str, int], pc: int, state: State,
+          callees: dict[str, State]) -> list[tuple[int, State]]:
+    """
+    Successors of pc as (pc, state) pairs. Called functions are added to
+    callees with the state they are entered with.
+    """
+    insn = insns[pc]
+    effect = STACK_EFFECTS.get(type(insn))
+    if effect is not None:
+        rest, _ = _pop(state, effect[0], pc, insn)
+        out = State(rest + (None,) * effect[1], state.saved)
+        if isinstance(insn, Jump):
+            return [(labels[insn.label], out)]
+        if isinstance(insn, BRANCHES):
+            return [(labels[insn.label], out), (pc + 1, out)]
+        return [(pc + 1, out)]
+
+    match insn:
+        case PushLabel(label=label):
+            return [(pc + 1, State(state.stack + (label,), state.saved))]
+        case PopN(n=n):
+            rest, _ = _pop(state, n, pc, insn)
+            return [(pc + 1, State(rest, state.saved))]
+        case Swap():
+            rest, (x, y) = _pop(state, 2, pc, insn)
+            return [(pc + 1, State(rest + (y, x), state.saved))]
+        case Dup():
+            rest, (x,) = _pop(state, 1, pc, insn)
+            return [(pc + 1, State(rest + (x, x), state.saved))]
+        case Over():
+            rest, (x, y) = _pop(state, 2, pc, insn)
+            return [(pc + 1, State(rest + (x, y, x), state.saved))]
+        case Rot():
+            rest, (x, y, z) = _pop(state, 3, pc, insn)
+            return [(pc + 1, State(rest + (y, z, x), state.saved))]
+        case Call():
+            rest, (dest,) = _pop(state, 1, pc, insn)
+            if isinstance(dest, str):
+                callees[dest] = State((RETADDR,), ())
+            return [(pc + 1, State(rest, state.saved))]
+        case CallDirect(label=label, argc=argc):
+            rest, _ = _pop(state, argc, pc, insn)
+            callees[label] = State((), ())
+            return [(pc + 1, State(rest + (None,), state.saved))]
+        case Ret():
+            if state.stack or state.saved:
+                raise VerifyError(
+                    pc, f"Ret with {len(state.stack)} word(s) on the stack"
+                    f" and {len(state.saved)} unrestored eval stack(s)")
+            return []
+        case JumpIndirect():
+            rest, (dest,) = _pop(state, 1, pc, insn)
+            if isinstance(dest, str):
+                return [(labels[dest], State(rest, state.saved))]
+            if rest or state.saved:
+                raise VerifyError(
+                    pc, f"return with {len(rest)} extra word(s) on the stack"
+                    f" and {len(state.saved)} unrestored eval stack(s)")
+            return []
+        case SaveEvalStack():
+            return [(pc + 1, State((), state.saved + (len(state.stack),)))]
+        case RestoreEvalStack():
+            if not state.saved:
+                raise VerifyError(
+                    pc, "RestoreEvalStack without matching SaveEvalStack")
+            depth = state.saved[-1]
+            return [(pc + 1, State((None,) * depth + state.stack,
+                                   state.saved[:-1]))]
+        case Halt():
+            return []
+        case _:
+            raise VerifyError(pc, f"unknown instruction: {insn}")
+
+
+def _function(insns: list[Insn], labels: dict[str, int], name: str,
+              entry: int, entry_state: State, callees: dict[str, State]) \
+        -> FunctionInfo:
+    states: dict[int, State] = {entry: entry_state}
+    work = [entry]
+    max_depth = len(entry_state.stack)
+    while work:
+        pc = work.pop()
+        for succ, state in _step(insns, labels, pc, states[pc], callees):
+            if succ >= len(insns):
+                raise VerifyError(pc, "execution falls off end of program")
+            max_depth = max(max_depth, len(state.stack))
+            old = states.get(succ)
+            if old is not None:
+                joined = old.join(state, succ)
+                if joined == old:
+                    continue
+                state = joined
+            states[succ] = state
+            work.append(succ)
+    return FunctionInfo(name, entry, max_depth, frozenset(states),
+                        _spills(insns, states))
+
+
+def _spills(insns: list[Insn], states: dict[int, State]) -> dict[int, int]:
+    spills: dict[int, int] = {}
+    for pc, state in states.items():
+        match insns[pc]:
+            case CallDirect(argc=argc):
+                spills[pc] = len(state.stack) - argc
+            case SaveEvalStack():
+                spills[pc] = len(state.stack)
+            case RestoreEvalStack():
+                spills[pc] = state.saved[-1]
+    return spills
+
+
+def verify(insns: list[Insn]) -> VerifiedProgram:
+    """
+    Verify a linked program, raising VerifyError with the offending PC.
+
+    Functions are the top level (entry at PC 0) and every label that is
+    called or whose address escapes via PushLabel without being used as a
+    local JumpIndirect target.
+    """
+    labels = link_labels(insns)
+    functions: dict[str, FunctionInfo] = {}
+
+    def analyze(name: str, entry: int, entry_state: State):
+        pending = [(name, entry, entry_state)]
+        while pending:
+            name, entry, entry_state = pending.pop()
+            if name in functions or any(
+                    entry in f.pcs for f in functions.values()):
+                continue
+            callees: dict[str, State] = {}
+            functions[name] = _function(
+                insns, labels, name, entry, entry_state, callees)
+            pending.extend((callee, labels[callee], callees[callee])
+                           for callee in sorted(callees, reverse=True))
+
+    if not insns:
+        raise VerifyError(0, "execution falls off end of program")
+    analyze(TOPLEVEL, 0, State((), ()))
+    for insn in insns:
+        if isinstance(insn, PushLabel):
+            analyze(insn.label, labels[insn.label], State((RETADDR,), ()))
+    return VerifiedProgram(functions)
@@ -8,6 +8,12 @@ import vm_scanner
 import vm_insns
 import vm_utils
 import vm
+import vm_memory
+import vm_arith
+import vm_verify
+import vm_cfg
+import vm_record
+import sys
 
 
 def get_args():
@@ -16,6 +22,45 @@ def get_args():
     ap.add_argument("--file", type=str, required=True, help="The file to run")
     ap.add_argument("--verbose", action="store_true", help="verbose output")
     ap.add_argument("--debug-step", action="store_true", help="debug with step")
+    ap.add_argument("--max-memory", type=int,
+                    default=vm_memory.DEFAULT_MAX_WORDS,
+                    help="Maximum VM memory in words")
+    ap.add_argument("--arith", choices=sorted(vm_arith.ARITH_MODES),
+                    default="bigint",
+                    help="Integer semantics: arbitrary precision, or int64 "
+                    "that wraps or traps on overflow")
+    ap.add_argument("--max-insns", type=int, default=1_000_000_000,
+                    metavar="N", help="Stop after N instructions")
+    ap.add_argument("--timeout", type=float, metavar="SECONDS",
+                    help="Stop after this much wall-clock time")
+    ap.add_argument("--cpu-time", type=float, metavar="SECONDS",
+                    help="Stop after this much CPU time")
+    ap.add_argument("--repeat", type=int, default=1, metavar="N",
+                    help="Run the program N times, resetting the VM between "
+                    "runs; stats are those of the last run")
+    ap.add_argument("--verify", action="store_true",
+                    help="Reject programs whose stack usage can't be proven "
+                    "consistent before running them")
+    ap.add_argument("--simplify-cfg", action="store_true",
+                    help="Thread jumps and remove unreachable code before "
+                    "running")
+    ap.add_argument("--engine", choices=sorted(vm_utils.ENGINES),
+                    default="interp", help="Execution engine")
+    ap.add_argument("--engine-stats", action="store_true",
+                    help="Report what the tiered/trace engines compiled")
+    ap.add_argument("--stats", nargs="?", const="text",
+                    choices=["text", "json"],
+                    help="Report instruction and resource counts to stderr")
+    ap.add_argument("--record", type=str, metavar="FILE",
+                    help="Record the run's inputs and checkpoints to FILE")
+    ap.add_argument("--checkpoint-every", type=int,
+                    default=vm_record.CHECKPOINT_EVERY, metavar="N",
+                    help="Instructions between checkpoints when recording")
+    ap.add_argument("--replay", type=str, metavar="FILE",
+                    help="Replay a run recorded with --record")
+    ap.add_argument("--replay-to", type=int, metavar="N",
+                    help="Stop the replay after N instructions and dump the "
+                    "VM state; continues verbosely with --verbose")
     return ap.parse_args()
 
 
@@ -32,16 +77,75 @@ def main():
     if args.verbose:
         vm_utils.dump_insns(insns)
 
-    params = list(reversed(args.args)) + [0]  # w/ space for return value
-    exe = vm.Execution(
-        insns,
-        [],
-        params + [0] * 100000,
-        {"SP": len(params)},
-    )
-    exe.verbose = args.verbose
-    exe.debug_step = args.debug_step
-    exe.run()
+    if args.simplify_cfg:
+        try:
+            insns = vm_cfg.simplify(insns)
+        except vm_verify.VerifyError as e:
+            print(f"Bad program at {e.pc}: {e.reason}", file=sys.stderr)
+            sys.exit(1)
+        if args.verbose:
+            vm_utils.dump_insns(insns)
+
+    if args.verify:
+        try:
+            verified = vm_verify.verify(insns)
+        except vm_verify.VerifyError as e:
+            print(f"Verification failed at {e.pc}: {e.reason}",
+                  file=sys.stderr)
+            sys.exit(1)
+        if args.verbose:
+            for f in verified.functions.values():
+                print(f"Verified {f.name}: max stack depth {f.max_depth}")
+
+    engine = vm_utils.ENGINES[args.engine]
+    limits = dict(wall_time=args.timeout, cpu_time=args.cpu_time)
+    result = None
+    if args.replay:
+        try:
+            exe, executed = vm_record.replay(
+                insns, args.replay, args.replay_to, engine=engine,
+                max_insns=args.max_insns,
+                collect_stats=args.stats is not None, **limits)
+        except vm_record.RecordingError as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        if args.replay_to is not None:
+            print(f"Replayed {executed} instructions")
+            exe.dump_state()
+            if args.verbose:
+                exe.verbose = True
+                exe.debug_step = args.debug_step
+                result = exe.run()
+    else:
+        params = list(reversed(args.args)) + [0]  # w/ space for return value
+        exe = engine(
+            insns,
+            [],
+            vm_memory.for_arith(args.arith, params,
+                                max_words=args.max_memory),
+            {"SP": len(params)},
+            arith=args.arith,
+            max_insns=args.max_insns,
+            collect_stats=args.stats is not None,
+            **limits,
+        )
+        exe.verbose = args.verbose
+        exe.debug_step = args.debug_step
+        if args.record:
+            result = vm_record.record(exe, args.record,
+                                      args.checkpoint_every)
+        else:
+            result = exe.run()
+            for _ in range(args.repeat - 1):
+                exe.reset(args.args)
+                result = exe.run()
+    if args.stats:
+        exe.stats.report(exe, args.stats)
+    if args.engine_stats and hasattr(exe, "dump_engine_stats"):
+        exe.dump_engine_stats()
+    if result is not None and not result.halted:
+        print(f"VM {result}", file=sys.stderr)
+        sys.exit(2)
 
 
 if __name__ == "__main__":